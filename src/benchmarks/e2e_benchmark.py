@@ -0,0 +1,296 @@
+"""
+Offline End-to-End Benchmark
+Runs the blob trigger (or the processor modules directly) over a synthetic corpus against
+local fake Document Intelligence, Vision, OpenAI and Cosmos DB services
+
+Usage: python benchmarks/e2e_benchmark.py [--docs 40] [--concurrency 4] [--mode trigger|async-trigger|modules]
+           [--mix small=0.5,medium=0.3,large=0.15,xlarge=0.05] [--profile profiles.json] [--latency-scale 0.1]
+           [--throttle-rate 0.02] [--error-rate 0.01] [--output results.json]
+           [--baseline previous.json --max-regression 0.1]
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_services import DEFAULT_PROFILES, service_environment, start_fake_services  # noqa: E402
+from benchmarks.synthetic_corpus import DEFAULT_MIX, build_corpus  # noqa: E402
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Run with caches and checkpoints off so every document exercises every service
+BENCHMARK_ENVIRONMENT = {
+    "PIPELINE_MODE": "offline-benchmark",
+    "RESULT_CACHE_BACKEND": "none",
+    "CHECKPOINT_BACKEND": "none",
+    "DOCUMENT_SUBMISSION_MODE": "bytes",
+    "TRACE_EXPORT": "none",
+    "LOG_DETAIL_LEVEL": "summary"
+}
+
+
+class FakeInputStream(io.BytesIO):
+    """Stands in for azure.functions.InputStream"""
+
+    def __init__(self, name, data):
+        super().__init__(data)
+        self.name = name
+        self.length = len(data)
+        self.uri = f"http://127.0.0.1/{name}"
+        self.blob_properties = {"ETag": f"\"{uuid.uuid4()}\""}
+
+
+class TraceCollector:
+    """Keeps the per-span totals of every finished invocation trace"""
+
+    def __init__(self):
+        self.invocations = []
+        self._lock = threading.Lock()
+
+    def __call__(self, trace):
+        metrics = trace.stage_metrics()
+        with self._lock:
+            self.invocations.append(metrics)
+
+    def percentiles(self):
+        """Return p50/p95/p99 of each span's per-invocation total duration"""
+        durations = {}
+        with self._lock:
+            for metrics in self.invocations:
+                for name, entry in metrics.items():
+                    durations.setdefault(name, []).append(entry["duration_ms"])
+        return {
+            name: {
+                "count": len(values),
+                "p50_ms": percentile(values, 50),
+                "p95_ms": percentile(values, 95),
+                "p99_ms": percentile(values, 99)
+            }
+            for name, values in sorted(durations.items())
+        }
+
+
+def percentile(values, rank):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = max(0, min(len(ordered) - 1, int(round(rank / 100.0 * len(ordered) + 0.5)) - 1))
+    return round(ordered[index], 3)
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MiB (None where unsupported)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def parse_mix(text):
+    """Parse "small=0.5,medium=0.5" into a dict"""
+    if not text:
+        return DEFAULT_MIX
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def build_profiles(args):
+    """Merge the default service profiles with a profile file and command-line overrides"""
+    overrides = {}
+    if args.profile:
+        with open(args.profile, "r", encoding="utf-8") as profile_file:
+            overrides = json.load(profile_file)
+    profiles = {}
+    for name, defaults in DEFAULT_PROFILES.items():
+        profile = dict(defaults, **overrides.get(name, {}))
+        profile["median_ms"] *= args.latency_scale
+        profile["p95_ms"] *= args.latency_scale
+        if args.throttle_rate is not None:
+            profile["throttle_rate"] = args.throttle_rate
+        if args.error_rate is not None:
+            profile["error_rate"] = args.error_rate
+        profiles[name] = profile
+    return profiles
+
+
+def run_modules_pipeline(document):
+    """Run the processor modules directly, one stage after another, for one document"""
+    from modules.clients.client_registry import (
+        get_cosmos_client,
+        get_form_recognizer_client,
+        get_openai_client,
+        get_vision_client
+    )
+    from modules.processors.document_intelligence import analyze_pdf_layout
+    from modules.processors.llm_processing import analyze_layout_with_llm
+    from modules.processors.page_rasterizer import rasterize_pdf_pages
+    from modules.processors.vision_processing import analyze_pages_with_vision
+    from modules.storage.cosmos_manager import get_container, prepare_document_for_storage, store_document
+    from modules.utils.tracing import finish_trace, span, start_trace
+
+    start_trace(document.name, mode="modules")
+    with span("stage.document_intelligence"):
+        layout_data = analyze_pdf_layout(get_form_recognizer_client(), document.pdf_bytes)
+    with span("stage.vision"):
+        vision_config, vision_session = get_vision_client()
+        page_images = rasterize_pdf_pages(document.pdf_bytes)
+        layout_data["vision_analysis"] = analyze_pages_with_vision(page_images, vision_config, session=vision_session)
+    with span("stage.llm"):
+        layout_data["llm_analysis"] = analyze_layout_with_llm(
+            get_openai_client(), layout_data, deployment_name=os.getenv("AZURE_OPENAI_GPT4_DEPLOYMENT")
+        )
+    with span("stage.output_and_storage"):
+        cosmos_client = get_cosmos_client(os.getenv("COSMOS_DB_ENDPOINT"), os.getenv("COSMOS_DB_KEY"))
+        container = get_container(cosmos_client, "DocumentAnalysisDB", "ProcessedDocuments")
+        store_document(container, prepare_document_for_storage(layout_data, document.name))
+    finish_trace()
+
+
+def run_documents(mode, corpus, concurrency):
+    """Process the corpus and return (wall seconds, failures)"""
+    import function_app
+
+    failures = Counter()
+
+    if mode == "async-trigger":
+        async def run_all():
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def run_one(document):
+                async with semaphore:
+                    try:
+                        await function_app.BlobTriggerPDFsMultiLayoutsAIDocIntelligenceAsync(
+                            FakeInputStream(document.name, document.pdf_bytes)
+                        )
+                    except Exception as e:
+                        failures[type(e).__name__] += 1
+
+            await asyncio.gather(*(run_one(document) for document in corpus))
+
+        start = time.perf_counter()
+        asyncio.run(run_all())
+        return time.perf_counter() - start, failures
+
+    if mode == "trigger":
+        def process(document):
+            function_app.BlobTriggerPDFsMultiLayoutsAIDocIntelligence(FakeInputStream(document.name, document.pdf_bytes))
+    else:
+        process = run_modules_pipeline
+
+    def run_one(document):
+        try:
+            process(document)
+        except Exception as e:
+            failures[type(e).__name__] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="benchmark-doc") as executor:
+        list(executor.map(run_one, corpus))
+    return time.perf_counter() - start, failures
+
+
+def compare_with_baseline(report, baseline, max_regression):
+    """Return a list of regressions beyond the allowed fraction"""
+    regressions = []
+    if report["docs_per_second"] < baseline["docs_per_second"] * (1 - max_regression):
+        regressions.append(
+            f"throughput {report['docs_per_second']:.3f} docs/s vs baseline {baseline['docs_per_second']:.3f}"
+        )
+    for name, stats in report["stages"].items():
+        previous = baseline.get("stages", {}).get(name)
+        if previous and previous["p95_ms"] and stats["p95_ms"] > previous["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{name} p95 {stats['p95_ms']:.1f} ms vs baseline {previous['p95_ms']:.1f} ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark against fake Azure services")
+    parser.add_argument("--docs", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--mode", choices=("trigger", "async-trigger", "modules"), default="trigger")
+    parser.add_argument("--mix", help="size mix, e.g. small=0.5,medium=0.3,large=0.15,xlarge=0.05")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--padding-bytes", type=int, default=0, help="extra bytes per PDF to raise upload sizes")
+    parser.add_argument("--profile", help="JSON file overriding service profiles, keyed by service name")
+    parser.add_argument("--latency-scale", type=float, default=1.0, help="multiplier for every latency distribution")
+    parser.add_argument("--throttle-rate", type=float, help="429 rate applied to every service")
+    parser.add_argument("--error-rate", type=float, help="500 rate applied to every service")
+    parser.add_argument("--output", help="write the JSON report to this path")
+    parser.add_argument("--baseline", help="previous JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(levelname)s %(message)s")
+    services = start_fake_services(build_profiles(args))
+    os.environ.update(BENCHMARK_ENVIRONMENT)
+    os.environ.update(service_environment(services))
+
+    from modules.utils.tracing import add_trace_listener
+
+    collector = TraceCollector()
+    add_trace_listener(collector)
+    corpus = build_corpus(args.docs, parse_mix(args.mix), args.seed, args.padding_bytes)
+
+    try:
+        wall_seconds, failures = run_documents(args.mode, corpus, args.concurrency)
+    finally:
+        for service in services.values():
+            service.stop()
+
+    report = {
+        "mode": args.mode,
+        "documents": len(corpus),
+        "corpus": dict(Counter(document.size_class for document in corpus)),
+        "concurrency": args.concurrency,
+        "failures": dict(failures),
+        "wall_seconds": round(wall_seconds, 3),
+        "docs_per_second": round(len(corpus) / wall_seconds, 3) if wall_seconds else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": collector.percentiles(),
+        "services": {name: service.stats() for name, service in services.items()}
+    }
+
+    print(f"{report['documents']} documents ({report['corpus']}) in {report['wall_seconds']}s, mode={args.mode}, "
+          f"concurrency={args.concurrency}")
+    print(f"Throughput: {report['docs_per_second']} docs/s   Peak RSS: {report['peak_rss_mb']} MiB   "
+          f"Failures: {report['failures'] or 0}")
+    print(f"{'span':<36}{'count':>7}{'p50 ms':>12}{'p95 ms':>12}{'p99 ms':>12}")
+    for name, stats in report["stages"].items():
+        print(f"{name:<36}{stats['count']:>7}{stats['p50_ms']:>12.1f}{stats['p95_ms']:>12.1f}{stats['p99_ms']:>12.1f}")
+    print(f"Fake services: {report['services']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as baseline_file:
+            regressions = compare_with_baseline(report, json.load(baseline_file), args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
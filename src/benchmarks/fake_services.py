@@ -0,0 +1,445 @@
+"""
+Fake Azure Services
+Local HTTP stand-ins for Document Intelligence, AI Vision, Azure OpenAI and Cosmos DB
+with configurable latency distributions, error/429 rates and payload sizes
+"""
+
+import base64
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.synthetic_corpus import build_analyze_result, parse_spec
+
+
+FAKE_COSMOS_KEY = base64.b64encode(b"offline-benchmark-cosmos-key").decode("ascii")
+
+# service: latency median/p95 in ms, error rate, 429 rate, Retry-After seconds, payload scale
+DEFAULT_PROFILES = {
+    "document_intelligence": {"median_ms": 1200, "p95_ms": 4000, "error_rate": 0.0, "throttle_rate": 0.0, "retry_after": 1, "payload_scale": 1},
+    "vision": {"median_ms": 400, "p95_ms": 1200, "error_rate": 0.0, "throttle_rate": 0.0, "retry_after": 1, "payload_scale": 1},
+    "openai": {"median_ms": 2500, "p95_ms": 8000, "error_rate": 0.0, "throttle_rate": 0.0, "retry_after": 2, "payload_scale": 1},
+    "cosmos": {"median_ms": 8, "p95_ms": 30, "error_rate": 0.0, "throttle_rate": 0.0, "retry_after": 0.1, "payload_scale": 1}
+}
+
+
+class ServiceProfile:
+    """Latency (log-normal from median and p95), failure injection and payload size for one fake service"""
+
+    def __init__(self, median_ms, p95_ms, error_rate=0.0, throttle_rate=0.0, retry_after=1, payload_scale=1, seed=None):
+        self.median_ms = median_ms
+        self.p95_ms = max(p95_ms, median_ms)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.payload_scale = payload_scale
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_latency(self):
+        """Draw a latency in seconds"""
+        if self.median_ms <= 0:
+            return 0.0
+        sigma = math.log(self.p95_ms / self.median_ms) / 1.645 if self.p95_ms > self.median_ms else 0.0
+        with self._lock:
+            return self._rng.lognormvariate(math.log(self.median_ms), sigma) / 1000.0
+
+    def sample_failure(self):
+        """Return 429, 500 or None for this request"""
+        with self._lock:
+            draw = self._rng.random()
+        if draw < self.throttle_rate:
+            return 429
+        if draw < self.throttle_rate + self.error_rate:
+            return 500
+        return None
+
+
+class FakeServiceHandler(BaseHTTPRequestHandler):
+    """Routes requests to the owning FakeService"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        self.server.service.handle(self, body)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _dispatch
+
+
+class FakeService:
+    """Base class: a threaded HTTP server on 127.0.0.1 with request and failure counters"""
+
+    name = "service"
+
+    def __init__(self, profile):
+        self.profile = profile
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self._counter_lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), FakeServiceHandler)
+        self._server.daemon_threads = True
+        self._server.service = self
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"fake-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def stats(self):
+        with self._counter_lock:
+            return {"requests": self.requests, "throttled": self.throttled, "errors": self.errors}
+
+    def send_json(self, handler, status, payload, headers=None):
+        data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            handler.send_header(key, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def handle(self, handler, body):
+        """Apply failure injection and latency, then route"""
+        with self._counter_lock:
+            self.requests += 1
+        failure = self.profile.sample_failure() if self.injects_failures(handler) else None
+        if failure == 429:
+            with self._counter_lock:
+                self.throttled += 1
+            retry_after = self.profile.retry_after
+            self.send_json(handler, 429, {"error": {"code": "429", "message": "Rate limit exceeded"}}, {
+                "Retry-After": str(max(1, math.ceil(retry_after))),
+                "retry-after-ms": str(int(retry_after * 1000)),
+                "x-ms-retry-after-ms": str(int(retry_after * 1000))
+            })
+            return
+        if failure == 500:
+            with self._counter_lock:
+                self.errors += 1
+            self.send_json(handler, 500, {"error": {"code": "InternalServerError", "message": "Injected failure"}})
+            return
+        latency = self.latency_for(handler)
+        if latency:
+            time.sleep(latency)
+        self.route(handler, body)
+
+    def injects_failures(self, handler):
+        return True
+
+    def latency_for(self, handler):
+        return self.profile.sample_latency()
+
+    def route(self, handler, body):
+        raise NotImplementedError
+
+
+class FakeDocumentIntelligence(FakeService):
+    """Long-running analyze operations: POST returns 202 + Operation-Location, GET polls until the sampled latency passed"""
+
+    name = "document_intelligence"
+    ANALYZE_PATH = re.compile(r"^/(?:formrecognizer|documentintelligence)/documentModels/([^/:]+):analyze$")
+    RESULT_PATH = re.compile(r"^/(?:formrecognizer|documentintelligence)/documentModels/([^/]+)/analyzeResults/([^/]+)$")
+
+    def __init__(self, profile):
+        super().__init__(profile)
+        self._operations = {}
+        self._operations_lock = threading.Lock()
+
+    def injects_failures(self, handler):
+        # Failures are injected on submission only, like service-side throttling of new analyses
+        return handler.command == "POST"
+
+    def latency_for(self, handler):
+        # Submission is fast; the analysis latency is spent while the client polls
+        return min(0.05, self.profile.sample_latency())
+
+    def route(self, handler, body):
+        url = urlparse(handler.path)
+        query = parse_qs(url.query)
+        api_version = query.get("api-version", ["2023-07-31"])[0]
+
+        analyze = self.ANALYZE_PATH.match(url.path)
+        if analyze and handler.command == "POST":
+            model_id = analyze.group(1)
+            if handler.headers.get("Content-Type", "").startswith("application/json"):
+                source = json.loads(body or b"{}")
+                size_class, seed = parse_spec(str(source.get("urlSource", "")).encode("utf-8"))
+            else:
+                size_class, seed = parse_spec(body)
+            result_id = str(uuid.uuid4())
+            with self._operations_lock:
+                self._operations[result_id] = {
+                    "ready_at": time.monotonic() + self.profile.sample_latency(),
+                    "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                    "result": (size_class, seed, query.get("pages", [None])[0], api_version, model_id)
+                }
+            location = f"{self.endpoint}{url.path.rsplit(':', 1)[0]}/analyzeResults/{result_id}?api-version={api_version}"
+            self.send_json(handler, 202, b"", {"Operation-Location": location, "apim-request-id": result_id})
+            return
+
+        result = self.RESULT_PATH.match(url.path)
+        if result and handler.command == "GET":
+            with self._operations_lock:
+                operation = self._operations.get(result.group(2))
+            if operation is None:
+                self.send_json(handler, 404, {"error": {"code": "NotFound", "message": "Unknown operation"}})
+                return
+            remaining = operation["ready_at"] - time.monotonic()
+            status = {"createdDateTime": operation["created"], "lastUpdatedDateTime": operation["created"]}
+            if remaining > 0:
+                status["status"] = "running"
+                self.send_json(handler, 200, status, {"retry-after-ms": str(max(10, int(min(remaining, 1.0) * 1000)))})
+                return
+            with self._operations_lock:
+                self._operations.pop(result.group(2), None)
+            size_class, seed, pages, version, model_id = operation["result"]
+            status["status"] = "succeeded"
+            status["analyzeResult"] = build_analyze_result(size_class, seed, pages, version, model_id)
+            self.send_json(handler, 200, status)
+            return
+
+        self.send_json(handler, 404, {"error": {"code": "NotFound", "message": handler.path}})
+
+
+class FakeVision(FakeService):
+    """Image Analysis 4.0: returns a read result whose size follows payload_scale"""
+
+    name = "vision"
+
+    def route(self, handler, body):
+        url = urlparse(handler.path)
+        if not url.path.endswith("/computervision/imageanalysis:analyze"):
+            self.send_json(handler, 404, {"error": {"code": "NotFound", "message": handler.path}})
+            return
+        version = parse_qs(url.query).get("api-version", ["2023-10-01"])[0]
+        line_count = 40 * max(1, int(self.profile.payload_scale))
+        self.send_json(handler, 200, {
+            "modelVersion": version,
+            "metadata": {"width": 1700, "height": 2200},
+            "captionResult": {"text": "a document with a table", "confidence": 0.71},
+            "readResult": {"blocks": [{"lines": [
+                {
+                    "text": f"Synthetic vision line {index}",
+                    "boundingPolygon": [{"x": 10, "y": 20 * index}, {"x": 600, "y": 20 * index}],
+                    "words": [{"text": "Synthetic", "confidence": 0.99}]
+                }
+                for index in range(line_count)
+            ]}]}
+        })
+
+
+class FakeOpenAI(FakeService):
+    """Chat completions with usage figures derived from the request size"""
+
+    name = "openai"
+
+    def route(self, handler, body):
+        url = urlparse(handler.path)
+        if not url.path.endswith("/chat/completions"):
+            self.send_json(handler, 404, {"error": {"code": "NotFound", "message": handler.path}})
+            return
+        request = json.loads(body or b"{}")
+        prompt_tokens = max(1, len(body) // 4)
+        items = [
+            {"description": f"line item {index}", "quantity": index % 7 + 1, "amount": round(index * 12.5, 2)}
+            for index in range(10 * max(1, int(self.profile.payload_scale)))
+        ]
+        content = "```json\n" + json.dumps({"document_type": "invoice", "line_items": items, "total": 1234.5}) + "\n```"
+        self.send_json(handler, 200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "gpt-4"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 4,
+                      "total_tokens": prompt_tokens + len(content) // 4}
+        })
+
+
+class FakeCosmos(FakeService):
+    """
+    In-memory Cosmos DB REST surface used by the pipeline: account discovery, databases,
+    containers, partition key ranges and point operations on items (create, upsert, read,
+    replace, delete). Request charges are reported from the item size.
+    """
+
+    name = "cosmos"
+
+    def __init__(self, profile):
+        super().__init__(profile)
+        self._databases = {}
+        self._store_lock = threading.Lock()
+
+    def injects_failures(self, handler):
+        return "/docs" in handler.path
+
+    def _system_fields(self, resource, path):
+        resource.update({
+            "_rid": base64.b64encode(uuid.uuid4().bytes[:8]).decode("ascii"),
+            "_self": path,
+            "_etag": f"\"{uuid.uuid4()}\"",
+            "_ts": int(time.time())
+        })
+        return resource
+
+    def _send(self, handler, status, payload, charge=1.0):
+        self.send_json(handler, status, payload, {
+            "x-ms-request-charge": f"{charge:.2f}",
+            "x-ms-session-token": "0:1#1",
+            "x-ms-activity-id": str(uuid.uuid4()),
+            "etag": payload.get("_etag", "") if isinstance(payload, dict) else ""
+        })
+
+    def _not_found(self, handler):
+        self._send(handler, 404, {"code": "NotFound", "message": "Resource not found"})
+
+    def route(self, handler, body):
+        parts = [part for part in urlparse(handler.path).path.split("/") if part]
+        method = handler.command
+        document = json.loads(body) if body and not handler.headers.get("Content-Type", "").startswith("application/query") else {}
+
+        if not parts:
+            self._send(handler, 200, {
+                "id": "offline-benchmark",
+                "_rid": "offline-benchmark.documents.azure.com",
+                "_self": "",
+                "media": "//media/",
+                "addresses": "//addresses/",
+                "_dbs": "//dbs/",
+                "writableLocations": [{"name": "Local", "databaseAccountEndpoint": self.endpoint + "/"}],
+                "readableLocations": [{"name": "Local", "databaseAccountEndpoint": self.endpoint + "/"}],
+                "enableMultipleWriteLocations": False,
+                "userReplicationPolicy": {"asyncReplication": False, "minReplicaSetSize": 1, "maxReplicasetSize": 4},
+                "userConsistencyPolicy": {"defaultConsistencyLevel": "Session"},
+                "systemReplicationPolicy": {"minReplicaSetSize": 1, "maxReplicasetSize": 4},
+                "readPolicy": {"primaryReadCoefficient": 1, "secondaryReadCoefficient": 1},
+                "queryEngineConfiguration": "{}"
+            })
+            return
+
+        with self._store_lock:
+            if parts == ["dbs"] and method == "POST":
+                if document["id"] in self._databases:
+                    self._send(handler, 409, {"code": "Conflict", "message": "Database exists"})
+                    return
+                self._databases[document["id"]] = {"resource": self._system_fields(dict(document), f"dbs/{document['id']}/"), "colls": {}}
+                self._send(handler, 201, self._databases[document["id"]]["resource"])
+                return
+
+            database = self._databases.get(parts[1]) if len(parts) > 1 else None
+            if database is None:
+                self._not_found(handler)
+                return
+            if len(parts) == 2:
+                if method == "GET":
+                    self._send(handler, 200, database["resource"])
+                else:
+                    self._not_found(handler)
+                return
+
+            if len(parts) == 3 and method == "POST":
+                if document["id"] in database["colls"]:
+                    self._send(handler, 409, {"code": "Conflict", "message": "Container exists"})
+                    return
+                resource = self._system_fields(dict(document), f"dbs/{parts[1]}/colls/{document['id']}/")
+                database["colls"][document["id"]] = {"resource": resource, "docs": {}}
+                self._send(handler, 201, resource)
+                return
+
+            container = database["colls"].get(parts[3]) if len(parts) > 3 else None
+            if container is None:
+                self._not_found(handler)
+                return
+            if len(parts) == 4:
+                if method == "GET":
+                    self._send(handler, 200, container["resource"])
+                else:
+                    self._not_found(handler)
+                return
+            if parts[4] == "pkranges":
+                self._send(handler, 200, {"_rid": container["resource"]["_rid"], "_count": 1, "PartitionKeyRanges": [
+                    {"id": "0", "minInclusive": "", "maxExclusive": "FF", "parents": []}
+                ]})
+                return
+
+            docs = container["docs"]
+            if len(parts) == 5 and method == "POST":
+                is_upsert = handler.headers.get("x-ms-documentdb-is-upsert", "").lower() == "true"
+                if document.get("id") in docs and not is_upsert:
+                    self._send(handler, 409, {"code": "Conflict", "message": "Item exists"})
+                    return
+                status = 200 if document.get("id") in docs else 201
+                docs[document["id"]] = self._system_fields(document, f"{'/'.join(parts)}/{document['id']}/")
+                self._send(handler, status, docs[document["id"]], charge=5 + len(body) / 1024.0)
+                return
+
+            item = docs.get(parts[5]) if len(parts) > 5 else None
+            if item is None:
+                self._not_found(handler)
+                return
+            if method == "GET":
+                self._send(handler, 200, item, charge=1 + len(json.dumps(item)) / 4096.0)
+            elif method == "PUT":
+                docs[parts[5]] = self._system_fields(document, item["_self"])
+                self._send(handler, 200, docs[parts[5]], charge=10 + len(body) / 1024.0)
+            elif method == "DELETE":
+                del docs[parts[5]]
+                self.send_json(handler, 204, b"", {"x-ms-request-charge": "5.00"})
+            else:
+                self._send(handler, 400, {"code": "BadRequest", "message": f"{method} is not supported by the fake"})
+
+
+SERVICE_CLASSES = {
+    "document_intelligence": FakeDocumentIntelligence,
+    "vision": FakeVision,
+    "openai": FakeOpenAI,
+    "cosmos": FakeCosmos
+}
+
+
+def start_fake_services(profiles=None, seed=11):
+    """Start every fake service and return them by name"""
+    profiles = profiles or {}
+    services = {}
+    for offset, (name, service_class) in enumerate(SERVICE_CLASSES.items()):
+        settings = dict(DEFAULT_PROFILES[name], **profiles.get(name, {}))
+        services[name] = service_class(ServiceProfile(seed=seed + offset, **settings)).start()
+    return services
+
+
+def service_environment(services, deployment="gpt-4-benchmark"):
+    """Environment variables that point the function app at the fake services"""
+    return {
+        "FORM_RECOGNIZER_ENDPOINT": services["document_intelligence"].endpoint + "/",
+        "FORM_RECOGNIZER_KEY": "offline-benchmark-key",
+        "VISION_API_ENDPOINT": services["vision"].endpoint,
+        "VISION_API_KEY": "offline-benchmark-key",
+        "AZURE_OPENAI_ENDPOINT": services["openai"].endpoint + "/",
+        "AZURE_OPENAI_KEY": "offline-benchmark-key",
+        "AZURE_OPENAI_GPT4_DEPLOYMENT": deployment,
+        "COSMOS_DB_ENDPOINT": services["cosmos"].endpoint + "/",
+        "COSMOS_DB_KEY": FAKE_COSMOS_KEY
+    }
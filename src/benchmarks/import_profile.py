@@ -0,0 +1,162 @@
+"""
+Import-Time Profile
+Measures the cold import of function_app and the first-use import cost of each stage's SDKs,
+failing when a budget is exceeded or a service SDK is imported eagerly
+
+Usage: python benchmarks/import_profile.py [--budget-ms 300] [--stage-budget vision=400 --stage-budget llm=800]
+           [--top 15] [--output import_profile.json]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# SDKs each stage loads on first use (keep in sync with the lazy_module calls)
+STAGE_IMPORTS = {
+    "document_intelligence": ["azure.ai.formrecognizer", "azure.ai.formrecognizer.aio", "azure.core.credentials"],
+    "vision": ["requests", "pypdfium2", "PIL.Image", "PIL.ImageOps"],
+    "llm": ["openai"],
+    "storage": ["azure.cosmos.cosmos_client", "azure.cosmos.exceptions"]
+}
+
+# Loading function_app must not import any of these
+EAGER_IMPORT_FORBIDDEN = (
+    "openai", "azure.cosmos", "azure.ai.formrecognizer", "azure.identity", "azure.storage.blob",
+    "requests", "aiohttp", "PIL", "pypdfium2"
+)
+
+STAGE_PROBE = """
+import importlib, json, sys, time
+import function_app
+timings = {}
+for name in sys.argv[1:]:
+    start = time.perf_counter()
+    try:
+        importlib.import_module(name)
+        timings[name] = round((time.perf_counter() - start) * 1000, 3)
+    except ImportError:
+        timings[name] = None
+print(json.dumps(timings))
+"""
+
+
+def _run(args):
+    """Run a fresh interpreter in the app directory (nothing is warm)"""
+    environment = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    return subprocess.run(
+        [sys.executable] + args, cwd=SRC_DIR, env=environment, capture_output=True, text=True
+    )
+
+
+def parse_importtime(stderr):
+    """Parse -X importtime output into [(module, self_us, cumulative_us, depth)]"""
+    entries = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" "))) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def profile_app_import():
+    """Return (total ms, entries, error) for importing function_app cold"""
+    result = _run(["-X", "importtime", "-c", "import function_app"])
+    entries = parse_importtime(result.stderr)
+    if result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "import failed"
+        return None, entries, error
+    total = next((cumulative for name, _, cumulative, _ in entries if name == "function_app"), 0)
+    return round(total / 1000, 3), entries, None
+
+
+def profile_stages():
+    """Return {stage: {module: ms or None}} with each stage measured in its own fresh process"""
+    stages = {}
+    for stage, modules in STAGE_IMPORTS.items():
+        result = _run(["-c", STAGE_PROBE] + modules)
+        try:
+            stages[stage] = json.loads(result.stdout.strip().splitlines()[-1])
+        except (IndexError, ValueError):
+            stages[stage] = {module: None for module in modules}
+    return stages
+
+
+def parse_stage_budgets(values):
+    """Parse ["vision=400", ...] into {"vision": 400.0}"""
+    budgets = {}
+    for value in values or []:
+        stage, _, milliseconds = value.partition("=")
+        budgets[stage.strip()] = float(milliseconds)
+    return budgets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import profile with budget assertions")
+    parser.add_argument("--budget-ms", type=float, default=300.0, help="budget for importing function_app")
+    parser.add_argument("--stage-budget", action="append", help="per-stage first-use budget, e.g. llm=800")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="write the JSON report to this path")
+    args = parser.parse_args()
+
+    failures = []
+    app_ms, entries, error = profile_app_import()
+    if error:
+        failures.append(f"function_app failed to import: {error}")
+
+    imported = {name for name, _, _, _ in entries}
+    eager = sorted(
+        name for name in imported
+        if any(name == forbidden or name.startswith(forbidden + ".") for forbidden in EAGER_IMPORT_FORBIDDEN)
+    )
+    if eager:
+        failures.append(f"service SDKs imported at load time: {', '.join(eager)}")
+    if app_ms is not None and app_ms > args.budget_ms:
+        failures.append(f"function_app import took {app_ms} ms, budget {args.budget_ms} ms")
+
+    stages = profile_stages() if not error else {}
+    stage_totals = {
+        stage: round(sum(ms for ms in timings.values() if ms is not None), 3) for stage, timings in stages.items()
+    }
+    for stage, budget in parse_stage_budgets(args.stage_budget).items():
+        if stage_totals.get(stage, 0) > budget:
+            failures.append(f"{stage} first-use imports took {stage_totals[stage]} ms, budget {budget} ms")
+
+    slowest = sorted(entries, key=lambda entry: entry[1], reverse=True)[:args.top]
+    print(f"function_app import: {app_ms} ms (budget {args.budget_ms} ms)")
+    print(f"{'module (by self time)':<56}{'self ms':>10}{'cumulative ms':>16}")
+    for name, self_us, cumulative_us, _ in slowest:
+        print(f"{name:<56}{self_us / 1000:>10.1f}{cumulative_us / 1000:>16.1f}")
+    print(f"{'stage first-use imports':<56}{'ms':>10}")
+    for stage, timings in stages.items():
+        missing = [module for module, ms in timings.items() if ms is None]
+        note = f"  (not installed: {', '.join(missing)})" if missing else ""
+        print(f"{stage:<56}{stage_totals[stage]:>10.1f}{note}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump({
+                "function_app_ms": app_ms,
+                "eager_sdk_imports": eager,
+                "stages": stages,
+                "stage_totals_ms": stage_totals,
+                "slowest_modules": [
+                    {"module": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000}
+                    for name, self_us, cumulative_us, _ in slowest
+                ],
+                "failures": failures
+            }, output_file, indent=2)
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Serialization Benchmark
+Compares the previous multi-pass JSON path with the shared single-pass encoding
+
+Usage: python benchmarks/serialization_benchmark.py [--pages 50] [--tables-per-page 2] [--rows 40] [--repeat 5]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.processors.layout_model import LayoutTable, SelectionMarks, materialize_layout  # noqa: E402
+from modules.utils import serialization  # noqa: E402
+from modules.utils.serialization import EncodedJson, encode_json  # noqa: E402
+
+
+def build_layout(pages, tables_per_page, rows, columns=6):
+    """Build a synthetic table-heavy layout in the compact model"""
+    layout = {"id": "benchmark", "pages": []}
+    table_index = 0
+    for page_number in range(1, pages + 1):
+        marks = SelectionMarks()
+        marks.add("unselected", 0.98)
+        page = {
+            "page_number": page_number,
+            "lines": [f"Line {line} of page {page_number}: invoice text" for line in range(40)],
+            "tables": [],
+            "selection_marks": marks,
+            "paragraphs": [{"role": "pageHeader", "content": f"Page {page_number}"}]
+        }
+        for _ in range(tables_per_page):
+            table = LayoutTable(table_index, [page_number], rows, columns)
+            for row in range(rows):
+                for column in range(columns):
+                    table.cells.add(row, column, f"{row * column}.00" if row else f"Header {column}")
+            page["tables"].append(table)
+            table_index += 1
+        layout["pages"].append(page)
+    layout["vision_analysis"] = {"readResult": {"blocks": [{"lines": [{"text": f"vision line {i}"} for i in range(200)]}]}}
+    layout["llm_analysis"] = {"line_items": [{"description": f"item {i}", "amount": i * 1.5} for i in range(100)]}
+    return layout
+
+
+def previous_path(layout):
+    """Serialization work done per document before the shared encoding"""
+    json.dumps(layout["vision_analysis"], indent=2, ensure_ascii=False)
+    json.dumps(layout["llm_analysis"], indent=2, ensure_ascii=False)
+    json.dumps(layout, indent=2, ensure_ascii=False)
+    document = {"id": layout["id"], "content": layout}
+    json.dumps(document)
+    json.dumps(document, separators=(",", ":"))
+
+
+def shared_path(layout):
+    """Serialization work done per document with the shared encoding"""
+    EncodedJson(layout["vision_analysis"]).log_text()
+    EncodedJson(layout["llm_analysis"]).log_text()
+    encoded_layout = EncodedJson(layout)
+    encoded_layout.log_text()
+    fits_item_limit = encoded_layout.size <= 2 * 1024 * 1024
+    # The Cosmos request body splices the metadata around the same encoded bytes
+    encode_json({"id": layout["id"]})[:-1] + b',"content":' + encoded_layout.data + b"}"
+    return fits_item_limit
+
+
+def best_of(function, layout, repeat):
+    """Return the best wall time of several runs in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(layout)
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--pages", type=int, default=50)
+    parser.add_argument("--tables-per-page", type=int, default=2)
+    parser.add_argument("--rows", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    layout = build_layout(args.pages, args.tables_per_page, args.rows)
+    plain_layout = materialize_layout(layout)
+    size = EncodedJson(layout).size
+    print(f"Layout: {args.pages} pages, {args.pages * args.tables_per_page} tables, {size / 1024:.0f} KiB encoded")
+    print(f"orjson available: {serialization.orjson is not None}")
+
+    results = [("previous path (plain dicts)", best_of(previous_path, plain_layout, args.repeat))]
+    os.environ["JSON_FAST_ENCODER"] = "false"
+    results.append(("shared encoding (stdlib json)", best_of(shared_path, layout, args.repeat)))
+    if serialization.orjson is not None:
+        os.environ["JSON_FAST_ENCODER"] = "true"
+        results.append(("shared encoding (orjson)", best_of(shared_path, layout, args.repeat)))
+
+    baseline = results[0][1]
+    for name, milliseconds in results:
+        print(f"{name:<32} {milliseconds:9.1f} ms  ({baseline / milliseconds:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
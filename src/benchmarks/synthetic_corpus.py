@@ -0,0 +1,172 @@
+"""
+Synthetic Corpus
+Deterministic PDFs of different sizes plus the layouts the fake Document Intelligence returns for them
+"""
+
+import random
+import re
+
+
+# name: (pages, tables per page, rows per table, columns, lines per page)
+CORPUS_SPECS = {
+    "small": (1, 1, 6, 4, 30),
+    "medium": (10, 2, 20, 5, 45),
+    "large": (60, 2, 40, 6, 50),
+    "xlarge": (200, 2, 60, 6, 55)
+}
+DEFAULT_MIX = {"small": 0.5, "medium": 0.3, "large": 0.15, "xlarge": 0.05}
+
+SPEC_PATTERN = re.compile(rb"%SYNTHETIC (\w+) seed=(\d+)")
+WORDS = ("invoice", "amount", "total", "net", "tax", "qty", "unit", "price", "item", "due", "customer", "order")
+
+
+class SyntheticDocument:
+    """A generated PDF together with the corpus spec it was built from"""
+
+    def __init__(self, name, size_class, seed, pdf_bytes):
+        self.name = name
+        self.size_class = size_class
+        self.seed = seed
+        self.pdf_bytes = pdf_bytes
+
+
+def build_pdf(page_count, marker, padding_bytes=0):
+    """Build a small valid PDF with empty pages; the marker comment identifies its corpus spec"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [" + b" ".join(b"%d 0 R" % (3 + i) for i in range(page_count))
+        + b"] /Count %d >>" % page_count
+    ]
+    objects += [b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] >>" for _ in range(page_count)]
+
+    output = bytearray(b"%PDF-1.4\n" + marker + b"\n")
+    if padding_bytes:
+        output += b"%" + b"x" * padding_bytes + b"\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(output)
+
+
+def build_corpus(count, mix=None, seed=7, padding_bytes=0):
+    """Return count synthetic documents drawn from the size mix"""
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    classes = list(mix)
+    weights = [mix[size_class] for size_class in classes]
+    documents = []
+    for index in range(count):
+        size_class = rng.choices(classes, weights)[0]
+        doc_seed = rng.randrange(1_000_000)
+        marker = b"%%SYNTHETIC %s seed=%d" % (size_class.encode("ascii"), doc_seed)
+        pdf_bytes = build_pdf(CORPUS_SPECS[size_class][0], marker, padding_bytes)
+        documents.append(SyntheticDocument(f"pdfinvoices/synthetic-{index:04d}-{size_class}.pdf", size_class, doc_seed, pdf_bytes))
+    return documents
+
+
+def parse_spec(pdf_bytes):
+    """Return (size_class, seed) from a synthetic PDF, defaulting to a small document"""
+    match = SPEC_PATTERN.search(pdf_bytes[:512] if pdf_bytes else b"")
+    if not match:
+        return "small", 0
+    return match.group(1).decode("ascii"), int(match.group(2))
+
+
+def _polygon(x, y, width=1.0, height=0.2):
+    return [x, y, x + width, y, x + width, y + height, x, y + height]
+
+
+def _sentence(rng, words=8):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def build_analyze_result(size_class, seed, pages=None, api_version="2023-07-31", model_id="prebuilt-layout"):
+    """Build a Document Intelligence analyzeResult for a corpus spec, optionally for a page range only"""
+    page_count, tables_per_page, rows, columns, lines_per_page = CORPUS_SPECS.get(size_class, CORPUS_SPECS["small"])
+    first, last = 1, page_count
+    if pages:
+        start, _, end = pages.partition("-")
+        first, last = int(start), min(int(end or start), page_count)
+
+    rng = random.Random(seed)
+    content = []
+    offset = 0
+    result_pages, tables, paragraphs = [], [], []
+    for page_number in range(1, page_count + 1):
+        # Advance the generator identically for every page so page ranges are consistent
+        page_lines = [_sentence(rng) for _ in range(lines_per_page)]
+        page_tables = [
+            [[f"Header {column}" if row == 0 else f"{rng.randint(1, 9999)}.{rng.randint(0, 99):02d}"
+              for column in range(columns)] for row in range(rows)]
+            for _ in range(tables_per_page)
+        ]
+        if not first <= page_number <= last:
+            continue
+
+        lines = []
+        for line_index, text in enumerate(page_lines):
+            lines.append({
+                "content": text,
+                "polygon": _polygon(0.5, 0.5 + line_index * 0.2, 7.0),
+                "spans": [{"offset": offset, "length": len(text)}]
+            })
+            content.append(text)
+            offset += len(text) + 1
+        result_pages.append({
+            "pageNumber": page_number,
+            "angle": 0,
+            "width": 8.5,
+            "height": 11,
+            "unit": "inch",
+            "spans": [{"offset": 0, "length": offset}],
+            "words": [],
+            "lines": lines,
+            "selectionMarks": [{
+                "state": "unselected",
+                "polygon": _polygon(7.5, 10.0, 0.2),
+                "confidence": 0.98,
+                "span": {"offset": 0, "length": 1}
+            }]
+        })
+        paragraphs.append({
+            "role": "pageHeader",
+            "content": page_lines[0],
+            "boundingRegions": [{"pageNumber": page_number, "polygon": _polygon(0.5, 0.5, 7.0)}],
+            "spans": [{"offset": 0, "length": len(page_lines[0])}]
+        })
+        for grid in page_tables:
+            region = [{"pageNumber": page_number, "polygon": _polygon(0.5, 3.0, 7.0, 5.0)}]
+            tables.append({
+                "rowCount": rows,
+                "columnCount": columns,
+                "cells": [
+                    {
+                        "kind": "columnHeader" if row == 0 else "content",
+                        "rowIndex": row,
+                        "columnIndex": column,
+                        "rowSpan": 1,
+                        "columnSpan": 1,
+                        "content": value,
+                        "spans": []
+                    }
+                    for row, values in enumerate(grid) for column, value in enumerate(values)
+                ],
+                "boundingRegions": region,
+                "spans": []
+            })
+
+    return {
+        "apiVersion": api_version,
+        "modelId": model_id,
+        "stringIndexType": "unicodeCodePoint",
+        "content": "\n".join(content),
+        "pages": result_pages,
+        "tables": tables,
+        "paragraphs": paragraphs,
+        "styles": [{"isHandwritten": False, "confidence": 0.95, "spans": []}]
+    }
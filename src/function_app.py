@@ -15,32 +15,42 @@ Modular Architecture:
 """
 
 # IMPORTS AND SETUP
+import asyncio
 import logging
 import azure.functions as func
 import time
 import traceback
 import os
+import uuid
 from typing import Dict, Any, List, Optional, Union
 from io import BytesIO
 from datetime import datetime
 
 # Import functions from modules
-from modules.clients.azure_clients import (
-    initialize_form_recognizer_client,
-    initialize_openai_client,
-    get_vision_api_config
+from modules.clients.client_registry import (
+    get_form_recognizer_client,
+    get_form_recognizer_client_async,
+    get_openai_client,
+    get_openai_client_async,
+    get_vision_client,
+    get_vision_client_async,
+    get_cosmos_client,
+    get_cosmos_client_async,
+    get_pool_stats
 )
 from modules.processors.document_intelligence import (
-    analyze_pdf,
-    extract_layout_data
+    LAYOUT_MODEL_ID,
+    analyze_pdf_layout,
+    analyze_pdf_layout_async
 )
 from modules.processors.vision_processing import (
-    analyze_image_with_vision,
-    process_image_file
+    analyze_pages_with_vision,
+    analyze_pages_with_vision_async
 )
-from modules.processors.llm_processing import (
-    analyze_content_with_llm,
-    prepare_content_for_llm
+from modules.processors.page_rasterizer import rasterize_document_pages
+from modules.processors.layout_templates import (
+    analyze_layout_with_templates,
+    analyze_layout_with_templates_async
 )
 from modules.output.display_manager import (
     display_complete_vision_output,
@@ -48,48 +58,191 @@ from modules.output.display_manager import (
     display_final_concatenated_output
 )
 from modules.storage.cosmos_manager import (
-    initialize_cosmos_client,
-    create_database_if_not_exists,
-    create_container_if_not_exists,
+    get_container,
+    get_container_async,
     prepare_document_for_storage,
-    store_document
+    store_document,
+    store_document_async
 )
+from modules.storage.paged_layout import (
+    PAGED_PARTITION_KEY_PATH,
+    STORAGE_LAYOUT_PAGED,
+    get_paged_container_name,
+    get_storage_layout,
+    store_paged_document,
+    store_paged_document_async
+)
+from modules.clients.rate_limiter import get_rate_limiter_stats
+from modules.storage.document_source import open_document_source
+from modules.storage.result_cache import compute_cache_key, get_result_cache
+from modules.storage.checkpoint_store import (
+    checkpoint_key,
+    checkpointed_stage,
+    checkpointed_stage_async,
+    clear_checkpoints,
+    get_blob_etag,
+    get_checkpoint_store
+)
+from modules.pipeline.stage_graph import define_stage, run_stage_graph, run_stage_graph_async
 from modules.utils.file_helpers import generate_document_id, get_file_info
 from modules.utils.validation import validate_required_env_vars
-from modules.utils.logging_helpers import log_processing_step
+from modules.utils.logging_helpers import log_processing_step, processing_step
+from modules.utils.lazy_imports import get_import_timings
+from modules.utils.log_policy import get_document_log_budget, log_stage_summary, start_document_logging
+from modules.utils.serialization import EncodedJson
+from modules.utils.tracing import finish_trace, start_trace
 from modules.utils.time_helpers import calculate_processing_time
 
 # Initialize the function app
 app = func.FunctionApp(http_auth_level=func.AuthLevel.FUNCTION)
 
+# Select which blob trigger handles uploads: "sync" (default) or "async"
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "sync").lower()
+
+REQUIRED_ENV_VARS = [
+    "FORM_RECOGNIZER_ENDPOINT",
+    "FORM_RECOGNIZER_KEY",
+    "AZURE_OPENAI_ENDPOINT",
+    "AZURE_OPENAI_KEY",
+    "AZURE_OPENAI_GPT4_DEPLOYMENT",
+    "VISION_API_ENDPOINT",
+    "VISION_API_KEY"
+]
+
+
+def blob_trigger_for_mode(mode):
+    """Register the decorated function as the blob trigger only in the selected pipeline mode"""
+    def decorator(function):
+        if PIPELINE_MODE != mode:
+            return function
+        return app.blob_trigger(arg_name="myblob", path="pdfinvoices/{name}",
+                                connection="invoicecontosostorage_STORAGE")(function)
+    return decorator
+
+
+# SHARED PIPELINE HELPERS
+def lookup_cached_layout(document):
+    """Return (result_cache, cache_key, cached_layout) for the blob content"""
+    result_cache = get_result_cache()
+    cache_key = compute_cache_key(model_id=LAYOUT_MODEL_ID, content_sha256=document.content_id)
+    cached_layout = result_cache.get(cache_key) if result_cache else None
+    
+    if cached_layout is not None:
+        cached_layout["id"] = str(uuid.uuid4())
+        log_processing_step("Result Cache Hit", f"Reusing layout for content key {cache_key[:12]}")
+    
+    return result_cache, cache_key, cached_layout
+
+
+def finalize_layout(layout_data, result_cache, cache_key, cache_hit, document_id, original_filename):
+    """Cache a fresh layout and attach cache and document metadata"""
+    if result_cache:
+        if not cache_hit:
+            result_cache.put(cache_key, layout_data)
+        layout_data["cache_info"] = {
+            "hit": cache_hit,
+            "key": cache_key,
+            "stats": result_cache.stats()
+        }
+    
+    # Add document ID and filename to layout data
+    layout_data["document_id"] = document_id
+    layout_data["filename"] = original_filename
+    
+    log_processing_step("Document Intelligence Complete", f"Extracted {len(layout_data.get('pages', []))} pages")
+    return layout_data
+
+
+def merge_branch_results(layout_data, upstream, stage_errors):
+    """
+    Merge the Vision and LLM branch results (or their errors) into the layout.
+    Returns (layout_data, encoded_layout); the encoding is shared by the output display and storage.
+    """
+    if "vision" in stage_errors:
+        layout_data["vision_analysis_error"] = str(stage_errors["vision"])
+    else:
+        layout_data["vision_analysis"] = upstream["vision"]
+    
+    if "llm" in stage_errors:
+        layout_data["llm_analysis_error"] = str(stage_errors["llm"])
+    else:
+        layout_data["llm_analysis"] = upstream["llm"]
+    
+    # FINAL OUTPUT DISPLAY
+    log_processing_step("Final Output Generation", "Displaying complete processing results")
+    
+    # Display the final concatenated output with all processing results
+    encoded_layout = EncodedJson(layout_data)
+    display_final_concatenated_output(layout_data, encoded_layout)
+    return layout_data, encoded_layout
+
+
+def record_storage_result(layout_data, stored_doc):
+    """Attach storage information for a stored document"""
+    layout_data["storage_info"] = {
+        "stored": True,
+        "document_id": stored_doc["id"],
+        "timestamp": stored_doc["timestamp"]
+    }
+
+
+def log_pipeline_summary(start_time, stage_durations=None, error=None):
+    """Log the invocation's pipeline summary record; failed invocations get one too"""
+    log_budget = get_document_log_budget()
+    log_stage_summary(
+        "pipeline",
+        status="ERROR" if error is not None else "OK",
+        error=str(error) if error is not None else None,
+        stage_durations=stage_durations or {},
+        duration_seconds=round((datetime.now() - start_time).total_seconds(), 3),
+        log_bytes_truncated=log_budget.truncated_bytes if log_budget else 0,
+        client_pools=get_pool_stats(),
+        rate_limiter_waits=get_rate_limiter_stats(),
+        lazy_import_ms=get_import_timings()
+    )
+
+
+def complete_processing(layout_data, stage_durations, start_time, blob_name):
+    """Attach stage durations and total processing time, then log completion"""
+    layout_data["stage_durations"] = {name: round(seconds, 3) for name, seconds in stage_durations.items()}
+    
+    # CALCULATE PROCESSING TIME
+    end_time = datetime.now()
+    processing_time_info = calculate_processing_time(start_time, end_time)
+    
+    layout_data["processing_time"] = processing_time_info
+    
+    log_processing_step(
+        "Processing Complete", 
+        f"Total time: {processing_time_info['duration_formatted']}"
+    )
+    log_pipeline_summary(start_time, layout_data["stage_durations"])
+    logging.info(f"Successfully processed blob: {blob_name}")
+    return layout_data
+
+
 # MAIN AZURE FUNCTION
-@app.blob_trigger(arg_name="myblob", path="pdfinvoices/{name}",
-                  connection="invoicecontosostorage_STORAGE")
+@blob_trigger_for_mode("sync")
 def BlobTriggerPDFsMultiLayoutsAIDocIntelligence(myblob: func.InputStream) -> None:
     """
     Blob trigger Azure Function for comprehensive PDF document analysis
     Processes PDF files using Azure Document Intelligence, AI Vision, and OpenAI
     """
     start_time = datetime.now()
+    error = None
     
     try:
         # Get blob information
         blob_name = myblob.name
-        file_content = myblob.read()
+        start_document_logging(blob_name)
+        # Large blobs are referenced by SAS URL instead of being read into memory
+        document = open_document_source(myblob)
+        start_trace(blob_name, pipeline_mode=PIPELINE_MODE, blob_bytes=document.size, by_reference=document.by_reference)
         
-        log_processing_step("Starting Document Analysis", f"Processing blob: {blob_name}")
+        log_processing_step("Starting Document Analysis", f"Processing blob: {document.describe()}")
         
         # Validate required environment variables
-        required_env_vars = [
-            "FORM_RECOGNIZER_ENDPOINT",
-            "FORM_RECOGNIZER_KEY",
-            "AZURE_OPENAI_ENDPOINT",
-            "AZURE_OPENAI_KEY",
-            "AZURE_OPENAI_GPT4_DEPLOYMENT",
-            "VISION_API_ENDPOINT",
-            "VISION_API_KEY"
-        ]
-        validate_required_env_vars(required_env_vars)
+        validate_required_env_vars(REQUIRED_ENV_VARS)
         
         # Generate unique document ID
         document_id = generate_document_id()
@@ -99,119 +252,135 @@ def BlobTriggerPDFsMultiLayoutsAIDocIntelligence(myblob: func.InputStream) -> No
         
         log_processing_step("File Processing", f"Processing file: {original_filename}")
         
-        # Initialize Azure clients
+        # Initialize Azure clients (reused across invocations on a warm worker)
         log_processing_step("Client Initialization", "Setting up Azure service clients")
         
         # Initialize Form Recognizer client
-        form_recognizer_client = initialize_form_recognizer_client()
+        form_recognizer_client = get_form_recognizer_client()
 
         # Initialize OpenAI client
-        openai_client = initialize_openai_client()
+        openai_client = get_openai_client()
 
-        # Get Vision API configuration
-        vision_config = get_vision_api_config()
-        
-        # DOCUMENT INTELLIGENCE PROCESSING
-        log_processing_step("Document Intelligence Analysis", "Analyzing PDF with Azure Document Intelligence")
-        
-        # Analyze PDF with Document Intelligence
-        document_result = analyze_pdf(form_recognizer_client, file_content)
-        
-        # Extract layout data
-        layout_data = extract_layout_data(document_result)
-        
-        # Add document ID and filename to layout data
-        layout_data["document_id"] = document_id
-        layout_data["filename"] = original_filename
-        
-        log_processing_step("Document Intelligence Complete", f"Extracted {len(layout_data.get('pages', []))} pages")
+        # Get Vision API configuration and its pooled HTTP session
+        vision_config, vision_session = get_vision_client()
         
-        # AI VISION PROCESSING
-        log_processing_step("AI Vision Analysis", "Processing with Azure AI Vision")
+        # PIPELINE STAGES
+        # Document Intelligence and AI Vision run in parallel, the LLM waits on the
+        # layout, and final output/storage waits on every branch.
         
-        try:
-            # Process with AI Vision for additional insights
-            vision_analysis = analyze_image_with_vision(vision_config, file_content)
+        def run_document_intelligence(upstream):
+            log_processing_step("Document Intelligence Analysis", "Analyzing PDF with Azure Document Intelligence")
             
-            # Display complete Vision output
-            display_complete_vision_output(vision_analysis, "- Azure AI Vision Analysis")
+            # Reuse a cached layout when the same content was already analyzed
+            result_cache, cache_key, layout_data = lookup_cached_layout(document)
+            cache_hit = layout_data is not None
             
-            # Add vision analysis to layout data
-            layout_data["vision_analysis"] = vision_analysis
+            if not cache_hit:
+                # Analyze PDF with Document Intelligence and extract layout data
+                # (large PDFs are split into page-range shards when DI_SHARDING_ENABLED is set)
+                layout_data = analyze_pdf_layout(
+                    form_recognizer_client,
+                    document.content,
+                    model_id=LAYOUT_MODEL_ID,
+                    document_url=document.url if document.by_reference else None
+                )
             
-        except Exception as e:
-            logging.warning(f"Vision analysis failed (continuing without it): {e}")
-            layout_data["vision_analysis_error"] = str(e)
+            return finalize_layout(layout_data, result_cache, cache_key, cache_hit, document_id, original_filename)
         
-        # LLM SEMANTIC ANALYSIS
-        log_processing_step("LLM Semantic Analysis", "Analyzing content with Azure OpenAI")
+        def run_vision(upstream):
+            log_processing_step("AI Vision Analysis", "Processing with Azure AI Vision")
+            
+            # Render the selected pages to images, then analyze them in parallel
+            page_images = rasterize_document_pages(document, session=vision_session)
+            vision_analysis = analyze_pages_with_vision(page_images, vision_config, session=vision_session)
+            
+            # Display complete Vision output
+            display_complete_vision_output(vision_analysis, "- Azure AI Vision Analysis")
+            return vision_analysis
         
-        try:
-            # Prepare content for LLM analysis
-            prepared_content = prepare_content_for_llm(layout_data, "pdf")
-
-            # Analyze with LLM
-            llm_analysis = analyze_content_with_llm(
+        def run_llm(upstream):
+            log_processing_step("LLM Semantic Analysis", "Analyzing content with Azure OpenAI")
+            
+            # Analyze with LLM (token-budgeted prompt, chunked for long documents when enabled);
+            # layouts matching a known template reuse its field mappings and skip or shrink the call
+            llm_analysis = analyze_layout_with_templates(
                 openai_client,
-                prepared_content,
+                upstream["document_intelligence"],
                 deployment_name=os.getenv("AZURE_OPENAI_GPT4_DEPLOYMENT")
             )
             
             # Display complete LLM output
             display_complete_llm_output(llm_analysis)
+            return llm_analysis
+        
+        def run_output_and_storage(upstream):
+            # Merge the parallel branches in their original order
+            layout_data, encoded_layout = merge_branch_results(upstream["document_intelligence"], upstream, stage_errors)
             
-            # Add LLM analysis to layout data
-            layout_data["llm_analysis"] = llm_analysis
-            
-        except Exception as e:
-            logging.warning(f"LLM analysis failed (continuing without it): {e}")
-            layout_data["llm_analysis_error"] = str(e)
-        
-        # FINAL OUTPUT DISPLAY
-        log_processing_step("Final Output Generation", "Displaying complete processing results")
-        
-        # Display the final concatenated output with all processing results
-        display_final_concatenated_output(layout_data)
-        
-        # OPTIONAL: STORE IN COSMOS DB
-        cosmos_endpoint = os.getenv("COSMOS_DB_ENDPOINT")
-        cosmos_key = os.getenv("COSMOS_DB_KEY")
-        
-        if cosmos_endpoint and cosmos_key:
-            try:
-                log_processing_step("Data Storage", "Storing results in Cosmos DB")
-                
-                # Initialize Cosmos client and containers
-                cosmos_client = initialize_cosmos_client(cosmos_endpoint, cosmos_key)
-                database = create_database_if_not_exists(cosmos_client, "DocumentAnalysisDB")
-                container = create_container_if_not_exists(database, "ProcessedDocuments")
-                
-                # Prepare and store document
-                document_for_storage = prepare_document_for_storage(layout_data, original_filename)
-                stored_doc = store_document(container, document_for_storage)
-                
-                layout_data["storage_info"] = {
-                    "stored": True,
-                    "document_id": stored_doc["id"],
-                    "timestamp": stored_doc["timestamp"]
-                }
-                
-            except Exception as e:
-                logging.warning(f"Storage failed (continuing without it): {e}")
-                layout_data["storage_error"] = str(e)
-        
-        # CALCULATE PROCESSING TIME
-        end_time = datetime.now()
-        processing_time_info = calculate_processing_time(start_time, end_time)
-        
-        layout_data["processing_time"] = processing_time_info
-        
-        log_processing_step(
-            "Processing Complete", 
-            f"Total time: {processing_time_info['duration_formatted']}"
-        )
-        
-        logging.info(f"Successfully processed blob: {blob_name}")
+            # OPTIONAL: STORE IN COSMOS DB
+            cosmos_endpoint = os.getenv("COSMOS_DB_ENDPOINT")
+            cosmos_key = os.getenv("COSMOS_DB_KEY")
+            
+            if cosmos_endpoint and cosmos_key:
+                try:
+                    with processing_step("Data Storage", "Storing results in Cosmos DB"):
+                        # Cosmos client and container handles are resolved once per process
+                        cosmos_client = get_cosmos_client(cosmos_endpoint, cosmos_key)
+                        
+                        if get_storage_layout() == STORAGE_LAYOUT_PAGED:
+                            # Header item plus one item per page group, partitioned by document id
+                            container = get_container(
+                                cosmos_client,
+                                "DocumentAnalysisDB",
+                                get_paged_container_name(),
+                                partition_key_path=PAGED_PARTITION_KEY_PATH
+                            )
+                            stored_doc = store_paged_document(container, layout_data, original_filename)
+                        else:
+                            container = get_container(cosmos_client, "DocumentAnalysisDB", "ProcessedDocuments")
+                            
+                            # Prepare and store document
+                            document_for_storage = prepare_document_for_storage(
+                                layout_data,
+                                original_filename,
+                                encoded_content=encoded_layout
+                            )
+                            stored_doc = store_document(container, document_for_storage)
+                        record_storage_result(layout_data, stored_doc)
+                    
+                except Exception as e:
+                    logging.warning(f"Storage failed (continuing without it): {e}")
+                    layout_data["storage_error"] = str(e)
+            
+            return layout_data
+        
+        # Resume from checkpoints left by a failed attempt on this blob version
+        checkpoint_store = get_checkpoint_store()
+        run_key = checkpoint_key(blob_name, get_blob_etag(myblob), content_sha256=document.content_id)
+        
+        stage_errors = {}
+        stages = [
+            define_stage(
+                "document_intelligence",
+                checkpointed_stage(checkpoint_store, run_key, "document_intelligence", run_document_intelligence),
+                required=True
+            ),
+            define_stage("vision", checkpointed_stage(checkpoint_store, run_key, "vision", run_vision)),
+            define_stage(
+                "llm",
+                checkpointed_stage(checkpoint_store, run_key, "llm", run_llm),
+                depends_on=["document_intelligence"]
+            ),
+            define_stage(
+                "output_and_storage",
+                run_output_and_storage,
+                depends_on=["document_intelligence", "vision", "llm"],
+                required=True
+            )
+        ]
+        stage_results, _, stage_durations = run_stage_graph(stages, errors=stage_errors)
+        complete_processing(stage_results["output_and_storage"], stage_durations, start_time, blob_name)
+        clear_checkpoints(checkpoint_store, run_key)
         
     except Exception as e:
         # Define a default blob name in case we fail early
@@ -223,4 +392,160 @@ def BlobTriggerPDFsMultiLayoutsAIDocIntelligence(myblob: func.InputStream) -> No
         
         logging.error(f"Document analysis failed for {blob_info}: {e}")
         logging.error(f"Traceback: {traceback.format_exc()}")
+        error = e
+        log_pipeline_summary(start_time, error=e)
+        raise
+    finally:
+        # One metrics record (all spans plus per-stage totals) per invocation, failed or not
+        finish_trace(error=error)
+
+
+# ASYNC AZURE FUNCTION (PIPELINE_MODE=async)
+@blob_trigger_for_mode("async")
+async def BlobTriggerPDFsMultiLayoutsAIDocIntelligenceAsync(myblob: func.InputStream) -> None:
+    """
+    Async variant of the blob trigger: Document Intelligence polling, Vision,
+    OpenAI and Cosmos calls are awaited so one worker keeps many documents in flight
+    """
+    start_time = datetime.now()
+    error = None
+    
+    try:
+        # Get blob information
+        blob_name = myblob.name
+        start_document_logging(blob_name)
+        # Large blobs are referenced by SAS URL instead of being read into memory
+        document = open_document_source(myblob)
+        start_trace(blob_name, pipeline_mode=PIPELINE_MODE, blob_bytes=document.size, by_reference=document.by_reference)
+        
+        log_processing_step("Starting Document Analysis (async)", f"Processing blob: {document.describe()}")
+        
+        # Validate required environment variables
+        validate_required_env_vars(REQUIRED_ENV_VARS)
+        
+        # Generate unique document ID
+        document_id = generate_document_id()
+        
+        # Extract filename from blob path
+        original_filename = blob_name.split('/')[-1] if '/' in blob_name else blob_name
+        
+        log_processing_step("File Processing", f"Processing file: {original_filename}")
+        
+        # Initialize async Azure clients (reused across invocations on a warm worker)
+        log_processing_step("Client Initialization", "Setting up async Azure service clients")
+        form_recognizer_client = await get_form_recognizer_client_async()
+        openai_client = await get_openai_client_async()
+        vision_config, vision_session = await get_vision_client_async()
+        
+        async def run_document_intelligence(upstream):
+            log_processing_step("Document Intelligence Analysis", "Analyzing PDF with Azure Document Intelligence")
+            
+            # Cache lookups and writes may hit disk or Blob Storage; keep them off the event loop
+            result_cache, cache_key, layout_data = await asyncio.to_thread(lookup_cached_layout, document)
+            cache_hit = layout_data is not None
+            
+            if not cache_hit:
+                layout_data = await analyze_pdf_layout_async(
+                    form_recognizer_client,
+                    document.content,
+                    model_id=LAYOUT_MODEL_ID,
+                    document_url=document.url if document.by_reference else None
+                )
+            
+            return await asyncio.to_thread(
+                finalize_layout, layout_data, result_cache, cache_key, cache_hit, document_id, original_filename
+            )
+        
+        async def run_vision(upstream):
+            log_processing_step("AI Vision Analysis", "Processing with Azure AI Vision")
+            # PDFium rendering is CPU-bound, so it runs off the event loop
+            page_images = await asyncio.to_thread(rasterize_document_pages, document)
+            vision_analysis = await analyze_pages_with_vision_async(page_images, vision_config, session=vision_session)
+            display_complete_vision_output(vision_analysis, "- Azure AI Vision Analysis")
+            return vision_analysis
+        
+        async def run_llm(upstream):
+            log_processing_step("LLM Semantic Analysis", "Analyzing content with Azure OpenAI")
+            llm_analysis = await analyze_layout_with_templates_async(
+                openai_client,
+                upstream["document_intelligence"],
+                deployment_name=os.getenv("AZURE_OPENAI_GPT4_DEPLOYMENT")
+            )
+            display_complete_llm_output(llm_analysis)
+            return llm_analysis
+        
+        async def run_output_and_storage(upstream):
+            layout_data, encoded_layout = merge_branch_results(upstream["document_intelligence"], upstream, stage_errors)
+            
+            # OPTIONAL: STORE IN COSMOS DB
+            cosmos_endpoint = os.getenv("COSMOS_DB_ENDPOINT")
+            cosmos_key = os.getenv("COSMOS_DB_KEY")
+            
+            if cosmos_endpoint and cosmos_key:
+                try:
+                    with processing_step("Data Storage", "Storing results in Cosmos DB"):
+                        cosmos_client = await get_cosmos_client_async(cosmos_endpoint, cosmos_key)
+                        
+                        if get_storage_layout() == STORAGE_LAYOUT_PAGED:
+                            container = await get_container_async(
+                                cosmos_client,
+                                "DocumentAnalysisDB",
+                                get_paged_container_name(),
+                                partition_key_path=PAGED_PARTITION_KEY_PATH
+                            )
+                            stored_doc = await store_paged_document_async(container, layout_data, original_filename)
+                        else:
+                            container = await get_container_async(cosmos_client, "DocumentAnalysisDB", "ProcessedDocuments")
+                            
+                            document_for_storage = prepare_document_for_storage(
+                                layout_data,
+                                original_filename,
+                                encoded_content=encoded_layout
+                            )
+                            stored_doc = await store_document_async(container, document_for_storage)
+                        record_storage_result(layout_data, stored_doc)
+                    
+                except Exception as e:
+                    logging.warning(f"Storage failed (continuing without it): {e}")
+                    layout_data["storage_error"] = str(e)
+            
+            return layout_data
+        
+        # Resume from checkpoints left by a failed attempt on this blob version
+        checkpoint_store = await asyncio.to_thread(get_checkpoint_store)
+        run_key = checkpoint_key(blob_name, get_blob_etag(myblob), content_sha256=document.content_id)
+        
+        stage_errors = {}
+        stages = [
+            define_stage(
+                "document_intelligence",
+                checkpointed_stage_async(checkpoint_store, run_key, "document_intelligence", run_document_intelligence),
+                required=True
+            ),
+            define_stage("vision", checkpointed_stage_async(checkpoint_store, run_key, "vision", run_vision)),
+            define_stage(
+                "llm",
+                checkpointed_stage_async(checkpoint_store, run_key, "llm", run_llm),
+                depends_on=["document_intelligence"]
+            ),
+            define_stage(
+                "output_and_storage",
+                run_output_and_storage,
+                depends_on=["document_intelligence", "vision", "llm"],
+                required=True
+            )
+        ]
+        stage_results, _, stage_durations = await run_stage_graph_async(stages, errors=stage_errors)
+        complete_processing(stage_results["output_and_storage"], stage_durations, start_time, blob_name)
+        await asyncio.to_thread(clear_checkpoints, checkpoint_store, run_key)
+        
+    except Exception as e:
+        blob_info = f"blob {myblob.name}" if getattr(myblob, "name", None) else "unknown blob"
+        logging.error(f"Document analysis failed for {blob_info}: {e}")
+        logging.error(f"Traceback: {traceback.format_exc()}")
+        error = e
+        log_pipeline_summary(start_time, error=e)
         raise
+    finally:
+        # One metrics record (all spans plus per-stage totals) per invocation, failed or not
+        finish_trace(error=error)
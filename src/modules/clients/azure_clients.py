@@ -5,13 +5,17 @@ Handles initialization of all Azure service clients
 
 import os
 import logging
-from azure.ai.formrecognizer import DocumentAnalysisClient
-from azure.core.credentials import AzureKeyCredential
-from azure.identity import DefaultAzureCredential
-from openai import AzureOpenAI
 
+from modules.utils.lazy_imports import lazy_module
 
-def initialize_form_recognizer_client():
+# SDKs are imported on first use so a cold start only loads what its stages need
+formrecognizer = lazy_module("azure.ai.formrecognizer")
+formrecognizer_aio = lazy_module("azure.ai.formrecognizer.aio")
+credentials = lazy_module("azure.core.credentials")
+openai = lazy_module("openai")
+
+
+def initialize_form_recognizer_client(transport=None):
     """Initialize Azure Document Intelligence client"""
     endpoint = os.getenv("FORM_RECOGNIZER_ENDPOINT")
     key = os.getenv("FORM_RECOGNIZER_KEY")
@@ -20,10 +24,11 @@ def initialize_form_recognizer_client():
         raise ValueError("FORM_RECOGNIZER_KEY must be a string")
         
     logging.info(f"Form Recognizer endpoint: {endpoint}")
-    return DocumentAnalysisClient(endpoint=endpoint, credential=AzureKeyCredential(key))
+    options = {"transport": transport} if transport is not None else {}
+    return formrecognizer.DocumentAnalysisClient(endpoint=endpoint, credential=credentials.AzureKeyCredential(key), **options)
 
 
-def initialize_openai_client():
+def initialize_openai_client(http_client=None):
     """Initialize the Azure OpenAI client for LLM processing"""
     endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
     key = os.getenv("AZURE_OPENAI_KEY")
@@ -34,10 +39,13 @@ def initialize_openai_client():
         return None
         
     try:
-        client = AzureOpenAI(
+        client = openai.AzureOpenAI(
             azure_endpoint=endpoint,
             api_key=key,
-            api_version=api_version
+            api_version=api_version,
+            http_client=http_client,
+            # Retries happen in call_with_rate_limit so they pass through the token bucket
+            max_retries=0
         )
         logging.info(f"Azure OpenAI client initialized with API version: {api_version}")
         return client
@@ -46,6 +54,48 @@ def initialize_openai_client():
         return None
 
 
+def initialize_form_recognizer_client_async(transport=None):
+    """Initialize async Azure Document Intelligence client"""
+    endpoint = os.getenv("FORM_RECOGNIZER_ENDPOINT")
+    key = os.getenv("FORM_RECOGNIZER_KEY")
+    
+    if not isinstance(key, str):
+        raise ValueError("FORM_RECOGNIZER_KEY must be a string")
+        
+    options = {"transport": transport} if transport is not None else {}
+    return formrecognizer_aio.DocumentAnalysisClient(
+        endpoint=endpoint,
+        credential=credentials.AzureKeyCredential(key),
+        **options
+    )
+
+
+def initialize_openai_client_async(http_client=None):
+    """Initialize the async Azure OpenAI client for LLM processing"""
+    endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+    key = os.getenv("AZURE_OPENAI_KEY")
+    api_version = os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
+    
+    if not endpoint or not key:
+        logging.warning("Azure OpenAI configuration missing or incomplete")
+        return None
+        
+    try:
+        client = openai.AsyncAzureOpenAI(
+            azure_endpoint=endpoint,
+            api_key=key,
+            api_version=api_version,
+            http_client=http_client,
+            # Retries happen in call_with_rate_limit so they pass through the token bucket
+            max_retries=0
+        )
+        logging.info(f"Async Azure OpenAI client initialized with API version: {api_version}")
+        return client
+    except Exception as e:
+        logging.error(f"Failed to initialize async Azure OpenAI client: {e}")
+        return None
+
+
 def get_vision_api_config():
     """Get the Vision API configuration from environment variables"""
     key = os.getenv("VISION_API_KEY")
@@ -0,0 +1,333 @@
+"""
+Client Registry Module
+Keeps one warm instance of each Azure service client per worker process
+"""
+
+import os
+import asyncio
+import inspect
+import logging
+import hashlib
+import json
+import threading
+import time
+
+from modules.clients.azure_clients import (
+    initialize_form_recognizer_client,
+    initialize_form_recognizer_client_async,
+    initialize_openai_client,
+    initialize_openai_client_async,
+    get_vision_api_config
+)
+
+
+DEFAULT_POOL_MAXSIZE = 20
+
+_registry = {}
+_sessions = {}
+_async_registry = {}
+_async_sessions = {}
+_lock = threading.RLock()
+
+
+def _pool_maxsize():
+    """Return the configured maximum number of keep-alive connections per host"""
+    return int(os.getenv("CLIENT_POOL_MAXSIZE", DEFAULT_POOL_MAXSIZE))
+
+
+def _fingerprint(config):
+    """Hash a client configuration so secrets are not kept in the registry"""
+    encoded = json.dumps(config, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _close_quietly(resource):
+    """Close a client or session, ignoring errors from already-closed resources"""
+    close = getattr(resource, "close", None)
+    if callable(close):
+        try:
+            close()
+        except Exception as e:
+            logging.debug(f"Ignoring error while closing pooled resource: {e}")
+
+
+def get_http_session(name="default"):
+    """Return a process-wide requests.Session with a keep-alive connection pool"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            maxsize = _pool_maxsize()
+            adapter = HTTPAdapter(pool_connections=maxsize, pool_maxsize=maxsize)
+            session = requests.Session()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[name] = session
+            logging.info(f"Created pooled HTTP session '{name}' (pool_maxsize={maxsize})")
+        return session
+
+
+def get_or_create_client(name, config, factory):
+    """Return the cached client for name, rebuilding it when its config changed"""
+    fingerprint = _fingerprint(config)
+    with _lock:
+        entry = _registry.get(name)
+        if entry and entry["fingerprint"] == fingerprint and entry["client"] is not None:
+            entry["reuses"] += 1
+            return entry["client"]
+
+        rebuilds = 0
+        if entry:
+            rebuilds = entry["rebuilds"] + 1
+            logging.info(f"Configuration changed for '{name}' client, rebuilding")
+            _close_quietly(entry["client"])
+
+        client = factory()
+        if client is None:
+            _registry.pop(name, None)
+            return None
+
+        _registry[name] = {
+            "client": client,
+            "fingerprint": fingerprint,
+            "created_at": time.time(),
+            "reuses": 0,
+            "rebuilds": rebuilds
+        }
+        logging.info(f"Created pooled '{name}' client")
+        return client
+
+
+def _azure_transport():
+    """Build an azure-core transport that shares the pooled HTTP session"""
+    from azure.core.pipeline.transport import RequestsTransport
+
+    return RequestsTransport(session=get_http_session("azure-core"), session_owner=False)
+
+
+def get_form_recognizer_client():
+    """Return the warm Document Intelligence client"""
+    config = {
+        "endpoint": os.getenv("FORM_RECOGNIZER_ENDPOINT"),
+        "key": os.getenv("FORM_RECOGNIZER_KEY")
+    }
+    return get_or_create_client(
+        "form_recognizer",
+        config,
+        lambda: initialize_form_recognizer_client(transport=_azure_transport())
+    )
+
+
+def get_openai_client():
+    """Return the warm Azure OpenAI client backed by a pooled httpx client"""
+    config = {
+        "endpoint": os.getenv("AZURE_OPENAI_ENDPOINT"),
+        "key": os.getenv("AZURE_OPENAI_KEY"),
+        "api_version": os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
+    }
+
+    def factory():
+        import httpx
+
+        maxsize = _pool_maxsize()
+        http_client = httpx.Client(
+            limits=httpx.Limits(max_connections=maxsize, max_keepalive_connections=maxsize),
+            timeout=httpx.Timeout(120.0, connect=10.0)
+        )
+        client = initialize_openai_client(http_client=http_client)
+        if client is None:
+            http_client.close()
+        return client
+
+    return get_or_create_client("openai", config, factory)
+
+
+def get_cosmos_client(endpoint, key):
+    """Return the warm Cosmos DB client for the given account"""
+    # Cosmos calls do not go through call_with_rate_limit, so the SDK's throttle retry
+    # policy (which honours x-ms-retry-after-ms) stays their only retry layer
+    from modules.storage.cosmos_manager import initialize_cosmos_client
+
+    return get_or_create_client(
+        "cosmos",
+        {"endpoint": endpoint, "key": key},
+        lambda: initialize_cosmos_client(endpoint, key, transport=_azure_transport())
+    )
+
+
+def get_vision_client():
+    """Return the Vision API configuration together with its pooled HTTP session"""
+    return get_vision_api_config(), get_http_session("vision")
+
+
+async def _aclose_quietly(resource):
+    """Close an async client or session, ignoring errors from already-closed resources"""
+    close = getattr(resource, "close", None)
+    if callable(close):
+        try:
+            outcome = close()
+            if inspect.isawaitable(outcome):
+                await outcome
+        except Exception as e:
+            logging.debug(f"Ignoring error while closing pooled async resource: {e}")
+
+
+async def get_async_http_session(name="default"):
+    """Return an aiohttp session with a keep-alive pool bound to the running event loop"""
+    import aiohttp
+
+    loop = asyncio.get_running_loop()
+    entry = _async_sessions.get(name)
+    if entry and entry["loop"] is loop and not entry["session"].closed:
+        return entry["session"]
+    if entry:
+        await _aclose_quietly(entry["session"])
+
+    maxsize = _pool_maxsize()
+    session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=maxsize, limit_per_host=maxsize))
+    _async_sessions[name] = {"session": session, "loop": loop}
+    logging.info(f"Created pooled async HTTP session '{name}' (limit={maxsize})")
+    return session
+
+
+async def get_or_create_async_client(name, config, factory):
+    """Async counterpart of get_or_create_client; clients are also rebuilt for a new event loop"""
+    loop = asyncio.get_running_loop()
+    fingerprint = _fingerprint(config)
+    entry = _async_registry.get(name)
+    if entry and entry["fingerprint"] == fingerprint and entry["loop"] is loop:
+        entry["reuses"] += 1
+        return entry["client"]
+
+    rebuilds = 0
+    if entry:
+        rebuilds = entry["rebuilds"] + 1
+        logging.info(f"Configuration or event loop changed for async '{name}' client, rebuilding")
+        await _aclose_quietly(entry["client"])
+
+    client = factory()
+    if client is None:
+        _async_registry.pop(name, None)
+        return None
+
+    _async_registry[name] = {
+        "client": client,
+        "fingerprint": fingerprint,
+        "loop": loop,
+        "created_at": time.time(),
+        "reuses": 0,
+        "rebuilds": rebuilds
+    }
+    logging.info(f"Created pooled async '{name}' client")
+    return client
+
+
+def _azure_async_transport(session):
+    """Build an azure-core async transport that shares a pooled aiohttp session"""
+    from azure.core.pipeline.transport import AioHttpTransport
+
+    return AioHttpTransport(session=session, session_owner=False)
+
+
+async def get_form_recognizer_client_async():
+    """Return the warm async Document Intelligence client"""
+    config = {
+        "endpoint": os.getenv("FORM_RECOGNIZER_ENDPOINT"),
+        "key": os.getenv("FORM_RECOGNIZER_KEY")
+    }
+    session = await get_async_http_session("azure-core")
+    return await get_or_create_async_client(
+        "form_recognizer",
+        config,
+        lambda: initialize_form_recognizer_client_async(transport=_azure_async_transport(session))
+    )
+
+
+async def get_openai_client_async():
+    """Return the warm async Azure OpenAI client backed by a pooled httpx client"""
+    config = {
+        "endpoint": os.getenv("AZURE_OPENAI_ENDPOINT"),
+        "key": os.getenv("AZURE_OPENAI_KEY"),
+        "api_version": os.getenv("AZURE_OPENAI_API_VERSION", "2024-02-15-preview")
+    }
+
+    def factory():
+        import httpx
+
+        maxsize = _pool_maxsize()
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=maxsize, max_keepalive_connections=maxsize),
+            timeout=httpx.Timeout(120.0, connect=10.0)
+        )
+        return initialize_openai_client_async(http_client=http_client)
+
+    return await get_or_create_async_client("openai", config, factory)
+
+
+async def get_cosmos_client_async(endpoint, key):
+    """Return the warm async Cosmos DB client for the given account"""
+    from modules.storage.cosmos_manager import initialize_cosmos_client_async
+
+    session = await get_async_http_session("azure-core")
+    return await get_or_create_async_client(
+        "cosmos",
+        {"endpoint": endpoint, "key": key},
+        lambda: initialize_cosmos_client_async(endpoint, key, transport=_azure_async_transport(session))
+    )
+
+
+async def get_vision_client_async():
+    """Return the Vision API configuration together with its pooled aiohttp session"""
+    return get_vision_api_config(), await get_async_http_session("vision")
+
+
+def get_pool_stats():
+    """Return reuse counters for pooled clients and connection pool usage per session"""
+    now = time.time()
+    with _lock:
+        clients = {
+            name: {
+                "age_seconds": round(now - entry["created_at"], 1),
+                "reuses": entry["reuses"],
+                "rebuilds": entry["rebuilds"]
+            }
+            for name, entry in _registry.items()
+        }
+        sessions = {}
+        for name, session in _sessions.items():
+            adapter = session.get_adapter("https://")
+            sessions[name] = {
+                "host_pools": len(adapter.poolmanager.pools),
+                "pool_maxsize": adapter._pool_maxsize
+            }
+        async_clients = {
+            name: {
+                "age_seconds": round(now - entry["created_at"], 1),
+                "reuses": entry["reuses"],
+                "rebuilds": entry["rebuilds"]
+            }
+            for name, entry in _async_registry.items()
+        }
+        async_sessions = {
+            name: {"limit": entry["session"].connector.limit if entry["session"].connector else None}
+            for name, entry in _async_sessions.items()
+        }
+    return {
+        "clients": clients,
+        "http_sessions": sessions,
+        "async_clients": async_clients,
+        "async_http_sessions": async_sessions
+    }
+
+
+def reset_clients():
+    """Close and forget every pooled client and session"""
+    with _lock:
+        for entry in _registry.values():
+            _close_quietly(entry["client"])
+        for session in _sessions.values():
+            _close_quietly(session)
+        _registry.clear()
+        _sessions.clear()
@@ -0,0 +1,227 @@
+"""
+Rate Limiter Module
+Shared token buckets and Retry-After-aware backoff for outbound AI service calls
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+# Connection resets and timeouts carry no HTTP status; matched by class name so the
+# openai, azure-core, requests and aiohttp SDKs need not be imported here
+CONNECTION_ERROR_TYPES = (
+    "APIConnectionError", "APITimeoutError", "ServiceRequestError", "ServiceResponseError",
+    "ConnectionError", "Timeout", "ClientConnectionError", "ServerTimeoutError"
+)
+DEFAULT_MAX_RETRIES = 4
+BASE_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 30.0
+
+# (environment variable, default quota, quota period in seconds, burst in seconds) per endpoint;
+# the Document Intelligence quota covers analyze submits only, not the poll requests
+ENDPOINT_QUOTAS = {
+    "document_intelligence": ("DI_MAX_TPS", 15, 1, 1),
+    "vision": ("VISION_MAX_TPS", 10, 1, 1),
+    "openai": ("AZURE_OPENAI_TPM", 80000, 60, 10)
+}
+
+
+class TokenBucket:
+    """Thread-safe token bucket that also records how long callers waited"""
+
+    def __init__(self, name, rate_per_second, capacity=None):
+        self.name = name
+        self.rate_per_second = float(rate_per_second)
+        self.capacity = float(capacity or rate_per_second)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+        self._waits = deque(maxlen=1000)
+        self.requests = 0
+        self.throttled = 0
+
+    def _reserve(self, cost):
+        """Reserve tokens and return how long the caller must wait before proceeding"""
+        cost = min(float(cost), self.capacity)
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate_per_second)
+            self._updated = now
+            self._tokens -= cost
+            wait = max(0.0, -self._tokens / self.rate_per_second, self._blocked_until - now)
+            self.requests += 1
+            self._waits.append(wait)
+            return wait
+
+    def acquire(self, cost=1):
+        """Block until the request may proceed; returns the seconds spent waiting"""
+        wait = self._reserve(cost)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    async def acquire_async(self, cost=1):
+        """Await until the request may proceed; returns the seconds spent waiting"""
+        wait = self._reserve(cost)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def penalize(self, seconds):
+        """Hold every caller of this endpoint back after the service asked us to slow down"""
+        with self._lock:
+            self.throttled += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def stats(self):
+        """Return request counts and queue wait percentiles"""
+        with self._lock:
+            waits = sorted(self._waits)
+            count = len(waits)
+            return {
+                "rate_per_second": self.rate_per_second,
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "wait_seconds_total": round(sum(waits), 3),
+                "wait_seconds_p50": round(waits[count // 2], 3) if count else 0.0,
+                "wait_seconds_p95": round(waits[min(count - 1, int(count * 0.95))], 3) if count else 0.0,
+                "wait_seconds_max": round(waits[-1], 3) if count else 0.0
+            }
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(endpoint):
+    """Return the worker-wide token bucket for an endpoint, sized from its configured quota"""
+    with _limiters_lock:
+        limiter = _limiters.get(endpoint)
+        if limiter is None:
+            env_name, default, period_seconds, burst_seconds = ENDPOINT_QUOTAS.get(endpoint, (None, 10, 1, 1))
+            quota = float(os.getenv(env_name, default)) if env_name else float(default)
+            rate_per_second = quota / period_seconds
+            limiter = TokenBucket(endpoint, rate_per_second, capacity=rate_per_second * burst_seconds)
+            _limiters[endpoint] = limiter
+            logging.info(f"Rate limiter '{endpoint}' sized at {limiter.rate_per_second:.2f} units/s")
+        return limiter
+
+
+def get_rate_limiter_stats():
+    """Return queue wait statistics for every endpoint limiter"""
+    with _limiters_lock:
+        limiters = dict(_limiters)
+    return {name: limiter.stats() for name, limiter in limiters.items()}
+
+
+def _status_and_headers(error):
+    """Extract the HTTP status and response headers from requests, azure-core, openai or aiohttp errors"""
+    response = getattr(error, "response", None)
+    status = (
+        getattr(error, "status_code", None)
+        or getattr(error, "status", None)
+        or getattr(response, "status_code", None)
+        or getattr(response, "status", None)
+    )
+    headers = getattr(response, "headers", None) or getattr(error, "headers", None) or {}
+    return status, headers
+
+
+def get_retry_after(headers):
+    """Parse Retry-After / retry-after-ms headers into seconds"""
+    if not headers:
+        return None
+    try:
+        retry_after_ms = headers.get("retry-after-ms") or headers.get("x-ms-retry-after-ms")
+        if retry_after_ms:
+            return float(retry_after_ms) / 1000.0
+        retry_after = headers.get("Retry-After") or headers.get("retry-after")
+        if retry_after:
+            return float(retry_after)
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def _is_connection_error(error):
+    """Return True for a connection failure or timeout that never produced an HTTP response"""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return any(error_type.__name__ in CONNECTION_ERROR_TYPES for error_type in type(error).__mro__)
+
+
+def _retry_delay(error, attempt):
+    """Return the delay before the next attempt, or None when the error is not retryable"""
+    status, headers = _status_and_headers(error)
+    if status is None and _is_connection_error(error):
+        return random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** attempt)))
+    if status not in RETRYABLE_STATUS_CODES:
+        return None
+    retry_after = get_retry_after(headers)
+    if retry_after is not None:
+        return retry_after * (1 + random.uniform(0, 0.1))
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * (2 ** attempt)))
+
+
+def _max_retries():
+    """Return the configured number of retries for throttled calls"""
+    return int(os.getenv("RATE_LIMIT_MAX_RETRIES", DEFAULT_MAX_RETRIES))
+
+
+def call_with_rate_limit(endpoint, func, cost=1, max_retries=None):
+    """
+    Call func under the endpoint's limiter, retrying 429/5xx with Retry-After or jittered
+    backoff, and connection resets and timeouts with jittered backoff
+    """
+    limiter = get_rate_limiter(endpoint)
+    max_retries = _max_retries() if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        waited = limiter.acquire(cost)
+        if waited > 0.05:
+            logging.info(f"[RateLimit-{endpoint}] Request waited {waited:.2f}s in queue")
+        try:
+            return func()
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt >= max_retries:
+                raise
+            attempt += 1
+            if _is_connection_error(e):
+                # Only this call failed; the endpoint's other callers are not held back
+                logging.warning(f"[RateLimit-{endpoint}] Connection failed ({e}); retry {attempt}/{max_retries} in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+            limiter.penalize(delay)
+            logging.warning(f"[RateLimit-{endpoint}] Throttled ({e}); retry {attempt}/{max_retries} in {delay:.2f}s")
+
+
+async def call_with_rate_limit_async(endpoint, func, cost=1, max_retries=None):
+    """Async counterpart of call_with_rate_limit; func returns an awaitable"""
+    limiter = get_rate_limiter(endpoint)
+    max_retries = _max_retries() if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        waited = await limiter.acquire_async(cost)
+        if waited > 0.05:
+            logging.info(f"[RateLimit-{endpoint}] Request waited {waited:.2f}s in queue")
+        try:
+            return await func()
+        except Exception as e:
+            delay = _retry_delay(e, attempt)
+            if delay is None or attempt >= max_retries:
+                raise
+            attempt += 1
+            if _is_connection_error(e):
+                logging.warning(f"[RateLimit-{endpoint}] Connection failed ({e}); retry {attempt}/{max_retries} in {delay:.2f}s")
+                await asyncio.sleep(delay)
+                continue
+            limiter.penalize(delay)
+            logging.warning(f"[RateLimit-{endpoint}] Throttled ({e}); retry {attempt}/{max_retries} in {delay:.2f}s")
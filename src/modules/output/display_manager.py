@@ -4,7 +4,9 @@ Handles comprehensive output display for all processing results
 """
 
 import logging
-import json
+
+from modules.utils.log_policy import log_items, log_payload, log_stage_summary
+from modules.utils.serialization import EncodedJson
 
 
 def display_complete_vision_output(vision_result, processing_stage=""):
@@ -13,8 +15,9 @@ def display_complete_vision_output(vision_result, processing_stage=""):
     logging.info(f"== COMPLETE AI VISION ANALYSIS OUTPUT {processing_stage} ==")
     logging.info("=" * 80)
     try:
-        complete_vision_output = json.dumps(vision_result, indent=2, ensure_ascii=False)
-        logging.info(f"Full AI Vision Analysis Results:\n{complete_vision_output}")
+        encoded_vision = EncodedJson(vision_result)
+        log_stage_summary("vision_output", payload_bytes=encoded_vision.size)
+        log_payload("Full AI Vision Analysis Results", encoded_vision.log_text())
     except Exception as e:
         logging.warning(f"Could not display complete Vision analysis: {e}")
         logging.info(f"Vision Analysis (string format): {str(vision_result)}")
@@ -27,25 +30,32 @@ def display_complete_llm_output(llm_result):
     logging.info("== COMPLETE LLM ANALYSIS OUTPUT ==")
     logging.info("=" * 80)
     try:
-        complete_llm_output = json.dumps(llm_result, indent=2, ensure_ascii=False)
-        logging.info(f"Full LLM Analysis Results:\n{complete_llm_output}")
+        encoded_llm = EncodedJson(llm_result)
+        log_stage_summary("llm_output", payload_bytes=encoded_llm.size)
+        log_payload("Full LLM Analysis Results", encoded_llm.log_text())
     except Exception as e:
         logging.warning(f"Could not display complete LLM analysis: {e}")
         logging.info(f"LLM Analysis (string format): {str(llm_result)}")
     logging.info("=" * 80)
 
 
-def display_final_concatenated_output(layout_data):
-    """Display the final concatenated output with all processing results"""
+def display_final_concatenated_output(layout_data, encoded_layout=None):
+    """Display the final concatenated output, reusing the layout's shared encoding when given"""
     logging.info("=" * 80)
     logging.info("== FINAL CONCATENATED PDF INFORMATION OUTPUT ==")
     logging.info("== ALL PROCESSING RESULTS COMBINED ==")
     logging.info("=" * 80)
     
     try:
-        final_complete_output = json.dumps(layout_data, indent=2, ensure_ascii=False)
-        logging.info("COMPLETE FINAL OUTPUT (All AI Processing Results):")
-        logging.info(final_complete_output)
+        encoded_layout = encoded_layout or EncodedJson(layout_data)
+        log_stage_summary(
+            "final_output",
+            payload_bytes=encoded_layout.size,
+            pages=len(layout_data.get("pages", [])),
+            vision_included="vision_analysis" in layout_data,
+            llm_included="llm_analysis" in layout_data
+        )
+        log_payload("COMPLETE FINAL OUTPUT (All AI Processing Results)", encoded_layout.log_text())
     except Exception as e:
         logging.warning(f"Could not display complete final output as JSON: {e}")
         _display_structured_fallback(layout_data)
@@ -70,16 +80,19 @@ def _display_structured_fallback(layout_data):
             
             if 'lines' in page:
                 logging.info(f"Text Lines ({len(page['lines'])}):")
-                for line in page['lines']:
-                    logging.info(f"  {line}")
+                log_items("  Line", page['lines'], total=len(page['lines']))
             
             if 'tables' in page:
                 logging.info(f"Tables ({len(page['tables'])}):")
                 for table_idx, table in enumerate(page['tables']):
                     logging.info(f"  Table {table_idx + 1}: {table.get('row_count', 0)} rows × {table.get('column_count', 0)} columns")
                     if 'cells' in table:
-                        for cell in table['cells']:
-                            logging.info(f"    [R{cell.get('row_index', 0)},C{cell.get('column_index', 0)}]: {cell.get('content', '')}")
+                        log_items(
+                            "    Cell",
+                            table['cells'],
+                            lambda cell: f"[R{cell.get('row_index', 0)},C{cell.get('column_index', 0)}]: {cell.get('content', '')}",
+                            total=len(table['cells'])
+                        )
     
     # Display Vision Analysis if available
     if 'vision_analysis' in layout_data:
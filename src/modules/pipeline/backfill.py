@@ -0,0 +1,340 @@
+"""
+Backfill Module
+Batch entry point that runs the processor modules over a local folder or a blob listing
+
+Usage: python -m modules.pipeline.backfill (--source-dir DIR | --container NAME [--prefix P])
+           [--manifest backfill_manifest.jsonl] [--workers 8] [--executor thread|process]
+           [--batch-size 50] [--skip-vision] [--skip-llm] [--retry-failed] [--limit N]
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+
+from modules.clients.rate_limiter import ENDPOINT_QUOTAS
+from modules.utils.tracing import finish_trace, span, start_trace
+
+
+DEFAULT_WORKERS = 8
+DEFAULT_BATCH_SIZE = 50
+PROGRESS_INTERVAL_SECONDS = 10
+DATABASE_NAME = "DocumentAnalysisDB"
+CONTAINER_NAME = "ProcessedDocuments"
+
+_blob_containers = {}
+_blob_containers_lock = threading.Lock()
+
+
+def backfill_document_id(name):
+    """Deterministic document id for a source, so re-running a backfill overwrites instead of duplicating"""
+    return "backfill-" + hashlib.sha256(name.encode("utf-8")).hexdigest()[:32]
+
+
+def iter_local_documents(directory, pattern=".pdf"):
+    """Yield a work item for every PDF under a directory, in a stable order"""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(pattern):
+                path = os.path.join(root, filename)
+                yield {"source": "local", "name": os.path.relpath(path, directory), "path": path}
+
+
+def _get_blob_container(container_name, connection_setting):
+    """Return this process's ContainerClient for a container"""
+    from azure.storage.blob import ContainerClient
+
+    key = (container_name, connection_setting)
+    with _blob_containers_lock:
+        container_client = _blob_containers.get(key)
+        if container_client is None:
+            connection_string = os.getenv(connection_setting)
+            if not connection_string:
+                raise ValueError(f"Blob backfill requires the {connection_setting} connection string")
+            container_client = ContainerClient.from_connection_string(connection_string, container_name)
+            _blob_containers[key] = container_client
+        return container_client
+
+
+def iter_blob_documents(container_name, prefix=None, connection_setting="invoicecontosostorage_STORAGE"):
+    """Yield a work item for every PDF blob, following the listing page by page"""
+    container_client = _get_blob_container(container_name, connection_setting)
+    for blob in container_client.list_blobs(name_starts_with=prefix):
+        if blob.name.lower().endswith(".pdf"):
+            yield {
+                "source": "blob",
+                "name": f"{container_name}/{blob.name}",
+                "container": container_name,
+                "blob": blob.name,
+                "connection_setting": connection_setting
+            }
+
+
+def _read_item(item):
+    """Return the PDF bytes of a work item"""
+    if item["source"] == "local":
+        with open(item["path"], "rb") as pdf_file:
+            return pdf_file.read()
+    container_client = _get_blob_container(item["container"], item["connection_setting"])
+    return container_client.download_blob(item["blob"]).readall()
+
+
+def process_backfill_document(item, options):
+    """
+    Run Document Intelligence, and optionally Vision and the LLM, for one work item.
+    Returns {"name", "document", "error"}; the document is ready for Cosmos and is
+    written by the coordinating process in bulk.
+    """
+    from modules.clients.client_registry import get_form_recognizer_client, get_openai_client, get_vision_client
+    from modules.processors.document_intelligence import LAYOUT_MODEL_ID, analyze_pdf_layout
+    from modules.processors.layout_templates import analyze_layout_with_templates
+    from modules.processors.page_rasterizer import rasterize_pdf_pages
+    from modules.processors.vision_processing import analyze_pages_with_vision
+    from modules.storage.cosmos_manager import prepare_document_for_storage
+
+    name = item["name"]
+    start_trace(name, mode="backfill")
+    try:
+        pdf_bytes = _read_item(item)
+        with span("stage.document_intelligence"):
+            layout_data = analyze_pdf_layout(get_form_recognizer_client(), pdf_bytes, model_id=LAYOUT_MODEL_ID)
+        layout_data["id"] = backfill_document_id(name)
+        layout_data["filename"] = os.path.basename(name)
+
+        if not options.get("skip_vision"):
+            with span("stage.vision"):
+                vision_config, vision_session = get_vision_client()
+                page_images = rasterize_pdf_pages(pdf_bytes, content_sha256=hashlib.sha256(pdf_bytes).hexdigest())
+                layout_data["vision_analysis"] = analyze_pages_with_vision(page_images, vision_config, session=vision_session)
+
+        if not options.get("skip_llm"):
+            with span("stage.llm"):
+                layout_data["llm_analysis"] = analyze_layout_with_templates(
+                    get_openai_client(),
+                    layout_data,
+                    deployment_name=os.getenv("AZURE_OPENAI_GPT4_DEPLOYMENT")
+                )
+
+        document = prepare_document_for_storage(layout_data, os.path.basename(name))
+        return {"name": name, "document": document, "error": None}
+    except Exception as e:
+        logging.error(f"Backfill failed for {name}: {e}")
+        return {"name": name, "document": None, "error": str(e)}
+    finally:
+        finish_trace()
+
+
+def _share_rate_limits(workers):
+    """Process-pool initializer: give each process an equal share of every endpoint quota"""
+    for env_name, default, _, _ in ENDPOINT_QUOTAS.values():
+        os.environ[env_name] = str(float(os.getenv(env_name, default)) / workers)
+
+
+class BackfillManifest:
+    """Append-only JSONL record of finished documents, read back to resume a run"""
+
+    def __init__(self, path):
+        self.path = path
+        self.completed = set()
+        self.failed = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as manifest_file:
+                for line in manifest_file:
+                    if not line.strip():
+                        continue
+                    entry = json.loads(line)
+                    if entry["status"] == "done":
+                        self.completed.add(entry["name"])
+                        self.failed.discard(entry["name"])
+                    else:
+                        self.failed.add(entry["name"])
+
+    def should_process(self, name, retry_failed=False):
+        """Skip documents already done, and earlier failures unless retrying them"""
+        if name in self.completed:
+            return False
+        return retry_failed or name not in self.failed
+
+    def record(self, name, status, document_id=None, error=None):
+        """Append one outcome; flushed immediately so an interrupted run can resume"""
+        entry = {
+            "name": name,
+            "status": status,
+            "document_id": document_id,
+            "error": error,
+            "finished_at": datetime.now(timezone.utc).isoformat()
+        }
+        with open(self.path, "a", encoding="utf-8") as manifest_file:
+            manifest_file.write(json.dumps(entry) + "\n")
+        (self.completed if status == "done" else self.failed).add(name)
+
+
+class BackfillProgress:
+    """Counts outcomes and logs throughput at a fixed interval"""
+
+    def __init__(self, total=None):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+        self._last_report = self.started
+
+    def throughput(self):
+        elapsed = time.monotonic() - self.started
+        return (self.done + self.failed) / elapsed if elapsed else 0.0
+
+    def report(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._last_report < PROGRESS_INTERVAL_SECONDS:
+            return
+        self._last_report = now
+        finished = self.done + self.failed
+        of_total = f"/{self.total}" if self.total else ""
+        logging.info(
+            f"Backfill progress: {finished}{of_total} finished ({self.done} stored, {self.failed} failed, "
+            f"{self.skipped} skipped from manifest), {self.throughput():.2f} docs/s"
+        )
+
+
+def _store_batch(container, batch, manifest, progress):
+    """Bulk upsert a batch of prepared documents and record each outcome in the manifest"""
+    from modules.storage.cosmos_manager import upsert_documents
+
+    summary = upsert_documents(container, [document for _, document in batch])
+    failures = dict(summary["failed"])
+    for name, document in batch:
+        if document["id"] in failures:
+            manifest.record(name, "failed", document["id"], failures[document["id"]])
+            progress.failed += 1
+        else:
+            manifest.record(name, "done", document["id"])
+            progress.done += 1
+
+
+def _get_target_container():
+    """Return the Cosmos container the backfill writes to"""
+    from modules.clients.client_registry import get_cosmos_client
+    from modules.storage.cosmos_manager import get_container
+
+    endpoint = os.getenv("COSMOS_DB_ENDPOINT")
+    key = os.getenv("COSMOS_DB_KEY")
+    if not endpoint or not key:
+        raise ValueError("Backfill requires COSMOS_DB_ENDPOINT and COSMOS_DB_KEY")
+    return get_container(get_cosmos_client(endpoint, key), DATABASE_NAME, CONTAINER_NAME)
+
+
+def run_backfill(items, manifest, workers=DEFAULT_WORKERS, executor_kind="thread", batch_size=DEFAULT_BATCH_SIZE,
+                 options=None, retry_failed=False, limit=None, total=None):
+    """
+    Process work items across a thread or process pool, keeping at most two per worker
+    in flight, and bulk upsert the results. Returns the final progress counters.
+    """
+    options = options or {}
+    container = _get_target_container()
+    progress = BackfillProgress(total)
+    if executor_kind == "process":
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_share_rate_limits, initargs=(workers,))
+    else:
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="backfill")
+
+    batch = []
+    in_flight = set()
+    submitted = 0
+
+    def collect(finished):
+        for future in finished:
+            result = future.result()
+            if result["error"]:
+                manifest.record(result["name"], "failed", error=result["error"])
+                progress.failed += 1
+            else:
+                batch.append((result["name"], result["document"]))
+        if len(batch) >= batch_size:
+            _store_batch(container, batch, manifest, progress)
+            batch.clear()
+        progress.report()
+
+    with executor:
+        for item in items:
+            if not manifest.should_process(item["name"], retry_failed):
+                progress.skipped += 1
+                continue
+            if limit is not None and submitted >= limit:
+                break
+            in_flight.add(executor.submit(process_backfill_document, item, options))
+            submitted += 1
+            if len(in_flight) >= workers * 2:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(finished)
+        while in_flight:
+            finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(finished)
+
+    if batch:
+        _store_batch(container, batch, manifest, progress)
+    progress.report(force=True)
+    return progress
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill historical PDFs through the processing pipeline")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--source-dir", help="local directory to walk for PDFs")
+    source.add_argument("--container", help="blob container to list")
+    parser.add_argument("--prefix", help="blob name prefix within the container")
+    parser.add_argument("--connection-setting", default="invoicecontosostorage_STORAGE",
+                        help="environment variable holding the storage connection string")
+    parser.add_argument("--manifest", default="backfill_manifest.jsonl")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS)
+    parser.add_argument("--executor", choices=("thread", "process"), default="thread")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--skip-vision", action="store_true")
+    parser.add_argument("--skip-llm", action="store_true")
+    parser.add_argument("--retry-failed", action="store_true", help="reprocess documents the manifest records as failed")
+    parser.add_argument("--limit", type=int, help="process at most this many documents in this run")
+    parser.add_argument("--verbose", action="store_true", help="also show per-document pipeline logs")
+    args = parser.parse_args()
+
+    # Progress is logged at INFO; the per-document pipeline INFO logs only with --verbose.
+    # The final summary is the only thing printed to stdout.
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    if not args.verbose:
+        for handler in logging.getLogger().handlers:
+            handler.addFilter(lambda record: record.levelno >= logging.WARNING or record.module == "backfill")
+    if args.source_dir:
+        items = list(iter_local_documents(args.source_dir))
+        total = len(items)
+    else:
+        items = iter_blob_documents(args.container, args.prefix, args.connection_setting)
+        total = None
+
+    manifest = BackfillManifest(args.manifest)
+    progress = run_backfill(
+        items,
+        manifest,
+        workers=args.workers,
+        executor_kind=args.executor,
+        batch_size=args.batch_size,
+        options={"skip_vision": args.skip_vision, "skip_llm": args.skip_llm},
+        retry_failed=args.retry_failed,
+        limit=args.limit,
+        total=total
+    )
+    print(json.dumps({
+        "stored": progress.done,
+        "failed": progress.failed,
+        "skipped": progress.skipped,
+        "docs_per_second": round(progress.throughput(), 3),
+        "manifest": args.manifest
+    }))
+
+
+if __name__ == "__main__":
+    main()
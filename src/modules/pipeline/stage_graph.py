@@ -0,0 +1,173 @@
+"""
+Stage Graph Module
+Runs pipeline stages concurrently while respecting their dependencies
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from modules.utils.tracing import span
+
+
+DEFAULT_MAX_WORKERS = 4
+
+
+def define_stage(name, func, depends_on=None, required=False):
+    """Describe a pipeline stage; func receives a dict of upstream results"""
+    return {
+        "name": name,
+        "func": func,
+        "depends_on": list(depends_on or []),
+        "required": required
+    }
+
+
+def _validate_stages(stages):
+    """Check that stage names are unique and every dependency exists"""
+    names = [stage["name"] for stage in stages]
+    if len(names) != len(set(names)):
+        raise ValueError(f"Duplicate stage names in pipeline: {names}")
+    for stage in stages:
+        missing = [dep for dep in stage["depends_on"] if dep not in names]
+        if missing:
+            raise ValueError(f"Stage '{stage['name']}' depends on unknown stages: {missing}")
+
+
+def _timed_call(stage, upstream, durations):
+    """Run a stage function and record its duration"""
+    start = time.perf_counter()
+    try:
+        with span(f"stage.{stage['name']}", required=stage["required"]):
+            return stage["func"](upstream)
+    finally:
+        durations[stage["name"]] = time.perf_counter() - start
+
+
+def run_stage_graph(stages, max_workers=None, errors=None):
+    """
+    Execute stages as soon as their dependencies have finished.
+    Optional stages that fail are recorded in errors and their dependents still run
+    with a None result; a failing required stage aborts the graph and re-raises
+    at once, without waiting for stages that are still running.
+    Pass an errors dict to let downstream stages inspect upstream failures.
+    Returns (results, errors, durations).
+    """
+    _validate_stages(stages)
+    if max_workers is None:
+        max_workers = int(os.getenv("PIPELINE_MAX_WORKERS", DEFAULT_MAX_WORKERS))
+
+    results = {}
+    if errors is None:
+        errors = {}
+    durations = {}
+    pending = {stage["name"]: stage for stage in stages}
+    running = {}
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pipeline-stage")
+    fail_fast = False
+    try:
+        while pending or running:
+            ready = [
+                stage for stage in pending.values()
+                if all(dep in results or dep in errors for dep in stage["depends_on"])
+            ]
+            for stage in ready:
+                del pending[stage["name"]]
+                upstream = {dep: results.get(dep) for dep in stage["depends_on"]}
+                logging.info(f"Starting pipeline stage '{stage['name']}'")
+                # Run in a copy of the caller's context so per-document context variables reach the stage
+                context = contextvars.copy_context()
+                running[executor.submit(context.run, _timed_call, stage, upstream, durations)] = stage
+
+            if not running:
+                raise RuntimeError(f"Pipeline stages cannot be scheduled: {list(pending)}")
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage = running.pop(future)
+                try:
+                    results[stage["name"]] = future.result()
+                    logging.info(
+                        f"Pipeline stage '{stage['name']}' finished in {durations[stage['name']]:.2f}s"
+                    )
+                except Exception as e:
+                    if stage["required"]:
+                        fail_fast = True
+                        raise
+                    logging.warning(f"Pipeline stage '{stage['name']}' failed (continuing without it): {e}")
+                    errors[stage["name"]] = e
+    finally:
+        # After a required stage fails, queued stages are cancelled and running ones
+        # finish in the background instead of holding up the failed invocation
+        executor.shutdown(wait=not fail_fast, cancel_futures=fail_fast)
+
+    return results, errors, durations
+
+
+async def _timed_call_async(stage, upstream, durations):
+    """Await a coroutine stage function and record its duration"""
+    start = time.perf_counter()
+    try:
+        with span(f"stage.{stage['name']}", required=stage["required"]):
+            return await stage["func"](upstream)
+    finally:
+        durations[stage["name"]] = time.perf_counter() - start
+
+
+async def run_stage_graph_async(stages, max_concurrency=None, errors=None):
+    """
+    Async counterpart of run_stage_graph for coroutine stage functions.
+    Stages run as asyncio tasks bounded by a semaphore, with the same
+    failure semantics and return value as run_stage_graph.
+    """
+    _validate_stages(stages)
+    if max_concurrency is None:
+        max_concurrency = int(os.getenv("PIPELINE_MAX_WORKERS", DEFAULT_MAX_WORKERS))
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def bounded(stage, upstream):
+        async with semaphore:
+            return await _timed_call_async(stage, upstream, durations)
+
+    results = {}
+    if errors is None:
+        errors = {}
+    durations = {}
+    pending = {stage["name"]: stage for stage in stages}
+    running = {}
+
+    while pending or running:
+        ready = [
+            stage for stage in pending.values()
+            if all(dep in results or dep in errors for dep in stage["depends_on"])
+        ]
+        for stage in ready:
+            del pending[stage["name"]]
+            upstream = {dep: results.get(dep) for dep in stage["depends_on"]}
+            logging.info(f"Starting pipeline stage '{stage['name']}'")
+            running[asyncio.ensure_future(bounded(stage, upstream))] = stage
+
+        if not running:
+            raise RuntimeError(f"Pipeline stages cannot be scheduled: {list(pending)}")
+
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            stage = running.pop(task)
+            try:
+                results[stage["name"]] = task.result()
+                logging.info(
+                    f"Pipeline stage '{stage['name']}' finished in {durations[stage['name']]:.2f}s"
+                )
+            except Exception as e:
+                if stage["required"]:
+                    for other in running:
+                        other.cancel()
+                    raise
+                logging.warning(f"Pipeline stage '{stage['name']}' failed (continuing without it): {e}")
+                errors[stage["name"]] = e
+
+    return results, errors, durations
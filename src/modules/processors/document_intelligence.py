@@ -3,24 +3,149 @@ Document Processor Module
 Handles Document Intelligence processing and data extraction
 """
 
+import asyncio
 import logging
+import os
 import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
+from modules.clients.rate_limiter import call_with_rate_limit, call_with_rate_limit_async
+from modules.processors.layout_model import LayoutTable, SelectionMarks
+from modules.processors.page_rasterizer import count_pdf_pages
+from modules.storage.document_source import probe_pdf_page_count
+from modules.utils.log_policy import log_items, log_stage_summary
+from modules.utils.tracing import map_in_context, span
 
-def analyze_pdf(form_recognizer_client, pdf_bytes):
-    """Analyze PDF using Azure Document Intelligence"""
-    logging.info("Starting PDF layout analysis.")
-    poller = form_recognizer_client.begin_analyze_document(
-        model_id="prebuilt-layout",
-        document=pdf_bytes
-    )
+
+LAYOUT_MODEL_ID = "prebuilt-layout"
+DEFAULT_SHARD_PAGE_COUNT = 50
+DEFAULT_SHARD_CONCURRENCY = 4
+# Submits are retried only by call_with_rate_limit (which honours Retry-After); the
+# SDK's retry policy still covers the poll requests, which the quota does not meter
+SUBMIT_RETRY_TOTAL = 0
+
+
+def analyze_pdf(form_recognizer_client, pdf_bytes, model_id=LAYOUT_MODEL_ID, pages=None):
+    """Analyze PDF (optionally only a page range such as "1-50") using Azure Document Intelligence"""
+    logging.info(f"Starting PDF layout analysis{f' for pages {pages}' if pages else ''}.")
+    options = {"pages": pages} if pages else {}
+    with span("document_intelligence.submit", model_id=model_id, pages=pages or "all", payload_bytes=len(pdf_bytes)):
+        poller = call_with_rate_limit(
+            "document_intelligence",
+            lambda: form_recognizer_client.begin_analyze_document(
+                model_id=model_id,
+                document=pdf_bytes,
+                retry_total=SUBMIT_RETRY_TOTAL,
+                **options
+            )
+        )
+    logging.info("PDF layout analysis in progress.")
+    with span("document_intelligence.poll") as poll_span:
+        result = poller.result()
+        poll_span.set_attribute("result_pages", len(result.pages))
+    logging.info("PDF layout analysis completed.")
+    logging.info(f"Document has {len(result.pages)} page(s), {len(result.tables)} table(s), and {len(result.styles)} style(s).")
+    return result
+
+
+def analyze_pdf_from_url(form_recognizer_client, document_url, model_id=LAYOUT_MODEL_ID, pages=None):
+    """Analyze a PDF that Document Intelligence fetches itself from a (SAS) URL"""
+    logging.info("Starting PDF layout analysis from document URL.")
+    options = {"pages": pages} if pages else {}
+    with span("document_intelligence.submit", model_id=model_id, pages=pages or "all", by_reference=True):
+        poller = call_with_rate_limit(
+            "document_intelligence",
+            lambda: form_recognizer_client.begin_analyze_document_from_url(
+                model_id=model_id,
+                document_url=document_url,
+                retry_total=SUBMIT_RETRY_TOTAL,
+                **options
+            )
+        )
+    logging.info("PDF layout analysis in progress.")
+    with span("document_intelligence.poll") as poll_span:
+        result = poller.result()
+        poll_span.set_attribute("result_pages", len(result.pages))
+    logging.info("PDF layout analysis completed.")
+    logging.info(f"Document has {len(result.pages)} page(s), {len(result.tables)} table(s), and {len(result.styles)} style(s).")
+    return result
+
+
+async def analyze_pdf_from_url_async(form_recognizer_client, document_url, model_id=LAYOUT_MODEL_ID, pages=None):
+    """Analyze a PDF from a (SAS) URL using the async Azure Document Intelligence client"""
+    logging.info("Starting async PDF layout analysis from document URL.")
+    options = {"pages": pages} if pages else {}
+    with span("document_intelligence.submit", model_id=model_id, pages=pages or "all", by_reference=True):
+        poller = await call_with_rate_limit_async(
+            "document_intelligence",
+            lambda: form_recognizer_client.begin_analyze_document_from_url(
+                model_id=model_id,
+                document_url=document_url,
+                retry_total=SUBMIT_RETRY_TOTAL,
+                **options
+            )
+        )
     logging.info("PDF layout analysis in progress.")
-    result = poller.result()
+    with span("document_intelligence.poll") as poll_span:
+        result = await poller.result()
+        poll_span.set_attribute("result_pages", len(result.pages))
     logging.info("PDF layout analysis completed.")
     logging.info(f"Document has {len(result.pages)} page(s), {len(result.tables)} table(s), and {len(result.styles)} style(s).")
     return result
 
 
+async def analyze_pdf_async(form_recognizer_client, pdf_bytes, model_id=LAYOUT_MODEL_ID, pages=None):
+    """Analyze PDF (optionally only a page range) using the async Azure Document Intelligence client"""
+    logging.info(f"Starting async PDF layout analysis{f' for pages {pages}' if pages else ''}.")
+    options = {"pages": pages} if pages else {}
+    with span("document_intelligence.submit", model_id=model_id, pages=pages or "all", payload_bytes=len(pdf_bytes)):
+        poller = await call_with_rate_limit_async(
+            "document_intelligence",
+            lambda: form_recognizer_client.begin_analyze_document(
+                model_id=model_id,
+                document=pdf_bytes,
+                retry_total=SUBMIT_RETRY_TOTAL,
+                **options
+            )
+        )
+    logging.info("PDF layout analysis in progress.")
+    with span("document_intelligence.poll") as poll_span:
+        result = await poller.result()
+        poll_span.set_attribute("result_pages", len(result.pages))
+    logging.info("PDF layout analysis completed.")
+    logging.info(f"Document has {len(result.pages)} page(s), {len(result.tables)} table(s), and {len(result.styles)} style(s).")
+    return result
+
+
+def build_page_index(items):
+    """Map each page number to the indexes of items that have a bounding region on it, in one pass"""
+    index = defaultdict(list)
+    for item_index, item in enumerate(items or []):
+        seen_pages = set()
+        for region in item.bounding_regions or []:
+            if region.page_number not in seen_pages:
+                seen_pages.add(region.page_number)
+                index[region.page_number].append(item_index)
+    return index
+
+
+def _build_table_data(table, table_index, page_numbers):
+    """Convert a Document Intelligence table into a compact layout table"""
+    table_data = LayoutTable(table_index, page_numbers, table.row_count, table.column_count)
+    for cell in table.cells:
+        table_data.cells.add(cell.row_index, cell.column_index, cell.content, cell.row_span, cell.column_span)
+    return table_data
+
+
+def _build_selection_marks(marks):
+    """Convert Document Intelligence selection marks into compact columnar storage"""
+    selection_marks = SelectionMarks()
+    for mark in marks or []:
+        selection_marks.add(mark.state, mark.confidence)
+    return selection_marks
+
+
 def extract_layout_data(result):
     """Extract structured data from Document Intelligence results"""
     logging.info("Extracting layout data from analysis result.")
@@ -30,61 +155,258 @@ def extract_layout_data(result):
         "pages": []
     }
 
-    # Log styles
-    for idx, style in enumerate(result.styles):
-        content_type = "handwritten" if style.is_handwritten else "no handwritten"
-        logging.info(f"Document contains {content_type} content")
+    # Index tables and paragraphs by page once instead of rescanning them for every page
+    tables = result.tables or []
+    paragraphs = getattr(result, "paragraphs", None) or []
+    tables_by_page = build_page_index(tables)
+    paragraphs_by_page = build_page_index(paragraphs)
+
+    table_pages = defaultdict(list)
+    for page_number in sorted(tables_by_page):
+        for table_index in tables_by_page[page_number]:
+            table_pages[table_index].append(page_number)
 
     # Process each page
     for page in result.pages:
-        logging.info(f"--- Page {page.page_number} ---")
         page_data = {
             "page_number": page.page_number,
             "lines": [line.content for line in page.lines],
             "tables": [],
-            "selection_marks": [
-                {"state": mark.state, "confidence": mark.confidence}
-                for mark in page.selection_marks
+            "selection_marks": _build_selection_marks(page.selection_marks),
+            # Only role-tagged paragraphs (titles, headings, headers/footers); body text is in lines
+            "paragraphs": [
+                {"role": paragraphs[paragraph_index].role, "content": paragraphs[paragraph_index].content}
+                for paragraph_index in paragraphs_by_page.get(page.page_number, [])
+                if paragraphs[paragraph_index].role
             ]
         }
 
-        # Log extracted lines
-        for line_idx, line in enumerate(page.lines):
-            logging.info(f"Line {line_idx}: '{line.content}'")
+        # Extract tables; a table spanning several pages is stored once on its first page
+        continued_tables = []
+        for table_index in tables_by_page.get(page.page_number, []):
+            table = tables[table_index]
+            page_numbers = table_pages[table_index]
+            if page_numbers[0] != page.page_number:
+                continued_tables.append(table_index)
+                continue
 
-        # Log selection marks
-        for selection_mark in page.selection_marks:
-            logging.info(
-                f"Selection mark is '{selection_mark.state}' with confidence {selection_mark.confidence}"
-            )
+            page_data["tables"].append(_build_table_data(table, table_index, page_numbers))
 
-        # Extract tables
-        page_tables = [
-            table for table in result.tables
-            if any(region.page_number == page.page_number for region in table.bounding_regions)
-        ]
-
-        for table_index, table in enumerate(page_tables):
-            logging.info(f"Table {table_index}: {table.row_count} rows, {table.column_count} columns")
-            
-            table_data = {
-                "row_count": table.row_count,
-                "column_count": table.column_count,
-                "cells": []
-            }
-
-            for cell in table.cells:
-                cell_data = {
-                    "row_index": cell.row_index,
-                    "column_index": cell.column_index,
-                    "content": cell.content,
-                    "row_span": cell.row_span,
-                    "column_span": cell.column_span
-                }
-                table_data["cells"].append(cell_data)
-            
-            page_data["tables"].append(table_data)
+        if continued_tables:
+            page_data["continued_tables"] = continued_tables
 
         layout_data["pages"].append(page_data)
 
+    _log_extraction(layout_data, result)
+    return layout_data
+
+
+def _log_extraction(layout_data, result):
+    """Log sampled lines and tables (per LOG_DETAIL_LEVEL) and one summary record for the extraction"""
+    pages = layout_data["pages"]
+    line_count = sum(len(page["lines"]) for page in pages)
+    tables = [table for page in pages for table in page["tables"]]
+    log_items(
+        "Line",
+        ((page["page_number"], line) for page in pages for line in page["lines"]),
+        lambda item: f"(page {item[0]}) '{item[1]}'",
+        total=line_count
+    )
+    log_items(
+        "Table",
+        tables,
+        lambda table: f"#{table['table_index']} pages {table['page_numbers']}: "
+                      f"{table['row_count']} rows, {table['column_count']} columns",
+        total=len(tables)
+    )
+    log_stage_summary(
+        "document_intelligence_extraction",
+        pages=len(pages),
+        lines=line_count,
+        tables=len(tables),
+        table_cells=sum(len(table["cells"]) for table in tables),
+        selection_marks=sum(len(page["selection_marks"]) for page in pages),
+        role_paragraphs=sum(len(page["paragraphs"]) for page in pages),
+        handwritten_styles=sum(1 for style in result.styles or [] if style.is_handwritten)
+    )
+
+
+def is_sharding_enabled():
+    """Return True when large PDFs should be split into page-range shards"""
+    return os.getenv("DI_SHARDING_ENABLED", "false").lower() in ("1", "true", "yes")
+
+
+def plan_page_shards(page_count, shard_page_count=None):
+    """Return page-range strings ("1-50", "51-100", ...) covering the document"""
+    shard_page_count = shard_page_count or int(os.getenv("DI_SHARD_PAGE_COUNT", DEFAULT_SHARD_PAGE_COUNT))
+    return [
+        f"{start}-{min(start + shard_page_count - 1, page_count)}"
+        for start in range(1, page_count + 1, shard_page_count)
+    ]
+
+
+def _shard_plan(pdf_bytes, document_url=None):
+    """
+    Return the shard page ranges for a PDF, or an empty list when it should not be sharded.
+    A referenced PDF's page count comes from ranged reads of the blob instead of its bytes.
+    """
+    if not is_sharding_enabled():
+        return []
+    page_count = probe_pdf_page_count(document_url) if document_url else count_pdf_pages(pdf_bytes)
+    if not page_count and document_url:
+        logging.info("Page count of the referenced PDF is unknown, analyzing it without sharding")
+    shards = plan_page_shards(page_count) if page_count else []
+    if len(shards) <= 1:
+        return []
+    logging.info(f"Sharding {page_count}-page PDF into {len(shards)} page ranges: {shards}")
+    return shards
+
+
+def _shard_pages(shards):
+    """Return the page numbers a shard plan covers"""
+    pages = []
+    for page_range in shards:
+        first, _, last = page_range.partition("-")
+        pages.extend(range(int(first), int(last or first) + 1))
+    return pages
+
+
+def _covers_shard_plan(layout_data, shards):
+    """Check that a stitched layout has exactly the pages of its shard plan, logging an error if not"""
+    expected = _shard_pages(shards)
+    actual = [page["page_number"] for page in layout_data.get("pages", [])]
+    if actual == expected:
+        return True
+    logging.error(
+        f"Stitched layout has {len(actual)} pages but the shard plan covers {len(expected)} "
+        f"({shards}); the page count was wrong, analyzing the document without sharding"
+    )
+    return False
+
+
+def _continues_table(previous, table):
+    """Check whether a table on a shard's first page continues the previous shard's last table"""
+    return (
+        previous.column_count == table.column_count
+        and table.page_numbers[0] == previous.page_numbers[-1] + 1
+    )
+
+
+def _append_table_rows(previous, table):
+    """Append a continuation table's rows to the previous table, dropping a repeated header row"""
+    skip_header = table.row_count > 0 and table.cells.row_contents(0) == previous.cells.row_contents(0)
+    first_row = 1 if skip_header else 0
+    previous.cells.extend_rows(table.cells, first_row, previous.row_count - first_row)
+    previous.row_count += table.row_count - first_row
+    previous.page_numbers.extend(
+        page_number for page_number in table.page_numbers if page_number not in previous.page_numbers
+    )
+
+
+def stitch_layout_shards(shard_layouts):
+    """
+    Combine per-shard layouts into one layout. Page numbers are already global;
+    tables are renumbered across shards and a table that runs across a shard
+    boundary (same column count, next page, first table on the page) is merged.
+    """
+    shard_layouts = sorted(
+        (shard for shard in shard_layouts if shard.get("pages")),
+        key=lambda shard: shard["pages"][0]["page_number"]
+    )
+    stitched = {"id": shard_layouts[0]["id"] if shard_layouts else str(uuid.uuid4()), "pages": []}
+    next_table_index = 0
+    previous_tail = None
+
+    for shard in shard_layouts:
+        pages = shard["pages"]
+        index_map = {}
+        shard_tables = []
+
+        for page_position, page in enumerate(pages):
+            kept_tables = []
+            joined_tables = []
+            for table_position, table in enumerate(page["tables"]):
+                local_index = table.table_index
+                if (previous_tail and page_position == 0 and table_position == 0
+                        and _continues_table(previous_tail, table)):
+                    _append_table_rows(previous_tail, table)
+                    index_map[local_index] = previous_tail.table_index
+                    joined_tables.append(previous_tail.table_index)
+                    continue
+                index_map[local_index] = next_table_index
+                table.table_index = next_table_index
+                next_table_index += 1
+                kept_tables.append(table)
+                shard_tables.append(table)
+            page["tables"] = kept_tables
+
+            continued = [index_map.get(index, index) for index in page.pop("continued_tables", [])]
+            continued = joined_tables + continued
+            if continued:
+                page["continued_tables"] = continued
+            stitched["pages"].append(page)
+
+        last_page_number = pages[-1]["page_number"]
+        ending_tables = [table for table in shard_tables if table.page_numbers[-1] == last_page_number]
+        if ending_tables:
+            previous_tail = ending_tables[-1]
+        elif not (previous_tail and previous_tail.page_numbers[-1] == last_page_number):
+            previous_tail = None
+
+    stitched["shard_count"] = len(shard_layouts)
+    return stitched
+
+
+def analyze_pdf_layout(form_recognizer_client, pdf_bytes, model_id=LAYOUT_MODEL_ID, max_concurrency=None, document_url=None):
+    """
+    Analyze a PDF and return layout data, sharding large documents by page range when enabled.
+    When document_url is given the service fetches the PDF (or each page range) itself.
+    """
+    def analyze_pages(pages):
+        if document_url:
+            return analyze_pdf_from_url(form_recognizer_client, document_url, model_id=model_id, pages=pages)
+        return analyze_pdf(form_recognizer_client, pdf_bytes, model_id=model_id, pages=pages)
+
+    shards = _shard_plan(pdf_bytes, document_url)
+    if not shards:
+        return extract_layout_data(analyze_pages(None))
+
+    max_concurrency = max_concurrency or int(os.getenv("DI_SHARD_CONCURRENCY", DEFAULT_SHARD_CONCURRENCY))
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="di-shard") as executor:
+        shard_layouts = map_in_context(
+            executor,
+            lambda pages: extract_layout_data(analyze_pages(pages)),
+            shards
+        )
+    layout_data = stitch_layout_shards(shard_layouts)
+    if not _covers_shard_plan(layout_data, shards):
+        return extract_layout_data(analyze_pages(None))
+    return layout_data
+
+
+async def analyze_pdf_layout_async(form_recognizer_client, pdf_bytes, model_id=LAYOUT_MODEL_ID, max_concurrency=None, document_url=None):
+    """Async counterpart of analyze_pdf_layout"""
+    async def analyze_pages(pages):
+        if document_url:
+            return await analyze_pdf_from_url_async(form_recognizer_client, document_url, model_id=model_id, pages=pages)
+        return await analyze_pdf_async(form_recognizer_client, pdf_bytes, model_id=model_id, pages=pages)
+
+    # The page-count probe makes blocking ranged reads, so it runs off the event loop
+    shards = await asyncio.to_thread(_shard_plan, pdf_bytes, document_url)
+    if not shards:
+        return extract_layout_data(await analyze_pages(None))
+
+    semaphore = asyncio.Semaphore(
+        max_concurrency or int(os.getenv("DI_SHARD_CONCURRENCY", DEFAULT_SHARD_CONCURRENCY))
+    )
+
+    async def analyze_shard(pages):
+        async with semaphore:
+            result = await analyze_pages(pages)
+        return extract_layout_data(result)
+
+    shard_layouts = await asyncio.gather(*(analyze_shard(pages) for pages in shards))
+    layout_data = stitch_layout_shards(shard_layouts)
+    if not _covers_shard_plan(layout_data, shards):
+        return extract_layout_data(await analyze_pages(None))
     return layout_data
@@ -0,0 +1,165 @@
+"""
+Image Preprocessing Module
+Normalizes, downsamples, recompresses and tiles images before Vision and multimodal LLM calls
+"""
+
+import base64
+import logging
+import os
+from io import BytesIO
+
+from modules.utils.lazy_imports import is_module_available, lazy_module
+from modules.utils.tracing import set_span_attribute
+
+# Pillow is loaded the first time an image is preprocessed
+Image = lazy_module("PIL.Image")
+ImageOps = lazy_module("PIL.ImageOps")
+
+
+TARGET_VISION = "vision"
+TARGET_LLM = "llm"
+
+# Image Analysis reads text well at about 2048 px on the long side; GPT-4 vision scales
+# high-detail images to fit 2048 px and then to 768 px on the short side, so more is wasted
+TARGET_LIMITS = {
+    TARGET_VISION: {"max_dimension": 2048, "max_short_side": None, "max_bytes": 1536 * 1024, "tile": True},
+    TARGET_LLM: {"max_dimension": 2048, "max_short_side": 768, "max_bytes": 512 * 1024, "tile": False}
+}
+JPEG_QUALITY_STEPS = (85, 75, 65, 55)
+MIN_SCALE_STEP = 0.75
+MAX_SHRINK_ROUNDS = 4
+TILE_OVERLAP = 64
+MAX_LLM_IMAGES = 5
+
+
+def is_preprocessing_enabled():
+    """Return False when IMAGE_PREPROCESSING is disabled or Pillow is not installed"""
+    if os.getenv("IMAGE_PREPROCESSING", "true").lower() in ("0", "false", "no"):
+        return False
+    return is_module_available("PIL")
+
+
+def _limits(target):
+    """Return the size limits for a target, with environment overrides"""
+    limits = dict(TARGET_LIMITS[target])
+    prefix = "VISION" if target == TARGET_VISION else "LLM"
+    limits["max_dimension"] = int(os.getenv(f"{prefix}_IMAGE_MAX_DIMENSION", limits["max_dimension"]))
+    limits["max_bytes"] = int(os.getenv(f"{prefix}_IMAGE_MAX_BYTES", limits["max_bytes"]))
+    return limits
+
+
+def _fit_size(width, height, max_dimension, max_short_side=None):
+    """Return the (width, height) that fits the limits, never enlarging"""
+    scale = min(1.0, max_dimension / max(width, height))
+    if max_short_side:
+        scale = min(scale, max_short_side / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _normalize(image):
+    """Apply the EXIF orientation and convert to RGB (alpha flattened onto white)"""
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    if image.mode != "RGB":
+        return image.convert("RGB")
+    return image
+
+
+def _encode_jpeg(image, max_bytes):
+    """JPEG-encode within max_bytes, lowering quality and then resolution as needed"""
+    for _ in range(MAX_SHRINK_ROUNDS):
+        for quality in JPEG_QUALITY_STEPS:
+            output = BytesIO()
+            image.save(output, format="JPEG", quality=quality, optimize=True)
+            if output.tell() <= max_bytes:
+                return output.getvalue(), image
+        image = image.resize(
+            (max(1, int(image.width * MIN_SCALE_STEP)), max(1, int(image.height * MIN_SCALE_STEP))),
+            Image.LANCZOS
+        )
+    return output.getvalue(), image
+
+
+def _tiles(image, tile_size):
+    """Split an image into overlapping tiles of at most tile_size pixels per side"""
+    step = tile_size - TILE_OVERLAP
+    boxes = []
+    for top in range(0, max(1, image.height - TILE_OVERLAP), step):
+        for left in range(0, max(1, image.width - TILE_OVERLAP), step):
+            boxes.append((left, top, min(left + tile_size, image.width), min(top + tile_size, image.height)))
+    return [image.crop(box) for box in boxes]
+
+
+def _result(images, original_bytes):
+    """Bundle prepared images with their byte accounting"""
+    prepared_bytes = sum(len(image["image_bytes"]) for image in images)
+    return {
+        "images": images,
+        "original_bytes": original_bytes,
+        "prepared_bytes": prepared_bytes,
+        "saved_bytes": original_bytes - prepared_bytes
+    }
+
+
+def preprocess_image(image_bytes, target=TARGET_VISION):
+    """
+    Prepare one image for a target ("vision" or "llm"). Returns {"images", "original_bytes",
+    "prepared_bytes", "saved_bytes"}; images holds one image, or overlapping tiles for
+    very large scans sent to Vision, each with image_bytes, content_type, width and height.
+    The input is passed through when preprocessing is off, it cannot be decoded, or it would not shrink.
+    """
+    original = {"image_bytes": image_bytes, "content_type": "application/octet-stream", "width": None, "height": None}
+    if not is_preprocessing_enabled():
+        return _result([original], len(image_bytes))
+
+    limits = _limits(target)
+    try:
+        with Image.open(BytesIO(image_bytes)) as source:
+            source_format = (source.format or "").lower()
+            image = _normalize(source)
+    except Exception as e:
+        logging.warning(f"Could not decode image for preprocessing, sending it unchanged: {e}")
+        return _result([original], len(image_bytes))
+    if source_format in ("jpeg", "png", "gif", "bmp", "tiff", "webp"):
+        original.update({"content_type": f"image/{source_format}", "width": image.width, "height": image.height})
+
+    # Scans more than twice the target size would lose legibility when downsampled; tile them instead
+    if limits["tile"] and max(image.size) > 2 * limits["max_dimension"]:
+        parts = _tiles(image, limits["max_dimension"])
+    else:
+        fitted = _fit_size(*image.size, limits["max_dimension"], limits["max_short_side"])
+        parts = [image if fitted == image.size else image.resize(fitted, Image.LANCZOS)]
+
+    prepared = []
+    for part in parts:
+        data, encoded = _encode_jpeg(part, limits["max_bytes"])
+        prepared.append({"image_bytes": data, "content_type": "image/jpeg", "width": encoded.width, "height": encoded.height})
+
+    result = _result(prepared, len(image_bytes))
+    if len(prepared) == 1 and result["saved_bytes"] <= 0 and len(image_bytes) <= limits["max_bytes"] \
+            and parts[0].size == image.size:
+        return _result([original], len(image_bytes))
+
+    set_span_attribute("saved_bytes", result["saved_bytes"])
+    logging.info(
+        f"Preprocessed {target} image {image.width}x{image.height} ({result['original_bytes']} bytes) into "
+        f"{len(prepared)} image(s) of {result['prepared_bytes']} bytes, saved {result['saved_bytes']} bytes"
+    )
+    return result
+
+
+def prepare_images_for_llm(images, max_images=MAX_LLM_IMAGES):
+    """Return data URLs for up to max_images images (bytes or base64 strings), downsampled for the LLM"""
+    data_urls = []
+    for image in images[:max_images]:
+        image_bytes = base64.b64decode(image) if isinstance(image, str) else image
+        prepared = preprocess_image(image_bytes, TARGET_LLM)["images"][0]
+        content_type = prepared["content_type"]
+        if not content_type.startswith("image/"):
+            content_type = "image/jpeg"
+        data_urls.append(f"data:{content_type};base64,{base64.b64encode(prepared['image_bytes']).decode('ascii')}")
+    return data_urls
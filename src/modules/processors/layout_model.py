@@ -0,0 +1,215 @@
+"""
+Layout Model Module
+Compact, column-oriented storage for table cells and selection marks that serializes lazily
+"""
+
+from array import array
+
+
+class StringTable:
+    """Interns repeated strings so each distinct value is stored once"""
+
+    __slots__ = ("values", "_ids")
+
+    def __init__(self):
+        self.values = []
+        self._ids = {}
+
+    def intern(self, value):
+        """Return the id of a string, adding it on first use"""
+        value = value or ""
+        string_id = self._ids.get(value)
+        if string_id is None:
+            string_id = len(self.values)
+            self._ids[value] = string_id
+            self.values.append(value)
+        return string_id
+
+    def __getstate__(self):
+        return self.values
+
+    def __setstate__(self, values):
+        self.values = values
+        self._ids = {value: string_id for string_id, value in enumerate(values)}
+
+
+class TableCells:
+    """Table cells stored as parallel int arrays plus a string table instead of one dict per cell"""
+
+    __slots__ = ("row_index", "column_index", "row_span", "column_span", "content_id", "strings")
+
+    def __init__(self):
+        self.row_index = array("i")
+        self.column_index = array("i")
+        self.row_span = array("i")
+        self.column_span = array("i")
+        self.content_id = array("i")
+        self.strings = StringTable()
+
+    @classmethod
+    def from_list(cls, cells):
+        """Build compact cells from the JSON cell shape"""
+        compact = cls()
+        for cell in cells or []:
+            compact.append(cell)
+        return compact
+
+    def add(self, row_index, column_index, content, row_span=1, column_span=1):
+        """Append one cell"""
+        self.row_index.append(row_index)
+        self.column_index.append(column_index)
+        self.row_span.append(row_span or 1)
+        self.column_span.append(column_span or 1)
+        self.content_id.append(self.strings.intern(content))
+
+    def append(self, cell):
+        """Append a cell given in the JSON cell shape"""
+        self.add(
+            cell.get("row_index", 0),
+            cell.get("column_index", 0),
+            cell.get("content", ""),
+            cell.get("row_span", 1),
+            cell.get("column_span", 1)
+        )
+
+    def content(self, position):
+        """Return the content of the cell at a position"""
+        return self.strings.values[self.content_id[position]]
+
+    def cell(self, position):
+        """Materialize one cell in the JSON cell shape"""
+        return {
+            "row_index": self.row_index[position],
+            "column_index": self.column_index[position],
+            "content": self.content(position),
+            "row_span": self.row_span[position],
+            "column_span": self.column_span[position]
+        }
+
+    def __len__(self):
+        return len(self.row_index)
+
+    def __iter__(self):
+        for position in range(len(self.row_index)):
+            yield self.cell(position)
+
+    def to_list(self):
+        """Serialize to the JSON cell list"""
+        return list(self)
+
+    def grid(self, row_count, column_count):
+        """Place cell contents on a row x column grid without materializing cell dicts"""
+        grid = [[""] * column_count for _ in range(row_count)]
+        values = self.strings.values
+        for row, column, content_id in zip(self.row_index, self.column_index, self.content_id):
+            if row < row_count and column < column_count:
+                grid[row][column] = values[content_id]
+        return grid
+
+    def row_contents(self, row_index):
+        """Return the contents of one row ordered by column"""
+        row = sorted(
+            (column, content_id)
+            for row, column, content_id in zip(self.row_index, self.column_index, self.content_id)
+            if row == row_index
+        )
+        return [self.strings.values[content_id] for _, content_id in row]
+
+    def extend_rows(self, other, first_row=0, row_offset=0):
+        """Append the cells of another table from first_row on, shifting their row index"""
+        for position in range(len(other)):
+            if other.row_index[position] >= first_row:
+                self.add(
+                    other.row_index[position] + row_offset,
+                    other.column_index[position],
+                    other.content(position),
+                    other.row_span[position],
+                    other.column_span[position]
+                )
+
+
+class LayoutTable:
+    """A layout table; also readable with the dict-style access used by the JSON shape"""
+
+    __slots__ = ("table_index", "page_numbers", "row_count", "column_count", "cells")
+
+    def __init__(self, table_index, page_numbers, row_count, column_count, cells=None):
+        self.table_index = table_index
+        self.page_numbers = page_numbers
+        self.row_count = row_count
+        self.column_count = column_count
+        self.cells = cells if cells is not None else TableCells()
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        """Dict-style lookup"""
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def to_dict(self):
+        """Serialize to the JSON table shape"""
+        return {
+            "table_index": self.table_index,
+            "page_numbers": list(self.page_numbers),
+            "row_count": self.row_count,
+            "column_count": self.column_count,
+            "cells": self.cells.to_list()
+        }
+
+
+class SelectionMarks:
+    """Selection marks stored as a state string table plus a confidence array"""
+
+    __slots__ = ("state_id", "confidence", "strings")
+
+    def __init__(self):
+        self.state_id = array("i")
+        self.confidence = array("d")
+        self.strings = StringTable()
+
+    def add(self, state, confidence):
+        """Append one selection mark"""
+        self.state_id.append(self.strings.intern(state))
+        self.confidence.append(confidence if confidence is not None else 0.0)
+
+    def __len__(self):
+        return len(self.state_id)
+
+    def __iter__(self):
+        for state_id, confidence in zip(self.state_id, self.confidence):
+            yield {"state": self.strings.values[state_id], "confidence": confidence}
+
+    def to_list(self):
+        """Serialize to the JSON selection mark list"""
+        return list(self)
+
+
+def layout_json_default(value):
+    """json.dumps default hook that serializes compact layout objects to their JSON shape"""
+    if isinstance(value, LayoutTable):
+        return value.to_dict()
+    if isinstance(value, (TableCells, SelectionMarks)):
+        return value.to_list()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def materialize_layout(value):
+    """Return a copy of a layout with every compact object replaced by plain dicts and lists"""
+    if isinstance(value, dict):
+        return {key: materialize_layout(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [materialize_layout(item) for item in value]
+    if isinstance(value, (LayoutTable, TableCells, SelectionMarks)):
+        return layout_json_default(value)
+    return value
@@ -0,0 +1,591 @@
+"""
+Layout Templates Module
+Fingerprints layouts and reuses learned field mappings across versions of the same form
+"""
+
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+
+from modules.processors.llm_processing import (
+    analyze_content_with_llm,
+    analyze_content_with_llm_async,
+    analyze_layout_with_llm,
+    analyze_layout_with_llm_async,
+    merge_llm_results,
+    prepare_content_for_llm
+)
+from modules.processors.prompt_builder import get_token_budget
+from modules.utils.serialization import decode_json, encode_json
+from modules.utils.tracing import set_span_attribute
+
+
+SIGNATURE_SIZE = 64
+BAND_ROWS = 4
+FINGERPRINT_MAX_PAGES = 5
+POSITION_BUCKETS = 10
+TABLE_SHAPE_WEIGHT = 0.2
+DEFAULT_MATCH_THRESHOLD = 0.85
+DEFAULT_MAX_TEMPLATES = 500
+MIN_FIELD_LENGTH = 2
+MAPPING_VERSION = 2
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_random = random.Random(20240611)
+_PERMUTATIONS = [
+    (_random.randrange(1, _MERSENNE_PRIME), _random.randrange(0, _MERSENNE_PRIME)) for _ in range(SIGNATURE_SIZE)
+]
+_DIGITS = re.compile(r"\d")
+
+FIELD_PROMPT = """You are an expert document analyzer. Fields already extracted from this document are given
+            as JSON below. Extract only the missing fields listed, from the document content that follows,
+            and return them as JSON using the same field names and nesting.
+            """
+
+
+def is_template_matching_enabled():
+    """Return True when LAYOUT_TEMPLATES is on"""
+    return os.getenv("LAYOUT_TEMPLATES", "false").lower() in ("1", "true", "yes")
+
+
+def normalize_line(text):
+    """Lower-case a line, mask digits and collapse whitespace so values that change between versions compare equal"""
+    return " ".join(_DIGITS.sub("#", str(text).lower()).split())
+
+
+def _hash64(text):
+    """Stable 64-bit hash of a string"""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def _line_shingles(pages):
+    """Shingle each page's normalized lines with their neighbour and a coarse vertical position"""
+    shingles = set()
+    for page_position, page in enumerate(pages[:FINGERPRINT_MAX_PAGES]):
+        lines = [normalize_line(line) for line in page.get("lines") or []]
+        lines = [line for line in lines if line]
+        for index, line in enumerate(lines):
+            bucket = index * POSITION_BUCKETS // len(lines)
+            shingles.add(f"{page_position}|{bucket}|{line}")
+            if index + 1 < len(lines):
+                shingles.add(f"{page_position}|{line}\n{lines[index + 1]}")
+        for paragraph in page.get("paragraphs") or []:
+            shingles.add(f"{page_position}|{paragraph.get('role')}|{normalize_line(paragraph.get('content', ''))}")
+    return shingles
+
+
+def _table_shapes(pages):
+    """Describe each table by its page, column count and normalized header row (row counts vary by version)"""
+    shapes = set()
+    for page_position, page in enumerate(pages[:FINGERPRINT_MAX_PAGES]):
+        for table in page.get("tables") or []:
+            header = sorted(
+                (cell.get("column_index", 0), normalize_line(cell.get("content", "")))
+                for cell in table.get("cells") or []
+                if cell.get("row_index", 0) == 0
+            )
+            shapes.add(f"{page_position}|{table.get('column_count')}|{'|'.join(content for _, content in header)}")
+    return shapes
+
+
+def _minhash(shingles):
+    """MinHash signature estimating the Jaccard similarity of two shingle sets"""
+    hashes = [_hash64(shingle) for shingle in shingles]
+    if not hashes:
+        return [_MERSENNE_PRIME] * SIGNATURE_SIZE
+    return [min((a * value + b) % _MERSENNE_PRIME for value in hashes) for a, b in _PERMUTATIONS]
+
+
+def compute_layout_fingerprint(layout_data):
+    """
+    Fingerprint a layout from its line shingles, table shapes and page count.
+    Returns {"signature", "table_shapes", "page_count"}, all JSON-serializable.
+    """
+    pages = layout_data.get("pages") or []
+    return {
+        "signature": _minhash(_line_shingles(pages)),
+        "table_shapes": sorted(_table_shapes(pages)),
+        "page_count": len(pages)
+    }
+
+
+def fingerprint_similarity(first, second):
+    """Similarity in [0, 1]: estimated line Jaccard blended with table-shape Jaccard"""
+    matching = sum(1 for a, b in zip(first["signature"], second["signature"]) if a == b)
+    line_similarity = matching / SIGNATURE_SIZE
+    first_tables, second_tables = set(first["table_shapes"]), set(second["table_shapes"])
+    if first_tables or second_tables:
+        table_similarity = len(first_tables & second_tables) / len(first_tables | second_tables)
+    else:
+        table_similarity = 1.0
+    return (1 - TABLE_SHAPE_WEIGHT) * line_similarity + TABLE_SHAPE_WEIGHT * table_similarity
+
+
+def _bands(signature):
+    """Split a signature into LSH band keys; similar layouts share at least one band"""
+    return [
+        f"{start}:" + ",".join(str(value) for value in signature[start:start + BAND_ROWS])
+        for start in range(0, SIGNATURE_SIZE, BAND_ROWS)
+    ]
+
+
+def _iter_fields(value, path=()):
+    """Yield (path, scalar) for every leaf of an LLM result"""
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from _iter_fields(item, path + (key,))
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            yield from _iter_fields(item, path + (index,))
+    elif isinstance(value, (str, int, float)) and not isinstance(value, bool):
+        yield path, value
+
+
+def _set_field(result, path, value):
+    """Set a value at a path of dict keys and list indexes, creating containers as needed"""
+    target = result
+    for key, next_key in zip(path, path[1:]):
+        empty = [] if isinstance(next_key, int) else {}
+        if isinstance(key, int):
+            while len(target) <= key:
+                target.append(None)
+            if target[key] is None:
+                target[key] = empty
+        else:
+            target.setdefault(key, empty)
+        target = target[key]
+    key = path[-1]
+    if isinstance(key, int):
+        while len(target) <= key:
+            target.append(None)
+    target[key] = value
+
+
+def _drop_gaps(value):
+    """Remove list slots left empty by fields that could not be located"""
+    if isinstance(value, dict):
+        return {key: _drop_gaps(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_drop_gaps(item) for item in value if item is not None]
+    return value
+
+
+def _token_key(token, fold_case=True):
+    """Compare tokens without surrounding punctuation or a leading currency symbol"""
+    key = token.strip(",;:()[]").lstrip("$€£")
+    return key.lower() if fold_case else key
+
+
+def _value_forms(value):
+    """Token sequences a value may appear as in the text (numbers in their common printed forms)"""
+    if isinstance(value, str):
+        forms = [value]
+    elif isinstance(value, int):
+        forms = [str(value), f"{value:,}"]
+    else:
+        forms = [str(value), f"{value:.2f}", f"{value:,.2f}"]
+    return [[_token_key(token, fold_case=False) for token in form.split()] for form in forms if form.strip()]
+
+
+def _find_tokens(tokens, wanted, fold_case=True):
+    """Return the token offset where the wanted token sequence starts, or -1 (whole tokens only)"""
+    keys = [_token_key(token, fold_case) for token in tokens]
+    for offset in range(len(keys) - len(wanted) + 1):
+        if keys[offset:offset + len(wanted)] == wanted:
+            return offset
+    return -1
+
+
+def _label_before(tokens, offset):
+    """The run of digit-free tokens directly before a value, e.g. "Date:" in "Invoice No: 1001 Date: ..." """
+    start = offset
+    while start > 0 and not _DIGITS.search(tokens[start - 1]):
+        start -= 1
+    return [_token_key(token) for token in tokens[start:offset]]
+
+
+def _stop_after(tokens, end):
+    """The token that ends a value on its line, when it is a digit-free label"""
+    if end < len(tokens) and not _DIGITS.search(tokens[end]):
+        return _token_key(tokens[end])
+    return None
+
+
+def _value_type(value):
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "float"
+    return "str"
+
+
+def _locate_learned_value(pages, value):
+    """Find a value on whole-token boundaries and describe its label, extent and right-hand boundary"""
+    forms = _value_forms(value)
+    for page_position, page in enumerate(pages):
+        lines = page.get("lines") or []
+        for index, line in enumerate(lines):
+            tokens = line.split()
+            for wanted in forms:
+                offset = _find_tokens(tokens, wanted, fold_case=False)
+                if offset < 0:
+                    continue
+                location = {
+                    "page": page_position,
+                    "line_index": index,
+                    "value_words": len(wanted),
+                    "stop": _stop_after(tokens, offset + len(wanted)),
+                    "to_end": offset + len(wanted) == len(tokens),
+                    "type": _value_type(value)
+                }
+                label = _label_before(tokens, offset)
+                if label:
+                    location.update({"position": "inline", "label": label})
+                    return location
+                if offset == 0 and index > 0 and normalize_line(lines[index - 1]):
+                    location.update({"position": "below", "label": normalize_line(lines[index - 1])})
+                    return location
+    return None
+
+
+def learn_field_mappings(layout_data, llm_result):
+    """
+    Learn where each LLM field sits in the layout: after a label on its line ("inline"),
+    or at the start of the line below a label line ("below"), with the value's word
+    count and what ends it (the next label or the end of the line). Fields that cannot be anchored to a label are
+    recorded as unlocated paths; their values are never stored. Returns
+    {"version", "fields", "unlocated"}.
+    """
+    fields = []
+    unlocated = []
+    pages = layout_data.get("pages") or []
+    for path, value in _iter_fields(llm_result):
+        location = _locate_learned_value(pages, value) if len(str(value).strip()) >= MIN_FIELD_LENGTH else None
+        if location:
+            location["path"] = list(path)
+            fields.append(location)
+        else:
+            unlocated.append(list(path))
+    return {"version": MAPPING_VERSION, "fields": fields, "unlocated": unlocated}
+
+
+def _coerce(text, value_type):
+    """Convert extracted text back to the type the field was learned with; None when it does not parse"""
+    if value_type == "str":
+        return text
+    number = text.strip(",;:()[]").lstrip("$€£").replace(",", "")
+    try:
+        return int(number) if value_type == "int" else float(number)
+    except ValueError:
+        return None
+
+
+def _extract_value(tokens, start, field):
+    """Take a value up to its learned right-hand label, the end of the line when it ended it, or its word count"""
+    end = start + field["value_words"]
+    if field["stop"]:
+        keys = [_token_key(token) for token in tokens]
+        if field["stop"] in keys[start + 1:]:
+            end = keys.index(field["stop"], start + 1)
+    elif field["to_end"]:
+        end = len(tokens)
+    return " ".join(tokens[start:end])
+
+
+def _locate_field(field, pages):
+    """Find a learned field in a new layout, preferring the line nearest its learned position"""
+    if field["page"] >= len(pages):
+        return None
+    lines = pages[field["page"]].get("lines") or []
+    candidates = []
+    for index, line in enumerate(lines):
+        if field["position"] == "inline":
+            tokens = line.split()
+            offset = _find_tokens(tokens, field["label"])
+            if offset < 0:
+                continue
+            text = _extract_value(tokens, offset + len(field["label"]), field)
+        elif normalize_line(line) == field["label"] and index + 1 < len(lines):
+            text = _extract_value(lines[index + 1].split(), 0, field)
+        else:
+            continue
+        value = _coerce(text, field["type"]) if text else None
+        if value is not None:
+            candidates.append((abs(index - field["line_index"]), index, value))
+    return min(candidates, key=lambda candidate: candidate[:2])[2] if candidates else None
+
+
+def apply_template(template, layout_data):
+    """
+    Extract a template's learned fields from a layout. Returns (result, coverage, missing)
+    where missing lists the fields not found plus the template's unlocated fields, and
+    coverage is the share of all the template's fields that were extracted.
+    """
+    pages = layout_data.get("pages") or []
+    mappings = template["mappings"]
+    result = {}
+    missing = []
+    for field in mappings["fields"]:
+        value = _locate_field(field, pages)
+        if value is None:
+            missing.append(field["path"])
+        else:
+            _set_field(result, field["path"], value)
+    missing.extend(mappings["unlocated"])
+    total = len(mappings["fields"]) + len(mappings["unlocated"])
+    coverage = (total - len(missing)) / total if total else 0.0
+    return _drop_gaps(result), coverage, missing
+
+
+class TemplateIndex:
+    """Local SQLite index of known layout templates, kept in memory with LSH band buckets for lookup"""
+
+    def __init__(self, path, max_templates=DEFAULT_MAX_TEMPLATES):
+        self.path = path
+        self.max_templates = max_templates
+        self._lock = threading.Lock()
+        self._templates = {}
+        self._buckets = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS layout_templates ("
+            "template_id TEXT PRIMARY KEY, fingerprint TEXT NOT NULL, mappings TEXT NOT NULL, "
+            "hits INTEGER NOT NULL, created REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.commit()
+        for template_id, fingerprint, mappings, hits, created, last_used in self._conn.execute(
+            "SELECT template_id, fingerprint, mappings, hits, created, last_used FROM layout_templates"
+        ):
+            mappings = decode_json(mappings)
+            if mappings.get("version") != MAPPING_VERSION:
+                continue
+            self._add({
+                "template_id": template_id,
+                "fingerprint": decode_json(fingerprint),
+                "mappings": mappings,
+                "hits": hits,
+                "created": created,
+                "last_used": last_used
+            })
+
+    def _add(self, template):
+        self._templates[template["template_id"]] = template
+        for band in _bands(template["fingerprint"]["signature"]):
+            self._buckets.setdefault(band, set()).add(template["template_id"])
+
+    def _remove(self, template_id):
+        template = self._templates.pop(template_id)
+        for band in _bands(template["fingerprint"]["signature"]):
+            self._buckets.get(band, set()).discard(template_id)
+
+    def find(self, fingerprint, threshold):
+        """Return (template, similarity) for the best match at or above threshold, or (None, best similarity)"""
+        with self._lock:
+            candidates = set()
+            for band in _bands(fingerprint["signature"]):
+                candidates |= self._buckets.get(band, set())
+            best, best_similarity = None, 0.0
+            for template_id in candidates:
+                template = self._templates[template_id]
+                if template["fingerprint"]["page_count"] != fingerprint["page_count"]:
+                    continue
+                similarity = fingerprint_similarity(fingerprint, template["fingerprint"])
+                if similarity > best_similarity:
+                    best, best_similarity = template, similarity
+        if best is None or best_similarity < threshold:
+            return None, best_similarity
+        return best, best_similarity
+
+    def record_hit(self, template_id):
+        """Count a reuse of a template, which also keeps it from being evicted"""
+        now = time.time()
+        with self._lock:
+            template = self._templates.get(template_id)
+            if template is None:
+                return
+            template["hits"] += 1
+            template["last_used"] = now
+            self._conn.execute(
+                "UPDATE layout_templates SET hits = hits + 1, last_used = ? WHERE template_id = ?", (now, template_id)
+            )
+            self._conn.commit()
+
+    def learn(self, fingerprint, mappings):
+        """Store a new template, evicting the least recently used beyond max_templates; returns its id"""
+        template_id = hashlib.sha256(encode_json(fingerprint)).hexdigest()[:24]
+        now = time.time()
+        template = {
+            "template_id": template_id,
+            "fingerprint": fingerprint,
+            "mappings": mappings,
+            "hits": 0,
+            "created": now,
+            "last_used": now
+        }
+        with self._lock:
+            if template_id in self._templates:
+                self._remove(template_id)
+            self._add(template)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO layout_templates (template_id, fingerprint, mappings, hits, created, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (template_id, encode_json(fingerprint).decode("utf-8"), encode_json(mappings).decode("utf-8"), 0, now, now)
+            )
+            while len(self._templates) > self.max_templates:
+                oldest = min(self._templates.values(), key=lambda entry: entry["last_used"])["template_id"]
+                self._remove(oldest)
+                self._conn.execute("DELETE FROM layout_templates WHERE template_id = ?", (oldest,))
+            self._conn.commit()
+        return template_id
+
+    def size(self):
+        """Return the number of known templates"""
+        with self._lock:
+            return len(self._templates)
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_template_index():
+    """Return the process-wide template index, or None when template matching is off or unavailable"""
+    global _index
+    if not is_template_matching_enabled():
+        return None
+    path = os.getenv("LAYOUT_TEMPLATE_INDEX_PATH", "/tmp/layout_templates/templates.db")
+    with _index_lock:
+        if _index is None or _index.path != path:
+            try:
+                _index = TemplateIndex(path, int(os.getenv("LAYOUT_TEMPLATE_MAX_TEMPLATES", DEFAULT_MAX_TEMPLATES)))
+                logging.info(f"Layout template index loaded with {_index.size()} templates from {path}")
+            except Exception as e:
+                logging.warning(f"Layout template index unavailable (continuing without it): {e}")
+                return None
+        return _index
+
+
+def _match_settings():
+    """Return (match threshold, coverage needed to skip the LLM) from the environment"""
+    return (
+        float(os.getenv("LAYOUT_TEMPLATE_MATCH_THRESHOLD", DEFAULT_MATCH_THRESHOLD)),
+        float(os.getenv("LAYOUT_TEMPLATE_SKIP_COVERAGE", "1.0"))
+    )
+
+
+def _field_prompt(prefilled, missing):
+    """Prompt asking the LLM for only the fields the template could not fill"""
+    names = ", ".join(".".join(str(key) for key in path) for path in missing)
+    return f"{FIELD_PROMPT}\nAlready extracted: {encode_json(prefilled).decode('utf-8')}\nMissing fields: {names}\n"
+
+
+def _template_info(template, similarity, coverage, llm):
+    return {
+        "template_id": template["template_id"],
+        "similarity": round(similarity, 3),
+        "coverage": round(coverage, 3),
+        "llm": llm
+    }
+
+
+def _prepare_match(index, layout_data):
+    """Fingerprint a layout and apply the best matching template, if any"""
+    threshold, skip_coverage = _match_settings()
+    fingerprint = compute_layout_fingerprint(layout_data)
+    template, similarity = index.find(fingerprint, threshold)
+    if template is None:
+        logging.info(f"No layout template matched (best similarity {similarity:.3f}, threshold {threshold})")
+        return fingerprint, None
+    result, coverage, missing = apply_template(template, layout_data)
+    index.record_hit(template["template_id"])
+    set_span_attribute("template_similarity", round(similarity, 3))
+    logging.info(
+        f"Layout matched template {template['template_id']} (similarity {similarity:.3f}); "
+        f"{len(missing)} field(s) missing, coverage {coverage:.2f}"
+    )
+    return fingerprint, (template, similarity, result, coverage, missing, coverage >= skip_coverage)
+
+
+def _learn(index, fingerprint, layout_data, llm_result):
+    """Learn a template from a full LLM result"""
+    if not isinstance(llm_result, dict) or "error" in llm_result or "analysis" in llm_result:
+        return
+    mappings = learn_field_mappings(layout_data, llm_result)
+    if mappings["fields"]:
+        template_id = index.learn(fingerprint, mappings)
+        logging.info(f"Learned layout template {template_id} with {len(mappings['fields'])} located field(s)")
+
+
+def analyze_layout_with_templates(client, layout_data, deployment_name=None):
+    """
+    Analyze a layout, reusing a known template's field mappings when the layout matches one.
+    A full match skips the LLM; a partial match asks it only for the missing fields within a
+    smaller prompt budget; no match runs the normal analysis and learns a template from it.
+    """
+    index = get_template_index()
+    if index is None:
+        return analyze_layout_with_llm(client, layout_data, deployment_name=deployment_name)
+
+    fingerprint, match = _prepare_match(index, layout_data)
+    if match is None:
+        llm_result = analyze_layout_with_llm(client, layout_data, deployment_name=deployment_name)
+        _learn(index, fingerprint, layout_data, llm_result)
+        return llm_result
+
+    template, similarity, result, coverage, missing, skip_llm = match
+    if skip_llm or not client:
+        result["layout_template"] = _template_info(template, similarity, coverage, "skipped")
+        return result
+
+    token_budget = int(os.getenv("LAYOUT_TEMPLATE_TOKEN_BUDGET", get_token_budget() // 4))
+    partial = analyze_content_with_llm(
+        client,
+        prepare_content_for_llm(layout_data, "pdf", token_budget),
+        deployment_name=deployment_name,
+        prompt=_field_prompt(result, missing)
+    )
+    if isinstance(partial, dict) and "error" not in partial:
+        result = merge_llm_results([result, partial])
+    result["layout_template"] = _template_info(template, similarity, coverage, "reduced")
+    return result
+
+
+async def analyze_layout_with_templates_async(client, layout_data, deployment_name=None):
+    """Async counterpart of analyze_layout_with_templates"""
+    index = get_template_index()
+    if index is None:
+        return await analyze_layout_with_llm_async(client, layout_data, deployment_name=deployment_name)
+
+    # Template matching and learning hit SQLite; keep them off the event loop
+    fingerprint, match = await asyncio.to_thread(_prepare_match, index, layout_data)
+    if match is None:
+        llm_result = await analyze_layout_with_llm_async(client, layout_data, deployment_name=deployment_name)
+        await asyncio.to_thread(_learn, index, fingerprint, layout_data, llm_result)
+        return llm_result
+
+    template, similarity, result, coverage, missing, skip_llm = match
+    if skip_llm or not client:
+        result["layout_template"] = _template_info(template, similarity, coverage, "skipped")
+        return result
+
+    token_budget = int(os.getenv("LAYOUT_TEMPLATE_TOKEN_BUDGET", get_token_budget() // 4))
+    partial = await analyze_content_with_llm_async(
+        client,
+        prepare_content_for_llm(layout_data, "pdf", token_budget),
+        deployment_name=deployment_name,
+        prompt=_field_prompt(result, missing)
+    )
+    if isinstance(partial, dict) and "error" not in partial:
+        result = merge_llm_results([result, partial])
+    result["layout_template"] = _template_info(template, similarity, coverage, "reduced")
+    return result
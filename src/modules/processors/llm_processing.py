@@ -3,20 +3,30 @@ LLM Analyzer Module
 Handles Azure OpenAI LLM processing
 """
 
+import asyncio
 import logging
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
+from modules.clients.rate_limiter import call_with_rate_limit, call_with_rate_limit_async
+from modules.processors.image_preprocessing import prepare_images_for_llm
+from modules.processors.prompt_builder import (
+    build_prompt_content,
+    estimate_tokens,
+    get_token_budget,
+    split_pages_into_chunks,
+    truncate_to_token_budget
+)
+from modules.utils.tracing import map_in_context, span
 
-def analyze_content_with_llm(client, content_text, deployment_name=None, images=None, prompt=None):
-    """Process content using Azure OpenAI with or without images"""
-    if not client:
-        logging.warning("No Azure OpenAI client available, skipping LLM analysis")
-        return None
-        
-    try:
-        if not prompt:
-            prompt = """You are an expert document analyzer. Analyze the provided content and extract key information.
+
+DEFAULT_CHUNK_CONCURRENCY = 4
+MAX_COMPLETION_TOKENS = 1024
+ESTIMATED_TOKENS_PER_IMAGE = 765
+
+
+DEFAULT_ANALYSIS_PROMPT = """You are an expert document analyzer. Analyze the provided content and extract key information.
             Identify:
             1. Document type (invoice, form, report, etc.)
             2. Key entities (people, companies, places)
@@ -26,45 +36,140 @@ def analyze_content_with_llm(client, content_text, deployment_name=None, images=
             
             Format your response as a structured JSON with these sections.
             """
+
+CHUNK_ANALYSIS_PROMPT = """You are an expert document analyzer. The provided content is one part of a longer document.
+            Extract only what appears in this part:
+            1. Document type (invoice, form, report, etc.)
+            2. Key entities (people, companies, places) as a list
+            3. Important dates and amounts as lists
+            4. Main purpose of the document
+            5. Any notable observations as a list
+            
+            Format your response as a structured JSON with these sections.
+            """
+
+
+def _build_llm_request(content_text, deployment_name=None, images=None, prompt=None):
+    """Build the deployment id and chat messages for an analysis call"""
+    # Use the provided deployment or fall back to environment variable
+    deployment_id = deployment_name or os.getenv("AZURE_OPENAI_GPT4_DEPLOYMENT", "gpt-4")
+    messages = [{"role": "system", "content": prompt or DEFAULT_ANALYSIS_PROMPT}]
+    
+    # Add text content (already budgeted by prepare_content_for_llm; this is a safety net)
+    messages.append({"role": "user", "content": truncate_to_token_budget(content_text, get_token_budget())})
+    
+    # Add image content if available (downsampled and recompressed for the model)
+    if images and len(images) > 0:
+        content_items = [{"type": "text", "text": "Analyze this document:"}]
+        
+        for data_url in prepare_images_for_llm(images):
+            content_items.append({
+                "type": "image_url",
+                "image_url": {"url": data_url}
+            })
+        
+        messages.append({"role": "user", "content": content_items})
+    
+    return deployment_id, messages
+
+
+def _estimate_request_tokens(messages):
+    """Estimate the tokens-per-minute cost of a chat request for the rate limiter"""
+    tokens = MAX_COMPLETION_TOKENS
+    for message in messages:
+        content = message["content"]
+        if isinstance(content, str):
+            tokens += estimate_tokens(content)
+        else:
+            for item in content:
+                tokens += estimate_tokens(item.get("text", "")) if item.get("type") == "text" else ESTIMATED_TOKENS_PER_IMAGE
+    return tokens
+
+
+def _record_token_usage(completion_span, response):
+    """Attach the prompt and completion token counts reported by the service to the span"""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        completion_span.set_attribute("prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+        completion_span.set_attribute("completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
+
+
+def _parse_llm_response(response):
+    """Parse the model reply as JSON, falling back to raw text"""
+    result_text = response.choices[0].message.content
+    
+    # Try to parse JSON response
+    try:
+        if "```json" in result_text and "```" in result_text.split("```json", 1)[1]:
+            json_str = result_text.split("```json", 1)[1].split("```", 1)[0]
+            result = json.loads(json_str)
+        else:
+            result = json.loads(result_text)
+    except json.JSONDecodeError:
+        result = {"analysis": result_text}
+    
+    return result
+
+
+def analyze_content_with_llm(client, content_text, deployment_name=None, images=None, prompt=None):
+    """Process content using Azure OpenAI with or without images"""
+    if not client:
+        logging.warning("No Azure OpenAI client available, skipping LLM analysis")
+        return None
         
-        # Use the provided deployment or fall back to environment variable
-        deployment_id = deployment_name or os.getenv("AZURE_OPENAI_GPT4_DEPLOYMENT", "gpt-4")
-        messages = [{"role": "system", "content": prompt}]
+    try:
+        deployment_id, messages = _build_llm_request(content_text, deployment_name, images, prompt)
         
-        # Add text content
-        messages.append({"role": "user", "content": content_text[:8000]})
+        logging.info(f"Calling Azure OpenAI with deployment: {deployment_id}")
+        estimated_tokens = _estimate_request_tokens(messages)
+        with span("llm.completion", deployment=deployment_id, estimated_request_tokens=estimated_tokens) as completion_span:
+            response = call_with_rate_limit(
+                "openai",
+                lambda: client.chat.completions.create(
+                    model=deployment_id,
+                    messages=messages,
+                    max_tokens=MAX_COMPLETION_TOKENS,
+                    temperature=0.0
+                ),
+                cost=estimated_tokens
+            )
+            _record_token_usage(completion_span, response)
         
-        # Add image content if available
-        if images and len(images) > 0:
-            content_items = [{"type": "text", "text": "Analyze this document:"}]
+        result = _parse_llm_response(response)
             
-            for i, img_base64 in enumerate(images[:5]):
-                content_items.append({
-                    "type": "image_url",
-                    "image_url": {"url": f"data:image/jpeg;base64,{img_base64}"}
-                })
-            
-            messages.append({"role": "user", "content": content_items})
+        logging.info("Successfully received and processed LLM response")
+        return result
         
-        logging.info(f"Calling Azure OpenAI with deployment: {deployment_id}")
-        response = client.chat.completions.create(
-            model=deployment_id,
-            messages=messages,
-            max_tokens=1024,
-            temperature=0.0
-        )
+    except Exception as e:
+        logging.error(f"Error in LLM processing: {e}")
+        return {"error": str(e)}
+
+
+async def analyze_content_with_llm_async(client, content_text, deployment_name=None, images=None, prompt=None):
+    """Process content using the async Azure OpenAI client with or without images"""
+    if not client:
+        logging.warning("No Azure OpenAI client available, skipping LLM analysis")
+        return None
+        
+    try:
+        deployment_id, messages = _build_llm_request(content_text, deployment_name, images, prompt)
         
-        result_text = response.choices[0].message.content
+        logging.info(f"Calling Azure OpenAI (async) with deployment: {deployment_id}")
+        estimated_tokens = _estimate_request_tokens(messages)
+        with span("llm.completion", deployment=deployment_id, estimated_request_tokens=estimated_tokens) as completion_span:
+            response = await call_with_rate_limit_async(
+                "openai",
+                lambda: client.chat.completions.create(
+                    model=deployment_id,
+                    messages=messages,
+                    max_tokens=MAX_COMPLETION_TOKENS,
+                    temperature=0.0
+                ),
+                cost=estimated_tokens
+            )
+            _record_token_usage(completion_span, response)
         
-        # Try to parse JSON response
-        try:
-            if "```json" in result_text and "```" in result_text.split("```json", 1)[1]:
-                json_str = result_text.split("```json", 1)[1].split("```", 1)[0]
-                result = json.loads(json_str)
-            else:
-                result = json.loads(result_text)
-        except json.JSONDecodeError:
-            result = {"analysis": result_text}
+        result = _parse_llm_response(response)
             
         logging.info("Successfully received and processed LLM response")
         return result
@@ -74,23 +179,154 @@ def analyze_content_with_llm(client, content_text, deployment_name=None, images=
         return {"error": str(e)}
 
 
-def prepare_content_for_llm(layout_data, file_format):
-    """Prepare content text from layout data for LLM processing"""
-    content_text = ""
+def is_chunked_analysis_enabled():
+    """Return True when long documents should be analyzed chunk by chunk"""
+    return os.getenv("LLM_CHUNKED_ANALYSIS", "false").lower() in ("1", "true", "yes")
+
+
+def _chunk_concurrency():
+    """Return the maximum number of chunk calls in flight"""
+    return int(os.getenv("LLM_CHUNK_CONCURRENCY", DEFAULT_CHUNK_CONCURRENCY))
+
+
+def _unique_key(value):
+    """Return a hashable identity for de-duplicating merged list items"""
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def merge_llm_results(partial_results):
+    """
+    Reduce per-chunk JSON results into one result of the same shape:
+    lists are concatenated without duplicates, nested objects are merged
+    recursively and scalar fields keep the first non-empty value.
+    """
+    merged = {}
+    for partial in partial_results:
+        if not isinstance(partial, dict):
+            continue
+        for key, value in partial.items():
+            if key not in merged or merged[key] in (None, "", [], {}):
+                merged[key] = value
+            elif isinstance(merged[key], list):
+                items = value if isinstance(value, list) else [value]
+                seen = {_unique_key(item) for item in merged[key]}
+                for item in items:
+                    if _unique_key(item) not in seen:
+                        merged[key].append(item)
+                        seen.add(_unique_key(item))
+            elif isinstance(merged[key], dict) and isinstance(value, dict):
+                merged[key] = merge_llm_results([merged[key], value])
+    return merged
+
+
+def _chunk_contents(layout_data, token_budget):
+    """Split a layout into page chunks and build the prompt text for each"""
+    chunks = split_pages_into_chunks(layout_data, token_budget)
+    contents = []
+    for pages in chunks:
+        content_text, _ = build_prompt_content({"pages": pages}, token_budget)
+        contents.append(([page.get("page_number") for page in pages], content_text))
+    return contents
+
+
+def _reduce_chunk_results(chunk_contents, partial_results):
+    """Merge chunk results and record chunk coverage and failures"""
+    failed = [
+        {"pages": pages, "error": partial.get("error") if isinstance(partial, dict) else "no result"}
+        for (pages, _), partial in zip(chunk_contents, partial_results)
+        if not isinstance(partial, dict) or "error" in partial
+    ]
+    succeeded = [
+        partial for partial in partial_results
+        if isinstance(partial, dict) and "error" not in partial
+    ]
+    if not succeeded:
+        return {"error": "All chunk analyses failed", "chunk_errors": failed}
+
+    result = merge_llm_results(succeeded)
+    result["chunking"] = {
+        "chunks": len(chunk_contents),
+        "chunk_pages": [pages for pages, _ in chunk_contents]
+    }
+    if failed:
+        result["chunk_errors"] = failed
+    return result
+
+
+def analyze_layout_with_llm(client, layout_data, deployment_name=None, token_budget=None, max_concurrency=None):
+    """
+    Analyze a PDF layout with the LLM. When chunked analysis is enabled and the
+    layout exceeds one prompt, page chunks are analyzed in parallel and merged.
+    """
+    if token_budget is None:
+        token_budget = get_token_budget()
+
+    chunk_contents = _chunk_contents(layout_data, token_budget) if is_chunked_analysis_enabled() else []
+    if len(chunk_contents) <= 1:
+        prepared_content = prepare_content_for_llm(layout_data, "pdf", token_budget)
+        return analyze_content_with_llm(client, prepared_content, deployment_name=deployment_name)
+
+    if not client:
+        logging.warning("No Azure OpenAI client available, skipping LLM analysis")
+        return None
+
+    max_concurrency = max_concurrency or _chunk_concurrency()
+    logging.info(f"Analyzing {len(chunk_contents)} chunks with up to {max_concurrency} parallel LLM calls")
+    with ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="llm-chunk") as executor:
+        partial_results = map_in_context(
+            executor,
+            lambda chunk: analyze_content_with_llm(
+                client, chunk[1], deployment_name=deployment_name, prompt=CHUNK_ANALYSIS_PROMPT
+            ),
+            chunk_contents
+        )
+
+    return _reduce_chunk_results(chunk_contents, partial_results)
+
+
+async def analyze_layout_with_llm_async(client, layout_data, deployment_name=None, token_budget=None, max_concurrency=None):
+    """Async counterpart of analyze_layout_with_llm bounded by a semaphore"""
+    if token_budget is None:
+        token_budget = get_token_budget()
+
+    chunk_contents = _chunk_contents(layout_data, token_budget) if is_chunked_analysis_enabled() else []
+    if len(chunk_contents) <= 1:
+        prepared_content = prepare_content_for_llm(layout_data, "pdf", token_budget)
+        return await analyze_content_with_llm_async(client, prepared_content, deployment_name=deployment_name)
+
+    if not client:
+        logging.warning("No Azure OpenAI client available, skipping LLM analysis")
+        return None
+
+    semaphore = asyncio.Semaphore(max_concurrency or _chunk_concurrency())
+
+    async def analyze_chunk(content_text):
+        async with semaphore:
+            return await analyze_content_with_llm_async(
+                client, content_text, deployment_name=deployment_name, prompt=CHUNK_ANALYSIS_PROMPT
+            )
+
+    logging.info(f"Analyzing {len(chunk_contents)} chunks with async LLM calls")
+    partial_results = await asyncio.gather(*(analyze_chunk(content) for _, content in chunk_contents))
+    return _reduce_chunk_results(chunk_contents, partial_results)
+
+
+def prepare_content_for_llm(layout_data, file_format, token_budget=None):
+    """Prepare content text from layout data for LLM processing within a token budget"""
+    if token_budget is None:
+        token_budget = get_token_budget()
     
     if file_format == 'pdf':
-        for page in layout_data['pages']:
-            content_text += f"\n--- PAGE {page['page_number']} ---\n"
-            content_text += "\n".join(page['lines'])
-            
-            for i, table in enumerate(page['tables']):
-                content_text += f"\n--- TABLE {i+1} ---\n"
-                for cell in table['cells']:
-                    content_text += f"[Row {cell['row_index']}, Col {cell['column_index']}]: {cell['content']}\n"
-    elif file_format == 'image':
-        content_text = f"Image caption: {layout_data['vision_analysis']['caption']}\n"
-        content_text += "Extracted text:\n"
-        for line in layout_data['pages'][0]['lines']:
-            content_text += f"{line}\n"
+        content_text, stats = build_prompt_content(layout_data, token_budget)
+        logging.info(
+            f"Prepared LLM prompt: ~{stats['estimated_tokens']} tokens, "
+            f"{stats['parts_included']}/{stats['parts_total']} sections within a {token_budget}-token budget"
+        )
+        return content_text
+    
+    if file_format == 'image':
+        parts = [f"Image caption: {layout_data['vision_analysis']['caption']}\n", "Extracted text:\n"]
+        parts.extend(f"{line}\n" for line in layout_data['pages'][0]['lines'])
+        return truncate_to_token_budget("".join(parts), token_budget)
     
-    return content_text
+    return ""
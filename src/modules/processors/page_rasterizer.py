@@ -0,0 +1,239 @@
+"""
+Page Rasterizer Module
+Renders selected PDF pages to right-sized JPEG/PNG images for the Vision stage, caching renders per page
+"""
+
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+from modules.utils.lazy_imports import is_module_available, lazy_module
+
+
+# PDFium loads a native library, so it is imported when the first page is rendered
+pdfium = lazy_module("pypdfium2")
+
+
+DEFAULT_MAX_PAGES = 4
+DEFAULT_RENDER_DPI = 150
+DEFAULT_MAX_DIMENSION = 2048
+DEFAULT_JPEG_QUALITY = 85
+DEFAULT_CACHE_MAX_BYTES = 64 * 1024 * 1024
+DOWNLOAD_CHUNK_BYTES = 1024 * 1024
+
+IMAGE_CONTENT_TYPES = {"jpeg": "image/jpeg", "png": "image/png"}
+
+# PDFium is not thread-safe; every call into it is serialized
+_pdfium_lock = threading.Lock()
+
+
+def is_rasterization_available():
+    """Return True when pypdfium2 is installed"""
+    return is_module_available("pypdfium2")
+
+
+def _image_format():
+    """Return VISION_IMAGE_FORMAT: "jpeg" (default) or "png" """
+    image_format = os.getenv("VISION_IMAGE_FORMAT", "jpeg").lower()
+    return image_format if image_format in IMAGE_CONTENT_TYPES else "jpeg"
+
+
+def _render_settings():
+    """Return (format, dpi, max dimension, jpeg quality) from the environment"""
+    return (
+        _image_format(),
+        int(os.getenv("VISION_RENDER_DPI", DEFAULT_RENDER_DPI)),
+        int(os.getenv("VISION_IMAGE_MAX_DIMENSION", DEFAULT_MAX_DIMENSION)),
+        int(os.getenv("VISION_JPEG_QUALITY", DEFAULT_JPEG_QUALITY))
+    )
+
+
+def select_pages(page_count, spec=None, max_pages=None):
+    """
+    Return the 1-based page numbers to render. spec is VISION_PAGES: "all" or a list
+    like "1-3,7" (default: from page 1); the selection is capped at VISION_MAX_PAGES.
+    """
+    spec = (spec if spec is not None else os.getenv("VISION_PAGES", "all")).strip().lower()
+    max_pages = max_pages or int(os.getenv("VISION_MAX_PAGES", DEFAULT_MAX_PAGES))
+    if spec in ("", "all"):
+        pages = range(1, page_count + 1)
+    else:
+        pages = []
+        for part in spec.split(","):
+            start, _, end = part.strip().partition("-")
+            pages.extend(range(int(start), int(end or start) + 1))
+    selected = []
+    for page_number in pages:
+        if 1 <= page_number <= page_count and page_number not in selected:
+            selected.append(page_number)
+    return selected[:max_pages]
+
+
+class RenderCache:
+    """In-process LRU of rendered page images, bounded by total bytes"""
+
+    def __init__(self, max_bytes=DEFAULT_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return a cached page image or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, page_image):
+        """Store a page image, evicting the least recently used renders"""
+        size = len(page_image["image_bytes"])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.used_bytes -= len(previous["image_bytes"])
+            self._entries[key] = page_image
+            self.used_bytes += size
+            while self.used_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.used_bytes -= len(evicted["image_bytes"])
+
+
+_render_cache = None
+_render_cache_lock = threading.Lock()
+
+
+def get_render_cache():
+    """Return the process-wide render cache, or None when RASTER_CACHE_MAX_BYTES is 0"""
+    global _render_cache
+    max_bytes = int(os.getenv("RASTER_CACHE_MAX_BYTES", DEFAULT_CACHE_MAX_BYTES))
+    if max_bytes <= 0:
+        return None
+    with _render_cache_lock:
+        if _render_cache is None or _render_cache.max_bytes != max_bytes:
+            _render_cache = RenderCache(max_bytes)
+        return _render_cache
+
+
+def _download_to_tempfile(url, session=None):
+    """Stream a by-reference document to a temporary file, returning its path"""
+    import requests
+
+    http = session or requests
+    handle, path = tempfile.mkstemp(suffix=".pdf")
+    with os.fdopen(handle, "wb") as output:
+        with http.get(url, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_BYTES):
+                output.write(chunk)
+    return path
+
+
+def _render_page(pdf, page_number, settings):
+    """Render one page at the configured DPI, shrunk so its longest side fits the max dimension"""
+    image_format, dpi, max_dimension, jpeg_quality = settings
+    page = pdf[page_number - 1]
+    try:
+        width, height = page.get_size()
+        scale = min(dpi / 72.0, max_dimension / max(width, height, 1))
+        image = page.render(scale=scale).to_pil()
+    finally:
+        page.close()
+
+    if image_format == "jpeg" and image.mode != "RGB":
+        image = image.convert("RGB")
+    output = BytesIO()
+    if image_format == "jpeg":
+        image.save(output, format="JPEG", quality=jpeg_quality, optimize=True)
+    else:
+        image.save(output, format="PNG", optimize=True)
+    return {
+        "page_number": page_number,
+        "image_bytes": output.getvalue(),
+        "content_type": IMAGE_CONTENT_TYPES[image_format],
+        "width": image.width,
+        "height": image.height
+    }
+
+
+def count_pdf_pages(pdf_source):
+    """
+    Return the page count of a PDF (bytes or file path) from PDFium's page tree,
+    or 0 when it is unknown (pypdfium2 missing or the PDF unreadable)
+    """
+    if not is_rasterization_available():
+        logging.warning("pypdfium2 is not installed; PDF page count is unknown")
+        return 0
+    try:
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(pdf_source)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+    except Exception as e:
+        logging.warning(f"PDFium could not read the page count: {e}")
+        return 0
+
+
+def rasterize_pdf_pages(pdf_source, page_spec=None, content_sha256=None, max_pages=None):
+    """
+    Render the selected pages of a PDF (bytes or file path) and return one dict per page:
+    page_number, image_bytes, content_type, width and height. Renders are cached per
+    (content hash, page, settings) so retries and re-runs of the same blob skip PDFium.
+    """
+    if not is_rasterization_available():
+        logging.warning("pypdfium2 is not installed; PDF pages cannot be rendered for Vision")
+        return []
+
+    settings = _render_settings()
+    cache = get_render_cache() if content_sha256 else None
+    with _pdfium_lock:
+        pdf = pdfium.PdfDocument(pdf_source)
+        try:
+            page_numbers = select_pages(len(pdf), page_spec, max_pages)
+            page_images = []
+            for page_number in page_numbers:
+                cache_key = (content_sha256, page_number) + settings
+                page_image = cache.get(cache_key) if cache else None
+                if page_image is None:
+                    page_image = _render_page(pdf, page_number, settings)
+                    if cache:
+                        cache.put(cache_key, page_image)
+                page_images.append(page_image)
+        finally:
+            pdf.close()
+
+    logging.info(
+        f"Rasterized {len(page_images)} page(s) for Vision: "
+        f"{sum(len(page_image['image_bytes']) for page_image in page_images)} image bytes"
+    )
+    return page_images
+
+
+def rasterize_document_pages(document, session=None, page_spec=None):
+    """Render the selected pages of a DocumentSource, downloading by-reference documents to a temp file"""
+    if not is_rasterization_available():
+        logging.warning("pypdfium2 is not installed; PDF pages cannot be rendered for Vision")
+        return []
+    if document.content is not None:
+        return rasterize_pdf_pages(document.content, page_spec, document.content_id)
+    if not document.url:
+        return []
+
+    path = _download_to_tempfile(document.url, session)
+    try:
+        return rasterize_pdf_pages(path, page_spec, document.content_id)
+    finally:
+        os.remove(path)
@@ -0,0 +1,242 @@
+"""
+Prompt Builder Module
+Builds token-budgeted LLM prompts from layout data
+"""
+
+import os
+import re
+from io import StringIO
+
+from modules.processors.layout_model import TableCells
+
+
+DEFAULT_TOKEN_BUDGET = 6000
+
+PRIORITY_HEADER = 0
+PRIORITY_KEY_VALUE = 1
+PRIORITY_TABLE = 2
+PRIORITY_BODY = 3
+
+HEADING_ROLES = ("title", "sectionHeading", "pageHeader")
+TOTAL_KEYWORDS = ("total", "subtotal", "amount due", "balance", "tax", "grand total")
+KEY_VALUE_PATTERN = re.compile(r"^\s*[^:]{1,40}:\s*\S")
+LEADING_LINES_AS_HEADER = 5
+# Rendered rows that form a table's header: markdown adds a separator row, CSV does not
+TABLE_HEADER_ROWS = {"markdown": 2, "csv": 1}
+
+
+def get_token_budget():
+    """Return the configured prompt token budget"""
+    return int(os.getenv("LLM_PROMPT_TOKEN_BUDGET", DEFAULT_TOKEN_BUDGET))
+
+
+def estimate_tokens(text):
+    """Estimate the token count locally (about 4 characters per token for English text)"""
+    if not text:
+        return 0
+    return (len(text) + 3) // 4
+
+
+def truncate_to_token_budget(text, token_budget):
+    """Cut text so that its estimated token count fits the budget"""
+    if estimate_tokens(text) <= token_budget:
+        return text
+    return text[:token_budget * 4]
+
+
+def _escape_cell(content, separator):
+    """Make cell content safe for a single grid row"""
+    content = (content or "").replace("\n", " ").strip()
+    if separator == "|":
+        return content.replace("|", "\\|")
+    if separator in content or '"' in content:
+        return '"' + content.replace('"', '""') + '"'
+    return content
+
+
+def build_table_grid(table):
+    """Place cell contents on a row x column grid; spanned positions stay empty"""
+    row_count = table.get("row_count", 0)
+    column_count = table.get("column_count", 0)
+    cells = table.get("cells", [])
+    if isinstance(cells, TableCells):
+        return cells.grid(row_count, column_count)
+
+    grid = [[""] * column_count for _ in range(row_count)]
+    for cell in cells:
+        row, column = cell.get("row_index", 0), cell.get("column_index", 0)
+        if row < row_count and column < column_count:
+            grid[row][column] = cell.get("content", "")
+    return grid
+
+
+def render_table_rows(table, table_format="markdown"):
+    """Render a table as compact markdown or CSV rows"""
+    grid = build_table_grid(table)
+    if table_format == "csv":
+        return [",".join(_escape_cell(value, ",") for value in row) for row in grid]
+
+    rows = ["| " + " | ".join(_escape_cell(value, "|") for value in row) + " |" for row in grid]
+    if rows:
+        rows.insert(1, "|" + "---|" * table.get("column_count", 0))
+    return rows
+
+
+def _table_label(table, fallback_index):
+    """Return the section label for a table, including its page span"""
+    table_number = table.get("table_index", fallback_index) + 1
+    page_numbers = table.get("page_numbers") or []
+    if len(page_numbers) > 1:
+        return f"--- TABLE {table_number} (pages {page_numbers[0]}-{page_numbers[-1]}) ---"
+    return f"--- TABLE {table_number} ---"
+
+
+def _line_priority(line, page_index, line_index, heading_texts):
+    """Classify a text line by how important it is to keep in the prompt"""
+    if line in heading_texts or (page_index == 0 and line_index < LEADING_LINES_AS_HEADER):
+        return PRIORITY_HEADER
+    lowered = line.lower()
+    if KEY_VALUE_PATTERN.match(line) or any(keyword in lowered for keyword in TOTAL_KEYWORDS):
+        return PRIORITY_KEY_VALUE
+    return PRIORITY_BODY
+
+
+def _collect_parts(layout_data, table_format):
+    """Split the layout into prioritized prompt parts in document order"""
+    parts = []
+    for page_index, page in enumerate(layout_data.get("pages", [])):
+        page_number = page.get("page_number", page_index + 1)
+        heading_texts = {
+            paragraph.get("content")
+            for paragraph in page.get("paragraphs", [])
+            if paragraph.get("role") in HEADING_ROLES
+        }
+
+        for line_index, line in enumerate(page.get("lines", [])):
+            text = line + "\n"
+            parts.append({
+                "page": page_number,
+                "priority": _line_priority(line, page_index, line_index, heading_texts),
+                "text": text,
+                "tokens": estimate_tokens(text)
+            })
+
+        for table_position, table in enumerate(page.get("tables", [])):
+            rows = render_table_rows(table, table_format)
+            text = _table_label(table, table_position) + "\n" + "\n".join(rows) + "\n"
+            lowered = text.lower()
+            parts.append({
+                "page": page_number,
+                "priority": PRIORITY_KEY_VALUE if any(k in lowered for k in TOTAL_KEYWORDS) else PRIORITY_TABLE,
+                "text": text,
+                "tokens": estimate_tokens(text),
+                "label": _table_label(table, table_position),
+                "rows": rows,
+                "header_rows": TABLE_HEADER_ROWS.get(table_format, 2)
+            })
+
+    for order, part in enumerate(parts):
+        part["order"] = order
+    return parts
+
+
+def estimate_page_tokens(page, table_format="markdown"):
+    """Estimate the prompt tokens a page needs when rendered in full"""
+    tokens = estimate_tokens(f"\n--- PAGE {page.get('page_number', 0)} ---\n")
+    tokens += sum(estimate_tokens(line + "\n") for line in page.get("lines", []))
+    for table in page.get("tables", []):
+        tokens += estimate_tokens("\n".join(render_table_rows(table, table_format)) + "\n") + 8
+    return tokens
+
+
+def split_pages_into_chunks(layout_data, token_budget=None, table_format="markdown"):
+    """Group consecutive pages into chunks that each fit the token budget"""
+    if token_budget is None:
+        token_budget = get_token_budget()
+
+    chunks = []
+    current, current_tokens = [], 0
+    for page in layout_data.get("pages", []):
+        page_tokens = estimate_page_tokens(page, table_format)
+        if current and current_tokens + page_tokens > token_budget:
+            chunks.append(current)
+            current, current_tokens = [], 0
+        current.append(page)
+        current_tokens += page_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _truncate_table_part(part, token_budget):
+    """Keep the header and as many leading rows of a table as fit the budget; None if the header alone does not"""
+    rows = part["rows"]
+    header = rows[:part["header_rows"]]
+    kept = []
+    text = part["label"] + "\n" + "\n".join(header) + "\n"
+    if estimate_tokens(text) + 8 > token_budget:
+        return None
+    for row in rows[len(header):]:
+        candidate_tokens = estimate_tokens(text + row + "\n") + 8
+        if candidate_tokens > token_budget:
+            break
+        kept.append(row)
+        text += row + "\n"
+    omitted = len(rows) - len(header) - len(kept)
+    if omitted > 0:
+        text += f"[... {omitted} more rows omitted ...]\n"
+    return text
+
+
+def build_prompt_content(layout_data, token_budget=None, table_format="markdown"):
+    """
+    Build the LLM prompt text for a PDF layout within a token budget.
+    Parts are chosen by priority (headers, then key-value/total lines and total
+    tables, then other tables, then body text) and emitted in document order.
+    Returns (content_text, stats).
+    """
+    if token_budget is None:
+        token_budget = get_token_budget()
+
+    parts = _collect_parts(layout_data, table_format)
+    remaining = token_budget
+    marked_pages = set()
+    selected = []
+
+    for part in sorted(parts, key=lambda item: (item["priority"], item["order"])):
+        marker_cost = 0 if part["page"] in marked_pages else estimate_tokens(f"\n--- PAGE {part['page']} ---\n")
+        cost = part["tokens"] + marker_cost
+        if cost <= remaining:
+            selected.append((part["order"], part["page"], part["text"]))
+        elif "rows" in part and remaining - marker_cost > 32:
+            text = _truncate_table_part(part, remaining - marker_cost)
+            if text is None:
+                continue
+            cost = estimate_tokens(text) + marker_cost
+            selected.append((part["order"], part["page"], text))
+        else:
+            continue
+        remaining -= cost
+        marked_pages.add(part["page"])
+
+    buffer = StringIO()
+    current_page = None
+    for _, page_number, text in sorted(selected):
+        if page_number != current_page:
+            buffer.write(f"\n--- PAGE {page_number} ---\n")
+            current_page = page_number
+        buffer.write(text)
+
+    omitted = len(parts) - len(selected)
+    if omitted:
+        buffer.write(f"\n[... {omitted} lower-priority sections omitted to fit the token budget ...]\n")
+
+    content_text = buffer.getvalue()
+    stats = {
+        "token_budget": token_budget,
+        "estimated_tokens": estimate_tokens(content_text),
+        "parts_total": len(parts),
+        "parts_included": len(selected),
+        "parts_omitted": omitted
+    }
+    return content_text, stats
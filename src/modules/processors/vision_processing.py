@@ -3,15 +3,167 @@ Vision Analyzer Module
 Handles Azure AI Vision API processing
 """
 
+import asyncio
 import logging
+import json
 import uuid
+import threading
 import time
-import requests
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
 
+from modules.clients.rate_limiter import call_with_rate_limit, call_with_rate_limit_async
+from modules.processors.image_preprocessing import TARGET_VISION, preprocess_image
+from modules.utils.lazy_imports import lazy_module
+from modules.utils.tracing import map_in_context, span
 
-def analyze_image_with_vision(image_bytes, vision_config, request_id=None):
-    """Analyze an image using Azure AI Vision API"""
+
+# Only used when no pooled session is passed in
+requests = lazy_module("requests")
+
+
+DEFAULT_VISION_TIMEOUT_SECONDS = 30
+DEFAULT_PAGE_CONCURRENCY = 4
+DEFAULT_VERSION_TTL_SECONDS = 3600
+REQUESTED_FEATURES = ("caption", "read")
+THROTTLE_STATUS_CODES = (429, 500, 502, 503, 504)
+# Error codes the service returns for an api-version it does not serve; a 404 without
+# one of these is a bad endpoint or path and must not mark the version as unsupported
+UNSUPPORTED_VERSION_ERROR_CODES = ("unsupportedapiversion", "invalidapiversion", "invalidapiversionparameter")
+
+# endpoint -> (working version, negotiated at) and (endpoint, version) -> rejected at
+_negotiated_versions = {}
+_rejected_versions = {}
+# Per-version feature capability map, learned per endpoint because feature availability
+# (e.g. captions) varies by region as well as by version:
+# (endpoint, version) -> {"accepted": {feature: accepted at}, "rejected": {feature: rejected at}}
+VERSION_CAPABILITIES = {}
+_version_lock = threading.Lock()
+
+
+def _vision_timeout():
+    """Return the per-request Vision API timeout in seconds"""
+    return float(os.getenv("VISION_TIMEOUT_SECONDS", DEFAULT_VISION_TIMEOUT_SECONDS))
+
+
+def _version_ttl():
+    """Return how long a negotiated or rejected version is trusted before re-probing"""
+    return float(os.getenv("VISION_VERSION_TTL_SECONDS", DEFAULT_VERSION_TTL_SECONDS))
+
+
+def get_version_features(endpoint, version, requested=REQUESTED_FEATURES):
+    """Return the requested features not known to be rejected by this endpoint and API version"""
+    now = time.time()
+    ttl = _version_ttl()
+    with _version_lock:
+        rejected = VERSION_CAPABILITIES.get((endpoint, version), {}).get("rejected", {})
+        return [feature for feature in requested if now - rejected.get(feature, float("-inf")) >= ttl]
+
+
+def _record_features(endpoint, version, features, accepted):
+    """Record features an endpoint and API version accepted or rejected"""
+    now = time.time()
+    with _version_lock:
+        capabilities = VERSION_CAPABILITIES.setdefault((endpoint, version), {"accepted": {}, "rejected": {}})
+        for feature in features:
+            capabilities["accepted" if accepted else "rejected"][feature] = now
+            capabilities["rejected" if accepted else "accepted"].pop(feature, None)
+
+
+def _negotiation_attempts(vision_config):
+    """
+    Yield (version, features) to try: each candidate version with the features it is not
+    known to reject, again with fewer features after the caller records a rejected one
+    """
+    endpoint = vision_config.get("endpoint")
+    for version in candidate_versions(vision_config):
+        tried = set()
+        while True:
+            features = tuple(get_version_features(endpoint, version))
+            if not features or features in tried:
+                break
+            tried.add(features)
+            yield version, features
+
+
+def candidate_versions(vision_config):
+    """Order API versions to try: negotiated version first, then configured and fallbacks minus known-bad"""
+    endpoint = vision_config.get("endpoint")
+    configured = vision_config.get("version", "2024-04-01")
+    ordered = [configured] + [v for v in vision_config.get("fallback_versions", []) if v != configured]
+    now = time.time()
+    ttl = _version_ttl()
+
+    with _version_lock:
+        negotiated = _negotiated_versions.get(endpoint)
+        if negotiated and now - negotiated[1] < ttl:
+            return [negotiated[0]]
+        usable = [
+            version for version in ordered
+            if now - _rejected_versions.get((endpoint, version), float("-inf")) >= ttl
+        ]
+    return usable or ordered
+
+
+def _record_version(endpoint, version, accepted):
+    """Memoize a working version or remember a rejected one for this process"""
+    with _version_lock:
+        if accepted:
+            _negotiated_versions[endpoint] = (version, time.time())
+            _rejected_versions.pop((endpoint, version), None)
+        else:
+            _rejected_versions[(endpoint, version)] = time.time()
+            negotiated = _negotiated_versions.get(endpoint)
+            if negotiated and negotiated[0] == version:
+                del _negotiated_versions[endpoint]
+
+
+def _error_codes(body_text):
+    """Return the lower-cased error and inner error codes of an API error body"""
+    try:
+        error = json.loads(body_text or "").get("error") or {}
+    except (ValueError, AttributeError):
+        return []
+    codes = []
+    while isinstance(error, dict):
+        if error.get("code"):
+            codes.append(str(error["code"]).lower())
+        error = error.get("innererror") or error.get("innerError")
+    return codes
+
+
+def _rejected_features(status, body_text, features):
+    """Return the requested features a 400 response names as not supported"""
+    lowered = (body_text or "").lower()
+    if status != 400 or ("not supported" not in lowered and "unsupported" not in lowered):
+        return []
+    return [feature for feature in features if re.search(rf"['\"]{feature.lower()}['\"]", lowered)]
+
+
+def _is_version_rejected(status, body_text):
+    """Detect responses meaning the API version (rather than the request) is not supported"""
+    if status not in (400, 404):
+        return False
+    if any(code in UNSUPPORTED_VERSION_ERROR_CODES for code in _error_codes(body_text)):
+        return True
+    lowered = (body_text or "").lower()
+    return status == 400 and ("apiversion" in lowered or "api-version" in lowered or "api version" in lowered)
+
+
+def _build_analyze_url(vision_endpoint, version, features):
+    """Build the Image Analysis URL for a version and the features it supports"""
+    return f"{vision_endpoint}/computervision/imageanalysis:analyze?api-version={version}&features={','.join(features)}"
+
+
+def _page_concurrency():
+    """Return how many pages are sent to the Vision API at once"""
+    return max(1, int(os.getenv("VISION_PAGE_CONCURRENCY", DEFAULT_PAGE_CONCURRENCY)))
+
+
+def analyze_image_with_vision(image_bytes, vision_config, request_id=None, session=None):
+    """Analyze an image using Azure AI Vision API, negotiating the API version"""
     if not vision_config.get("endpoint") or not vision_config.get("key"):
         logging.warning("Vision API configuration is missing, skipping vision analysis")
         return None
@@ -23,36 +175,142 @@ def analyze_image_with_vision(image_bytes, vision_config, request_id=None):
     vision_key = vision_config.get("key")
     current_version = vision_config.get("version", "2024-04-01")
     
+    headers = {
+        'Content-Type': 'application/octet-stream',
+        'Ocp-Apim-Subscription-Key': vision_key,
+        'x-ms-client-request-id': req_id
+    }
+    http = session or requests
+    
     try:
-        # Build API URL based on version
-        if current_version.startswith("2024"):
-            analyze_url = f"{vision_endpoint}/computervision/imageanalysis:analyze?api-version={current_version}&features=caption,read"
-        else:
-            analyze_url = f"{vision_endpoint}/computervision/imageanalysis:analyze?api-version={current_version}&features=caption,read"
-        
-        headers = {
-            'Content-Type': 'application/octet-stream',
-            'Ocp-Apim-Subscription-Key': vision_key,
-            'x-ms-client-request-id': req_id
-        }
-        
-        logging.info(f"[Vision-{req_id}] Making request to: {analyze_url}")
+        for current_version, features in _negotiation_attempts(vision_config):
+            analyze_url = _build_analyze_url(vision_endpoint, current_version, features)
+            logging.info(f"[Vision-{req_id}] Making request to: {analyze_url}")
+            
+            def send():
+                response = http.post(analyze_url, headers=headers, data=image_bytes, timeout=_vision_timeout())
+                if response.status_code in THROTTLE_STATUS_CODES:
+                    response.raise_for_status()
+                return response
+            
+            with span("vision.request", api_version=current_version, payload_bytes=len(image_bytes)) as request_span:
+                response = call_with_rate_limit("vision", send)
+                request_span.set_attribute("status_code", response.status_code)
+                request_span.set_attribute("response_bytes", len(response.content))
+            api_latency = request_span.duration_ms / 1000
+            
+            logging.info(f"[Vision-{req_id}] Response received in {api_latency:.2f}s with status {response.status_code}")
+            
+            if _is_version_rejected(response.status_code, response.text):
+                logging.warning(f"[Vision-{req_id}] API version {current_version} rejected, trying next fallback")
+                _record_version(vision_endpoint, current_version, accepted=False)
+                continue
+            
+            rejected_features = _rejected_features(response.status_code, response.text, features)
+            if rejected_features:
+                logging.warning(f"[Vision-{req_id}] API version {current_version} does not support {rejected_features}, retrying without them")
+                _record_features(vision_endpoint, current_version, rejected_features, accepted=False)
+                continue
+            
+            response.raise_for_status()
+            _record_version(vision_endpoint, current_version, accepted=True)
+            _record_features(vision_endpoint, current_version, features, accepted=True)
+            result = response.json()
+            
+            # Add tracking information
+            result['request_id'] = req_id
+            result['api_version_used'] = current_version
+            result['features_used'] = list(features)
+            
+            logging.info(f"[Vision-{req_id}] Successfully processed with API version {current_version}")
+            return result
         
-        start_time = time.time()
-        response = requests.post(analyze_url, headers=headers, data=image_bytes, timeout=30)
-        api_latency = time.time() - start_time
+        raise RuntimeError("No supported Vision API version found")
         
-        logging.info(f"[Vision-{req_id}] Response received in {api_latency:.2f}s with status {response.status_code}")
-        
-        response.raise_for_status()
-        result = response.json()
+    except Exception as e:
+        logging.error(f"[Vision-{req_id}] Vision API error: {str(e)}")
+        return {
+            "error": "Vision API failed",
+            "details": str(e),
+            "api_version": current_version
+        }
+
+
+async def analyze_image_with_vision_async(image_bytes, vision_config, request_id=None, session=None):
+    """Analyze an image using Azure AI Vision API with an aiohttp session, negotiating the API version"""
+    import aiohttp
+
+    if not vision_config.get("endpoint") or not vision_config.get("key"):
+        logging.warning("Vision API configuration is missing, skipping vision analysis")
+        return None
+    
+    req_id = request_id or str(uuid.uuid4())[:8]
+    logging.info(f"[Vision-{req_id}] Starting async image analysis with Azure AI Vision")
+    
+    vision_endpoint = vision_config.get("endpoint")
+    vision_key = vision_config.get("key")
+    current_version = vision_config.get("version", "2024-04-01")
+    owns_session = session is None
+    
+    headers = {
+        'Content-Type': 'application/octet-stream',
+        'Ocp-Apim-Subscription-Key': vision_key,
+        'x-ms-client-request-id': req_id
+    }
+    
+    try:
+        if owns_session:
+            session = aiohttp.ClientSession()
         
-        # Add tracking information
-        result['request_id'] = req_id
-        result['api_version_used'] = current_version
+        for current_version, features in _negotiation_attempts(vision_config):
+            analyze_url = _build_analyze_url(vision_endpoint, current_version, features)
+            logging.info(f"[Vision-{req_id}] Making request to: {analyze_url}")
+            
+            async def send():
+                async with session.post(
+                    analyze_url,
+                    headers=headers,
+                    data=image_bytes,
+                    timeout=aiohttp.ClientTimeout(total=_vision_timeout())
+                ) as response:
+                    if response.status in THROTTLE_STATUS_CODES:
+                        response.raise_for_status()
+                    return response.status, await response.text()
+            
+            with span("vision.request", api_version=current_version, payload_bytes=len(image_bytes)) as request_span:
+                status, body_text = await call_with_rate_limit_async("vision", send)
+                request_span.set_attribute("status_code", status)
+                request_span.set_attribute("response_bytes", len(body_text))
+            api_latency = request_span.duration_ms / 1000
+            logging.info(f"[Vision-{req_id}] Response received in {api_latency:.2f}s with status {status}")
+            
+            if _is_version_rejected(status, body_text):
+                logging.warning(f"[Vision-{req_id}] API version {current_version} rejected, trying next fallback")
+                _record_version(vision_endpoint, current_version, accepted=False)
+                continue
+            
+            rejected_features = _rejected_features(status, body_text, features)
+            if rejected_features:
+                logging.warning(f"[Vision-{req_id}] API version {current_version} does not support {rejected_features}, retrying without them")
+                _record_features(vision_endpoint, current_version, rejected_features, accepted=False)
+                continue
+            
+            if status >= 400:
+                raise RuntimeError(f"Vision API returned status {status}: {body_text[:500]}")
+            
+            _record_version(vision_endpoint, current_version, accepted=True)
+            _record_features(vision_endpoint, current_version, features, accepted=True)
+            result = json.loads(body_text)
+            
+            # Add tracking information
+            result['request_id'] = req_id
+            result['api_version_used'] = current_version
+            result['features_used'] = list(features)
+            
+            logging.info(f"[Vision-{req_id}] Successfully processed with API version {current_version}")
+            return result
         
-        logging.info(f"[Vision-{req_id}] Successfully processed with API version {current_version}")
-        return result
+        raise RuntimeError("No supported Vision API version found")
         
     except Exception as e:
         logging.error(f"[Vision-{req_id}] Vision API error: {str(e)}")
@@ -61,21 +319,109 @@ def analyze_image_with_vision(image_bytes, vision_config, request_id=None):
             "details": str(e),
             "api_version": current_version
         }
+    finally:
+        if owns_session and session is not None:
+            await session.close()
+
+
+def summarize_page_result(page_image, vision_result):
+    """Reduce one page's Vision response to its caption and OCR lines"""
+    summary = {
+        "page_number": page_image["page_number"],
+        "image_bytes": len(page_image["image_bytes"]),
+        "image_size": [page_image["width"], page_image["height"]]
+    }
+    if not vision_result or "error" in (vision_result or {}):
+        summary["error"] = (vision_result or {}).get("details", "Vision analysis unavailable")
+        return summary
+
+    caption = vision_result.get("captionResult") or vision_result.get("caption") or {}
+    read = vision_result.get("readResult") or vision_result.get("read") or {}
+    summary["caption"] = caption.get("text", "")
+    summary["caption_confidence"] = caption.get("confidence", 0)
+    summary["lines"] = [
+        line["text"] for block in read.get("blocks", []) for line in block.get("lines", []) if "text" in line
+    ]
+    summary["api_version"] = vision_result.get("api_version_used")
+    return summary
+
+
+def merge_page_results(page_summaries):
+    """Combine per-page summaries into the document's vision_analysis, ordered by page"""
+    page_summaries = sorted(page_summaries, key=lambda summary: summary["page_number"])
+    versions = [summary["api_version"] for summary in page_summaries if summary.get("api_version")]
+    return {
+        "pages_analyzed": len(page_summaries),
+        "failed_pages": [summary["page_number"] for summary in page_summaries if "error" in summary],
+        "api_version_used": versions[0] if versions else None,
+        "caption": next((summary["caption"] for summary in page_summaries if summary.get("caption")), ""),
+        "pages": page_summaries
+    }
+
+
+def analyze_pages_with_vision(page_images, vision_config, request_id=None, session=None, max_concurrency=None):
+    """Analyze rendered page images in parallel and merge the captions/OCR back per page"""
+    if not page_images:
+        logging.warning("No page images to analyze, skipping vision analysis")
+        return None
+    if not vision_config.get("endpoint") or not vision_config.get("key"):
+        logging.warning("Vision API configuration is missing, skipping vision analysis")
+        return None
+
+    req_id = request_id or str(uuid.uuid4())[:8]
+
+    def analyze_page(page_image):
+        vision_result = analyze_image_with_vision(
+            page_image["image_bytes"],
+            vision_config,
+            request_id=f"{req_id}-p{page_image['page_number']}",
+            session=session
+        )
+        return summarize_page_result(page_image, vision_result)
+
+    workers = min(max_concurrency or _page_concurrency(), len(page_images))
+    with span("vision.pages", pages=len(page_images)):
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="vision-page") as executor:
+            page_summaries = map_in_context(executor, analyze_page, page_images)
+    return merge_page_results(page_summaries)
+
+
+async def analyze_pages_with_vision_async(page_images, vision_config, request_id=None, session=None, max_concurrency=None):
+    """Async version of analyze_pages_with_vision"""
+    if not page_images:
+        logging.warning("No page images to analyze, skipping vision analysis")
+        return None
+    if not vision_config.get("endpoint") or not vision_config.get("key"):
+        logging.warning("Vision API configuration is missing, skipping vision analysis")
+        return None
+
+    req_id = request_id or str(uuid.uuid4())[:8]
+    semaphore = asyncio.Semaphore(max_concurrency or _page_concurrency())
+
+    async def analyze_page(page_image):
+        async with semaphore:
+            vision_result = await analyze_image_with_vision_async(
+                page_image["image_bytes"],
+                vision_config,
+                request_id=f"{req_id}-p{page_image['page_number']}",
+                session=session
+            )
+        return summarize_page_result(page_image, vision_result)
+
+    with span("vision.pages", pages=len(page_images)):
+        page_summaries = await asyncio.gather(*(analyze_page(page_image) for page_image in page_images))
+    return merge_page_results(page_summaries)
 
 
-def process_image_file(pdf_bytes, vision_config, invocation_id):
-    """Process image files using Vision API"""
-    vision_result = analyze_image_with_vision(pdf_bytes, vision_config, request_id=invocation_id)
+def process_image_file(image_bytes, vision_config, invocation_id, session=None):
+    """Process image files using Vision API (downsampled first; very large scans are tiled)"""
+    prepared = preprocess_image(image_bytes, TARGET_VISION)
+    tiles = [dict(image, page_number=index) for index, image in enumerate(prepared["images"], start=1)]
+    vision_result = analyze_pages_with_vision(tiles, vision_config, request_id=invocation_id, session=session)
     
-    if vision_result and 'error' not in vision_result:
-        # Extract text lines from Vision API response
-        text_lines = []
-        if 'read' in vision_result and 'blocks' in vision_result['read']:
-            for block in vision_result['read']['blocks']:
-                if 'lines' in block:
-                    for line in block['lines']:
-                        if 'text' in line:
-                            text_lines.append(line['text'])
+    if vision_result and len(vision_result["failed_pages"]) < len(tiles):
+        # Text lines from every tile, in tile order (overlapping tiles may repeat a line)
+        text_lines = [line for tile in vision_result["pages"] for line in tile.get("lines", [])]
         
         layout_data = {
             "id": str(uuid.uuid4()),
@@ -87,9 +433,11 @@ def process_image_file(pdf_bytes, vision_config, invocation_id):
                 "selection_marks": []
             }],
             "vision_analysis": {
-                "caption": vision_result.get("caption", {}).get("text", ""),
-                "confidence": vision_result.get("caption", {}).get("confidence", 0),
-                "api_version": vision_config.get("version", "unknown")
+                "caption": vision_result["caption"],
+                "confidence": vision_result["pages"][0].get("caption_confidence", 0),
+                "api_version": vision_result["api_version_used"] or vision_config.get("version", "unknown"),
+                "tiles": len(tiles),
+                "image_bytes_saved": prepared["saved_bytes"]
             }
         }
         
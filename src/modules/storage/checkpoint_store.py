@@ -0,0 +1,209 @@
+"""
+Checkpoint Store Module
+Persists per-stage pipeline outputs so host retries resume instead of starting over
+"""
+
+import asyncio
+import logging
+import hashlib
+import os
+import shutil
+import threading
+
+from modules.utils.serialization import decode_json, encode_json
+
+
+def checkpoint_key(blob_name, etag=None, file_content=None, content_sha256=None):
+    """Build a checkpoint key from the blob name and its ETag (or content hash when no ETag)"""
+    if content_sha256 is None and file_content is not None:
+        content_sha256 = hashlib.sha256(file_content).hexdigest()
+    version = etag or content_sha256 or "latest"
+    digest = hashlib.sha256(f"{blob_name}|{version}".encode("utf-8")).hexdigest()
+    return digest[:32]
+
+
+def get_blob_etag(myblob):
+    """Return the ETag of a triggering blob when the binding exposes it"""
+    try:
+        properties = getattr(myblob, "blob_properties", None) or {}
+    except Exception:
+        return None
+    return properties.get("ETag") or properties.get("Etag") or properties.get("etag")
+
+
+def _is_checkpointable(value):
+    """Error results are not checkpointed so that a retry runs the stage again"""
+    return value is not None and not (isinstance(value, dict) and "error" in value)
+
+
+class LocalDiskCheckpointStore:
+    """Checkpoints stored as one JSON file per stage under a local directory"""
+
+    name = "local"
+
+    def __init__(self, root):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def _path(self, key, stage):
+        return os.path.join(self.root, key, f"{stage}.json")
+
+    def load(self, key, stage):
+        """Return the saved stage output or None"""
+        path = self._path(key, stage)
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as checkpoint_file:
+            return decode_json(checkpoint_file.read())
+
+    def save(self, key, stage, value):
+        """Atomically write a stage output"""
+        path = self._path(key, stage)
+        with self._lock:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as checkpoint_file:
+            checkpoint_file.write(encode_json(value))
+        os.replace(temp_path, path)
+
+    def clear(self, key):
+        """Delete all checkpoints for a key"""
+        shutil.rmtree(os.path.join(self.root, key), ignore_errors=True)
+
+
+class BlobCheckpointStore:
+    """Checkpoints stored as blobs named <key>/<stage>.json in a storage container"""
+
+    name = "blob"
+
+    def __init__(self, container_client):
+        self.container_client = container_client
+
+    def load(self, key, stage):
+        """Return the saved stage output or None"""
+        from azure.core.exceptions import ResourceNotFoundError
+
+        try:
+            downloader = self.container_client.download_blob(f"{key}/{stage}.json")
+        except ResourceNotFoundError:
+            return None
+        return decode_json(downloader.readall())
+
+    def save(self, key, stage, value):
+        """Upload a stage output, replacing any previous one"""
+        self.container_client.upload_blob(
+            f"{key}/{stage}.json",
+            encode_json(value),
+            overwrite=True
+        )
+
+    def clear(self, key):
+        """Delete all checkpoints for a key"""
+        for blob in self.container_client.list_blobs(name_starts_with=f"{key}/"):
+            self.container_client.delete_blob(blob.name)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _create_store(backend_name):
+    """Build the checkpoint store selected by environment variables"""
+    if backend_name == "local":
+        return LocalDiskCheckpointStore(os.getenv("CHECKPOINT_LOCAL_PATH", "/tmp/pipeline_checkpoints"))
+    if backend_name == "blob":
+        from azure.storage.blob import ContainerClient
+
+        connection_string = os.getenv("CHECKPOINT_STORAGE_CONNECTION", os.getenv("invoicecontosostorage_STORAGE"))
+        if not connection_string:
+            raise ValueError("Blob checkpoint store requires a storage connection string")
+        container_client = ContainerClient.from_connection_string(
+            connection_string,
+            os.getenv("CHECKPOINT_CONTAINER", "pipeline-checkpoints")
+        )
+        if not container_client.exists():
+            container_client.create_container()
+        return BlobCheckpointStore(container_client)
+    raise ValueError(f"Unknown checkpoint backend: {backend_name}")
+
+
+def get_checkpoint_store():
+    """Return the process-wide checkpoint store, or None when checkpointing is disabled"""
+    global _store
+    backend_name = os.getenv("CHECKPOINT_BACKEND", "local").lower()
+    if backend_name in ("", "none", "off", "disabled"):
+        return None
+
+    with _store_lock:
+        if _store is None or _store.name != backend_name:
+            try:
+                _store = _create_store(backend_name)
+                logging.info(f"Checkpoint store initialized with '{backend_name}' backend")
+            except Exception as e:
+                logging.warning(f"Checkpoint store unavailable (continuing without it): {e}")
+                return None
+        return _store
+
+
+def _load_checkpoint(store, key, stage):
+    """Load a checkpoint, treating store failures as a missing checkpoint"""
+    try:
+        value = store.load(key, stage)
+    except Exception as e:
+        logging.warning(f"Checkpoint load failed for stage '{stage}' (running it again): {e}")
+        return None
+    if value is not None:
+        logging.info(f"Resuming stage '{stage}' from checkpoint")
+    return value
+
+
+def _save_checkpoint(store, key, stage, value):
+    """Save a checkpoint, logging and ignoring store failures"""
+    if not _is_checkpointable(value):
+        return
+    try:
+        store.save(key, stage, value)
+    except Exception as e:
+        logging.warning(f"Checkpoint save failed for stage '{stage}' (continuing without it): {e}")
+
+
+def checkpointed_stage(store, key, stage, func):
+    """Wrap a stage function so its output is restored from, or saved to, the checkpoint store"""
+    if store is None:
+        return func
+
+    def run(upstream):
+        value = _load_checkpoint(store, key, stage)
+        if value is None:
+            value = func(upstream)
+            _save_checkpoint(store, key, stage, value)
+        return value
+
+    return run
+
+
+def checkpointed_stage_async(store, key, stage, func):
+    """Async counterpart of checkpointed_stage for coroutine stage functions"""
+    if store is None:
+        return func
+
+    # Store reads and writes (disk, Blob) run in a worker thread so a slow backend
+    # does not stall the other stages and documents on the event loop
+    async def run(upstream):
+        value = await asyncio.to_thread(_load_checkpoint, store, key, stage)
+        if value is None:
+            value = await func(upstream)
+            await asyncio.to_thread(_save_checkpoint, store, key, stage, value)
+        return value
+
+    return run
+
+
+def clear_checkpoints(store, key):
+    """Remove checkpoints once a document has been fully processed"""
+    if store is None:
+        return
+    try:
+        store.clear(key)
+    except Exception as e:
+        logging.warning(f"Checkpoint cleanup failed (continuing without it): {e}")
@@ -3,16 +3,47 @@ Storage Manager Module
 Handles data persistence operations with Azure Cosmos DB
 """
 
+import asyncio
 import logging
-import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import azure.cosmos.cosmos_client as cosmos_client
-import azure.cosmos.exceptions as exceptions
 
+from modules.processors.layout_model import materialize_layout
+from modules.utils.lazy_imports import lazy_module
+from modules.utils.serialization import EncodedJson, encode_json
+from modules.utils.tracing import map_in_context, set_span_attribute, span
 
-def initialize_cosmos_client(endpoint, key):
+
+COSMOS_MAX_ITEM_BYTES = 2 * 1024 * 1024
+COSMOS_BATCH_MAX_OPERATIONS = 100
+COSMOS_PATCH_MAX_OPERATIONS = 10
+DEFAULT_BULK_CONCURRENCY = 8
+DEFAULT_QUERY_PAGE_SIZE = 100
+
+# Metadata fields of a processed document, for listings that don't need the layout content
+DOCUMENT_METADATA_FIELDS = ("id", "timestamp", "original_filename", "file_type", "processing_status")
+_FIELD_PATH_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+
+# Cosmos DB storage is optional; the SDK is loaded when a storage call first needs it
+cosmos_client = lazy_module("azure.cosmos.cosmos_client")
+exceptions = lazy_module("azure.cosmos.exceptions")
+
+# Resolved database/container handles per client, kept for the process lifetime
+_container_handles = {}
+_async_container_handles = {}
+_handles_lock = threading.Lock()
+# One lock per handle key so concurrent cold starts resolve it once instead of racing
+_resolve_locks = {}
+_async_resolve_locks = {}
+
+
+def initialize_cosmos_client(endpoint, key, transport=None):
     """Initialize and return a Cosmos DB client"""
-    return cosmos_client.CosmosClient(endpoint, key)
+    options = {"transport": transport} if transport is not None else {}
+    return cosmos_client.CosmosClient(endpoint, key, **options)
 
 
 def create_database_if_not_exists(client, database_name):
@@ -21,40 +52,120 @@ def create_database_if_not_exists(client, database_name):
         database = client.create_database_if_not_exists(id=database_name)
         logging.info(f"Database '{database_name}' ready")
         return database
+    except exceptions.CosmosResourceExistsError:
+        # Another caller created it between the SDK's read and create
+        return client.get_database_client(database_name)
     except exceptions.CosmosHttpResponseError as e:
         logging.error(f"Failed to create/access database: {e}")
         raise
 
 
-def create_container_if_not_exists(database, container_name, partition_key_path="/id"):
+def create_container_if_not_exists(database, container_name, partition_key_path="/id", default_ttl=None):
     """Create container if it doesn't exist"""
     try:
+        options = {}
+        if default_ttl is not None:
+            options["default_ttl"] = default_ttl
         container = database.create_container_if_not_exists(
             id=container_name,
             partition_key={"paths": [partition_key_path], "kind": "Hash"},
-            offer_throughput=400
+            offer_throughput=400,
+            **options
         )
         logging.info(f"Container '{container_name}' ready")
         return container
+    except exceptions.CosmosResourceExistsError:
+        # Another caller created it between the SDK's read and create
+        return database.get_container_client(container_name)
     except exceptions.CosmosHttpResponseError as e:
         logging.error(f"Failed to create/access container: {e}")
         raise
 
 
-def prepare_document_for_storage(layout_data, original_filename=None):
-    """Prepare the layout data for storage with metadata"""
-    document = {
+def get_container(client, database_name, container_name, partition_key_path="/id", default_ttl=None):
+    """
+    Return the container handle, creating the database and container only on the
+    first call per client so later invocations skip the control-plane round trips
+    """
+    key = (id(client), database_name, container_name)
+    with _handles_lock:
+        entry = _container_handles.get(key)
+        if entry and entry[0] is client:
+            return entry[1]
+        resolve_lock = _resolve_locks.setdefault(key, threading.Lock())
+
+    with resolve_lock:
+        with _handles_lock:
+            entry = _container_handles.get(key)
+            if entry and entry[0] is client:
+                return entry[1]
+        database = create_database_if_not_exists(client, database_name)
+        container = create_container_if_not_exists(database, container_name, partition_key_path, default_ttl)
+        with _handles_lock:
+            _container_handles[key] = (client, container)
+    return container
+
+
+async def get_container_async(client, database_name, container_name, partition_key_path="/id"):
+    """Return the container handle for the async client, resolving it once per client"""
+    key = (id(client), database_name, container_name)
+    entry = _async_container_handles.get(key)
+    if entry and entry[0] is client:
+        return entry[1]
+
+    async with _async_resolve_locks.setdefault(key, asyncio.Lock()):
+        entry = _async_container_handles.get(key)
+        if entry and entry[0] is client:
+            return entry[1]
+        database = await create_database_if_not_exists_async(client, database_name)
+        container = await create_container_if_not_exists_async(database, container_name, partition_key_path)
+        _async_container_handles[key] = (client, container)
+    return container
+
+
+def clear_container_handles():
+    """Forget cached database/container handles (e.g. after a container was deleted)"""
+    with _handles_lock:
+        _container_handles.clear()
+        _resolve_locks.clear()
+    _async_container_handles.clear()
+    _async_resolve_locks.clear()
+
+
+def document_metadata(layout_data, original_filename=None):
+    """Return the id and metadata fields stored with every processed document"""
+    return {
         "id": layout_data.get("id", f"doc_{int(datetime.now().timestamp())}"),
         "timestamp": datetime.now().isoformat(),
         "original_filename": original_filename or layout_data.get("original_filename", "unknown"),
         "file_type": layout_data.get("file_type", "pdf"),
-        "processing_status": "completed",
-        "content": layout_data
+        "processing_status": "completed"
     }
+
+
+def prepare_document_for_storage(layout_data, original_filename=None, encoded_content=None):
+    """
+    Prepare the layout data for storage with metadata. The layout is encoded once
+    (or the caller's EncodedJson is reused) for validation and the size check.
+    With a caller's EncodedJson the content stays encoded and store_document(_async)
+    sends those bytes as the request body; otherwise it is expanded into plain dicts
+    and lists for SDK calls (such as bulk upserts) that serialize the item themselves.
+    """
+    shared_encoding = encoded_content is not None
+    encoded_content = encoded_content or EncodedJson(layout_data)
+    document = document_metadata(layout_data, original_filename)
+    document["content"] = None
     
-    # Ensure all nested data is JSON serializable
+    # Encoding validates that all nested data is JSON serializable
     try:
-        json.dumps(document)
+        payload_bytes = encoded_content.size
+        document["content"] = encoded_content if shared_encoding else materialize_layout(layout_data)
+        set_span_attribute("payload_bytes", payload_bytes)
+        if payload_bytes > COSMOS_MAX_ITEM_BYTES:
+            logging.warning(
+                f"Document content is {payload_bytes} bytes, above the Cosmos DB item limit "
+                f"of {COSMOS_MAX_ITEM_BYTES} bytes"
+            )
     except (TypeError, ValueError) as e:
         logging.warning(f"Document contains non-serializable data: {e}")
         document["content"] = str(layout_data)
@@ -63,10 +174,98 @@ def prepare_document_for_storage(layout_data, original_filename=None):
     return document
 
 
+def charge_recorder():
+    """
+    Return (charges, response_hook); the hook appends each response's RU charge to charges.
+    Pass it per call: the client's last_response_headers are shared by concurrent requests.
+    """
+    charges = []
+
+    def record_charge(headers, _result):
+        charges.append(float(headers.get("x-ms-request-charge", 0) or 0))
+
+    return charges, record_charge
+
+
+def _encoded_body_options(document):
+    """
+    Return (body, request options) for create_item. When the content is an EncodedJson,
+    the SDK gets the metadata only (it needs the id and partition key) and a per-call
+    raw_request_hook swaps in the item spliced around the already-encoded content bytes.
+    """
+    encoded_content = document.get("content")
+    if not isinstance(encoded_content, EncodedJson):
+        return document, {}
+    metadata = {key: value for key, value in document.items() if key != "content"}
+    body = encode_json(metadata)[:-1] + b',"content":' + encoded_content.data + b"}"
+
+    def send_encoded_body(request):
+        request.http_request.set_bytes_body(body)
+
+    return dict(metadata, content=None), {"raw_request_hook": send_encoded_body}
+
+
 def store_document(container, document):
     """Store document in Cosmos DB container"""
     try:
-        stored_item = container.create_item(body=document)
+        charges, record_charge = charge_recorder()
+        body, options = _encoded_body_options(document)
+        with span("cosmos.create_item", container=container.id) as request_span:
+            stored_item = container.create_item(body=body, response_hook=record_charge, **options)
+            request_span.set_attribute("request_charge", sum(charges))
+        logging.info(f"Document stored successfully with ID: {stored_item['id']}")
+        return stored_item
+    except exceptions.CosmosHttpResponseError as e:
+        logging.error(f"Failed to store document: {e}")
+        raise
+
+
+def initialize_cosmos_client_async(endpoint, key, transport=None):
+    """Initialize and return an async Cosmos DB client"""
+    from azure.cosmos.aio import CosmosClient
+
+    options = {"transport": transport} if transport is not None else {}
+    return CosmosClient(endpoint, key, **options)
+
+
+async def create_database_if_not_exists_async(client, database_name):
+    """Create database if it doesn't exist using the async client"""
+    try:
+        database = await client.create_database_if_not_exists(id=database_name)
+        logging.info(f"Database '{database_name}' ready")
+        return database
+    except exceptions.CosmosResourceExistsError:
+        return client.get_database_client(database_name)
+    except exceptions.CosmosHttpResponseError as e:
+        logging.error(f"Failed to create/access database: {e}")
+        raise
+
+
+async def create_container_if_not_exists_async(database, container_name, partition_key_path="/id"):
+    """Create container if it doesn't exist using the async client"""
+    try:
+        container = await database.create_container_if_not_exists(
+            id=container_name,
+            partition_key={"paths": [partition_key_path], "kind": "Hash"},
+            offer_throughput=400
+        )
+        logging.info(f"Container '{container_name}' ready")
+        return container
+    except exceptions.CosmosResourceExistsError:
+        return database.get_container_client(container_name)
+    except exceptions.CosmosHttpResponseError as e:
+        logging.error(f"Failed to create/access container: {e}")
+        raise
+
+
+async def store_document_async(container, document):
+    """Store document in Cosmos DB container using the async client"""
+    try:
+        charges, record_charge = charge_recorder()
+        body, options = _encoded_body_options(document)
+        with span("cosmos.create_item", container=container.id) as request_span:
+            stored_item = await container.create_item(body=body, response_hook=record_charge, **options)
+            request_span.set_attribute("request_charge", sum(charges))
         logging.info(f"Document stored successfully with ID: {stored_item['id']}")
         return stored_item
     except exceptions.CosmosHttpResponseError as e:
@@ -91,40 +290,221 @@ def retrieve_document(container, document_id, partition_key=None):
         raise
 
 
-def query_documents(container, query, parameters=None):
-    """Query documents from Cosmos DB container"""
+def build_projection_query(fields=None, where=None, order_by=None):
+    """
+    Build a query that returns only the given fields (server-side projection), e.g.
+    build_projection_query(DOCUMENT_METADATA_FIELDS, where="c.file_type = @type").
+    Nested fields use dots ("storage_info.document_id") and come back under their last name.
+    """
+    if fields:
+        for field in fields:
+            if not _FIELD_PATH_PATTERN.match(field):
+                raise ValueError(f"Invalid projection field: {field!r}")
+        query = "SELECT " + ", ".join(f"c.{field}" for field in fields) + " FROM c"
+    else:
+        query = "SELECT * FROM c"
+    if where:
+        query += f" WHERE {where}"
+    if order_by:
+        query += f" ORDER BY {order_by}"
+    return query
+
+
+def iter_query_pages(container, query, parameters=None, max_item_count=None, continuation_token=None,
+                     partition_key=None):
+    """
+    Yield query results one page at a time as {"items", "continuation_token", "request_charge"}.
+    Only one page is held in memory; pass a page's continuation_token back in to resume.
+    Without partition_key the query fans out across partitions.
+    """
+    max_item_count = max_item_count or int(os.getenv("COSMOS_QUERY_PAGE_SIZE", DEFAULT_QUERY_PAGE_SIZE))
+    options = {"partition_key": partition_key} if partition_key is not None else {"enable_cross_partition_query": True}
+    charges, record_charge = charge_recorder()
     try:
-        items = list(container.query_items(
+        pager = container.query_items(
             query=query,
             parameters=parameters or [],
-            enable_cross_partition_query=True
-        ))
-        logging.info(f"Query returned {len(items)} documents")
-        return items
+            max_item_count=max_item_count,
+            response_hook=record_charge,
+            **options
+        ).by_page(continuation_token)
+        total_items = 0
+        total_charge = 0.0
+        while True:
+            with span("cosmos.query_page", container=container.id) as request_span:
+                charges.clear()
+                page = next(pager, None)
+                if page is None:
+                    break
+                items = list(page)
+                request_charge = sum(charges)
+                request_span.set_attribute("request_charge", request_charge)
+                request_span.set_attribute("items", len(items))
+            total_items += len(items)
+            total_charge += request_charge
+            yield {"items": items, "continuation_token": pager.continuation_token, "request_charge": request_charge}
+        logging.info(f"Query returned {total_items} documents ({round(total_charge, 2)} RU)")
     except exceptions.CosmosHttpResponseError as e:
         logging.error(f"Failed to query documents: {e}")
         raise
 
 
-def update_document(container, document_id, updates, partition_key=None):
-    """Update an existing document in Cosmos DB"""
+def iter_query_items(container, query, parameters=None, max_item_count=None, partition_key=None):
+    """Yield query results one item at a time, fetching pages as they are needed"""
+    for page in iter_query_pages(container, query, parameters, max_item_count, partition_key=partition_key):
+        yield from page["items"]
+
+
+def query_documents(container, query, parameters=None):
+    """Query documents from Cosmos DB container (all results in memory; prefer iter_query_items for large results)"""
+    return list(iter_query_items(container, query, parameters))
+
+
+def _partition_key_value(document, partition_key_path):
+    """Return the value at the partition key path (e.g. "/id") of a document"""
+    value = document
+    for part in partition_key_path.strip("/").split("/"):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def _upsert_group(container, partition_key, documents):
+    """
+    Upsert documents sharing one partition key, as transactional batches when there
+    are several; a batch that fails (e.g. over the 2 MB batch limit) is retried item by item
+    """
+    charges, record_charge = charge_recorder()
+    failures = []
+
+    def upsert_items(items):
+        for document in items:
+            try:
+                container.upsert_item(body=document, response_hook=record_charge)
+            except exceptions.CosmosHttpResponseError as e:
+                failures.append((document.get("id"), str(e)))
+
+    for start in range(0, len(documents), COSMOS_BATCH_MAX_OPERATIONS):
+        chunk = documents[start:start + COSMOS_BATCH_MAX_OPERATIONS]
+        if len(chunk) == 1:
+            upsert_items(chunk)
+            continue
+        try:
+            container.execute_item_batch(
+                batch_operations=[("upsert", (document,)) for document in chunk],
+                partition_key=partition_key,
+                response_hook=record_charge
+            )
+        except (exceptions.CosmosBatchOperationError, exceptions.CosmosHttpResponseError) as e:
+            logging.warning(f"Batch of {len(chunk)} documents failed ({e}), upserting them one by one")
+            upsert_items(chunk)
+    return len(documents) - len(failures), failures, sum(charges)
+
+
+def upsert_documents(container, documents, partition_key_path="/id", max_concurrency=None):
+    """
+    Bulk upsert for backfills: documents are grouped by partition key, written as
+    transactional batches per partition and the partitions run concurrently.
+    Returns {"upserted", "failed": [(id, error)], "request_charge"}; failures do not stop the run.
+    """
+    groups = {}
+    for document in documents:
+        groups.setdefault(_partition_key_value(document, partition_key_path), []).append(document)
+    max_concurrency = max_concurrency or int(os.getenv("COSMOS_BULK_CONCURRENCY", DEFAULT_BULK_CONCURRENCY))
+
+    with span("cosmos.bulk_upsert", container=container.id, documents=len(documents)) as request_span:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(groups) or 1))) as executor:
+            results = map_in_context(
+                executor, lambda group: _upsert_group(container, group[0], group[1]), list(groups.items())
+            )
+        summary = {
+            "upserted": sum(result[0] for result in results),
+            "failed": [failure for result in results for failure in result[1]],
+            "request_charge": round(sum(result[2] for result in results), 2)
+        }
+        request_span.set_attribute("request_charge", summary["request_charge"])
+
+    logging.info(
+        f"Bulk upsert: {summary['upserted']} of {len(documents)} documents in {len(groups)} partitions, "
+        f"{summary['request_charge']} RU, {len(summary['failed'])} failed"
+    )
+    return summary
+
+
+def _patch_path(field):
+    """JSON Pointer path for a top-level field"""
+    return "/" + str(field).replace("~", "~0").replace("/", "~1")
+
+
+def _patch_in_batch(container, document_id, partition_key, operations, etag=None, response_hook=None):
+    """
+    Apply more patch operations than one patch request allows as several patch
+    operations in one transactional batch, so either all of them apply or none do
+    """
+    chunks = [
+        operations[start:start + COSMOS_PATCH_MAX_OPERATIONS]
+        for start in range(0, len(operations), COSMOS_PATCH_MAX_OPERATIONS)
+    ]
+    if len(chunks) > COSMOS_BATCH_MAX_OPERATIONS:
+        raise ValueError(
+            f"An update can set at most {COSMOS_BATCH_MAX_OPERATIONS * COSMOS_PATCH_MAX_OPERATIONS - 1} fields"
+        )
+    batch_operations = [("patch", (document_id, chunk)) for chunk in chunks]
+    if etag:
+        batch_operations[0] = ("patch", (document_id, chunks[0]), {"if_match_etag": etag})
+    results = container.execute_item_batch(
+        batch_operations=batch_operations,
+        partition_key=partition_key,
+        response_hook=response_hook
+    )
+    return results[-1].get("resourceBody")
+
+
+def update_document(container, document_id, updates, partition_key=None, etag=None):
+    """
+    Update top-level fields of an existing document with partial-document patch
+    operations, applied atomically. With etag, the update fails if the document
+    changed since it was read (CosmosAccessConditionFailedError, or a status-412
+    CosmosBatchOperationError when more than 10 operations went as one batch).
+    """
+    from azure.core import MatchConditions
+
+    if partition_key is None:
+        partition_key = document_id
+
+    operations = [{"op": "set", "path": _patch_path(field), "value": value} for field, value in updates.items()]
+    operations.append({"op": "set", "path": "/last_updated", "value": datetime.now().isoformat()})
+    charges, record_charge = charge_recorder()
+
     try:
-        if partition_key is None:
-            partition_key = document_id
-            
-        # First retrieve the existing document
-        existing_doc = retrieve_document(container, document_id, partition_key)
-        if not existing_doc:
-            raise ValueError(f"Document {document_id} not found for update")
-        
-        # Apply updates
-        existing_doc.update(updates)
-        existing_doc["last_updated"] = datetime.now().isoformat()
-        
-        # Replace the document
-        updated_item = container.replace_item(item=document_id, body=existing_doc)
+        with span("cosmos.patch_item", container=container.id, operations=len(operations)) as request_span:
+            if len(operations) <= COSMOS_PATCH_MAX_OPERATIONS:
+                options = {"etag": etag, "match_condition": MatchConditions.IfNotModified} if etag else {}
+                updated_item = container.patch_item(
+                    item=document_id,
+                    partition_key=partition_key,
+                    patch_operations=operations,
+                    response_hook=record_charge,
+                    **options
+                )
+            else:
+                # A patch request carries at most 10 operations; a batch keeps the chunks atomic
+                updated_item = _patch_in_batch(container, document_id, partition_key, operations, etag, record_charge)
+            request_span.set_attribute("request_charge", sum(charges))
         logging.info(f"Document updated successfully: {document_id}")
         return updated_item
+    except exceptions.CosmosBatchOperationError as e:
+        if e.status_code == 404:
+            raise ValueError(f"Document {document_id} not found for update")
+        if e.status_code == 412:
+            logging.warning(f"Document {document_id} was modified concurrently (ETag mismatch), update not applied")
+        else:
+            logging.error(f"Failed to update document (no fields were changed): {e}")
+        raise
+    except exceptions.CosmosResourceNotFoundError:
+        raise ValueError(f"Document {document_id} not found for update")
+    except exceptions.CosmosAccessConditionFailedError:
+        logging.warning(f"Document {document_id} was modified concurrently (ETag mismatch), update not applied")
+        raise
     except exceptions.CosmosHttpResponseError as e:
         logging.error(f"Failed to update document: {e}")
         raise
@@ -0,0 +1,184 @@
+"""
+Document Source Module
+Decides whether a triggering blob is submitted as bytes or by SAS URL reference
+"""
+
+import logging
+import hashlib
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+
+DEFAULT_BY_REFERENCE_MIN_BYTES = 4 * 1024 * 1024
+DEFAULT_SAS_EXPIRY_MINUTES = 30
+HASH_CHUNK_BYTES = 1024 * 1024
+PAGE_COUNT_PROBE_BYTES = 256 * 1024
+
+_LINEARIZED_PAGE_COUNT = re.compile(rb"/Linearized\b[^>]*?/N\s+(\d+)", re.S)
+_PAGE_TREE_NODE = re.compile(rb"/Type\s*/Pages\b")
+_PAGE_COUNT = re.compile(rb"/Count\s+(\d+)")
+
+
+class DocumentSource:
+    """A document to analyze, held in memory as bytes or referenced by a read-only SAS URL"""
+
+    def __init__(self, blob_name, content=None, url=None, size=None, content_sha256=None, content_id=None):
+        self.blob_name = blob_name
+        self.content = content
+        self.url = url
+        self.size = size if size is not None else (len(content) if content is not None else None)
+        self.content_sha256 = content_sha256 or (
+            hashlib.sha256(content).hexdigest() if content is not None else None
+        )
+        # Content-derived identity for cache keys: the SHA-256 of the bytes, or a
+        # referenced blob's Content-MD5 so it does not have to be read
+        self.content_id = content_id or self.content_sha256
+
+    @property
+    def by_reference(self):
+        """True when services fetch the document themselves from its SAS URL"""
+        return self.content is None and self.url is not None
+
+    def describe(self):
+        """Return a short description for logs"""
+        mode = "SAS URL reference" if self.by_reference else "in-memory bytes"
+        return f"{self.blob_name} ({self.size or 'unknown'} bytes, {mode})"
+
+
+def _parse_connection_string(connection_string):
+    """Split a storage connection string into its key/value settings"""
+    settings = {}
+    for part in (connection_string or "").split(";"):
+        if "=" in part:
+            key, value = part.split("=", 1)
+            settings[key] = value
+    return settings
+
+
+def generate_blob_sas_url(blob_uri, blob_path, connection_setting="invoicecontosostorage_STORAGE"):
+    """Generate a short-lived read-only SAS URL for a blob, or None when no account key is configured"""
+    settings = _parse_connection_string(os.getenv(connection_setting))
+    account_name = settings.get("AccountName")
+    account_key = settings.get("AccountKey")
+    if not blob_uri or not account_name or not account_key or "/" not in blob_path:
+        return None
+
+    from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+
+    container_name, blob_name = blob_path.split("/", 1)
+    expiry_minutes = int(os.getenv("BLOB_SAS_EXPIRY_MINUTES", DEFAULT_SAS_EXPIRY_MINUTES))
+    sas_token = generate_blob_sas(
+        account_name=account_name,
+        container_name=container_name,
+        blob_name=blob_name,
+        account_key=account_key,
+        permission=BlobSasPermissions(read=True),
+        expiry=datetime.now(timezone.utc) + timedelta(minutes=expiry_minutes)
+    )
+    return f"{blob_uri.split('?', 1)[0]}?{sas_token}"
+
+
+def _hash_stream(stream):
+    """Hash a file-like object in fixed-size chunks without holding it in memory"""
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = stream.read(HASH_CHUNK_BYTES)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def blob_content_id(myblob):
+    """
+    Return an identity derived from a blob's content (its Content-MD5), or None. The ETag
+    is not used: it changes per blob and upload, so the same PDF would never share a cache
+    entry; it only versions the checkpoint key.
+    """
+    try:
+        properties = getattr(myblob, "blob_properties", None) or {}
+    except Exception:
+        properties = {}
+    content_md5 = properties.get("ContentMD5") or properties.get("Content-MD5")
+    return f"md5:{content_md5}" if content_md5 else None
+
+
+def _page_count_hints(data):
+    """Return every page count visible in PDF bytes: the linearization /N and each root page tree /Count"""
+    counts = [int(match.group(1)) for match in _LINEARIZED_PAGE_COUNT.finditer(data)]
+    for node in _PAGE_TREE_NODE.finditer(data):
+        start = data.rfind(b" obj", 0, node.start())
+        end = data.find(b"endobj", node.end())
+        if start < 0 or end < 0:
+            continue
+        body = data[start:end]
+        # Only the root of the page tree (no /Parent) counts every page
+        count = _PAGE_COUNT.search(body)
+        if count and b"/Parent" not in body:
+            counts.append(int(count.group(1)))
+    return counts
+
+
+def probe_pdf_page_count(url, session=None):
+    """
+    Find a referenced PDF's page count from ranged reads of its tail and head, without
+    downloading it. The tail holds the newest xref section, so it is read first; an
+    incrementally updated PDF can still carry a stale count in its head, so when the
+    counts seen disagree the document is treated as unknown. Returns 0 when the count
+    is unknown or not visible (for example when the page tree sits in an object stream).
+    """
+    import requests
+
+    http = session or requests
+    counts = []
+    for byte_range in (f"bytes=-{PAGE_COUNT_PROBE_BYTES}", f"bytes=0-{PAGE_COUNT_PROBE_BYTES - 1}"):
+        try:
+            with http.get(url, headers={"Range": byte_range}, stream=True, timeout=30) as response:
+                response.raise_for_status()
+                # A server ignoring Range sends the whole blob; read no more than was asked for
+                data = b""
+                for chunk in response.iter_content(HASH_CHUNK_BYTES):
+                    data += chunk
+                    if len(data) >= PAGE_COUNT_PROBE_BYTES:
+                        break
+        except Exception as e:
+            logging.warning(f"Could not probe the PDF page count by ranged read: {e}")
+            return 0
+        counts.extend(_page_count_hints(data[:PAGE_COUNT_PROBE_BYTES]))
+    if len(set(counts)) > 1:
+        logging.warning(f"Referenced PDF reports conflicting page counts {sorted(set(counts))}, not sharding it")
+        return 0
+    return counts[0] if counts else 0
+
+
+def open_document_source(myblob):
+    """
+    Build the DocumentSource for a triggering blob. DOCUMENT_SUBMISSION_MODE is
+    "bytes" (always read), "url" (always reference) or "auto" (default: reference
+    blobs of at least BY_REFERENCE_MIN_BYTES). Falls back to bytes when no SAS can be made.
+    Referenced blobs are identified by their Content-MD5; without one the payload is
+    streamed through SHA-256 (never held in memory) so the result cache can still dedupe it.
+    """
+    mode = os.getenv("DOCUMENT_SUBMISSION_MODE", "auto").lower()
+    threshold = int(os.getenv("BY_REFERENCE_MIN_BYTES", DEFAULT_BY_REFERENCE_MIN_BYTES))
+    size = getattr(myblob, "length", None)
+
+    wants_reference = mode == "url" or (mode == "auto" and size is not None and size >= threshold)
+    if wants_reference:
+        try:
+            sas_url = generate_blob_sas_url(getattr(myblob, "uri", None), myblob.name)
+        except Exception as e:
+            logging.warning(f"Could not create SAS URL for {myblob.name} (submitting bytes): {e}")
+            sas_url = None
+        if sas_url:
+            content_id = blob_content_id(myblob)
+            if content_id:
+                return DocumentSource(myblob.name, url=sas_url, size=size, content_id=content_id)
+            content_sha256, streamed_size = _hash_stream(myblob)
+            return DocumentSource(myblob.name, url=sas_url, size=size or streamed_size, content_sha256=content_sha256)
+        logging.info(f"No SAS URL available for {myblob.name}, submitting bytes")
+
+    return DocumentSource(myblob.name, content=myblob.read())
@@ -0,0 +1,286 @@
+"""
+Paged Layout Storage Module
+Stores a document in Cosmos DB as a header item plus one item per page group, partitioned by document id
+"""
+
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from modules.processors.layout_model import materialize_layout
+from modules.storage.cosmos_manager import (
+    COSMOS_MAX_ITEM_BYTES,
+    DEFAULT_BULK_CONCURRENCY,
+    charge_recorder,
+    document_metadata,
+    exceptions,
+    iter_query_items
+)
+from modules.utils.serialization import EncodedJson
+from modules.utils.tracing import map_in_context, span
+
+
+STORAGE_LAYOUT_SINGLE = "single"
+STORAGE_LAYOUT_PAGED = "paged"
+
+PAGED_PARTITION_KEY_PATH = "/document_id"
+DEFAULT_PAGED_CONTAINER = "ProcessedDocumentPages"
+DEFAULT_PAGES_PER_ITEM = 1
+
+ITEM_TYPE_HEADER = "header"
+ITEM_TYPE_PAGES = "pages"
+ITEM_TYPE_SECTION = "section"
+
+
+def get_storage_layout():
+    """Return COSMOS_STORAGE_LAYOUT: "single" (one item per document, default) or "paged" """
+    layout = os.getenv("COSMOS_STORAGE_LAYOUT", STORAGE_LAYOUT_SINGLE).lower()
+    return layout if layout in (STORAGE_LAYOUT_SINGLE, STORAGE_LAYOUT_PAGED) else STORAGE_LAYOUT_SINGLE
+
+
+def get_paged_container_name():
+    """Return the container that holds paged documents"""
+    return os.getenv("COSMOS_PAGED_CONTAINER", DEFAULT_PAGED_CONTAINER)
+
+
+def _pages_per_item():
+    """Return how many pages are stored in one page item"""
+    return max(1, int(os.getenv("COSMOS_PAGES_PER_ITEM", DEFAULT_PAGES_PER_ITEM)))
+
+
+def _first_page_of_group(page_number, pages_per_item):
+    """Return the first page number of the page item that holds page_number"""
+    return (page_number - 1) // pages_per_item * pages_per_item + 1
+
+
+def page_item_id(document_id, first_page):
+    """Item id of the page item starting at first_page"""
+    return f"{document_id}:pages:{first_page:05d}"
+
+
+def section_item_id(document_id, name):
+    """Item id of a top-level section (e.g. vision_analysis)"""
+    return f"{document_id}:section:{name}"
+
+
+def _encoded_item(item):
+    """Return the plain dict/list copy of an item, warning when it exceeds the Cosmos item limit"""
+    encoded = EncodedJson(item)
+    if encoded.size > COSMOS_MAX_ITEM_BYTES:
+        logging.warning(
+            f"Item {item['id']} is {encoded.size} bytes, above the Cosmos DB item limit of "
+            f"{COSMOS_MAX_ITEM_BYTES} bytes; lower COSMOS_PAGES_PER_ITEM"
+        )
+    return materialize_layout(item)
+
+
+def prepare_paged_items(layout_data, original_filename=None, pages_per_item=None):
+    """
+    Split the layout into a header item, page items and section items. Dict/list
+    top-level values (vision_analysis, llm_analysis, ...) become section items;
+    scalar values stay in the header. Returns (header, items).
+    """
+    pages_per_item = pages_per_item or _pages_per_item()
+    header = document_metadata(layout_data, original_filename)
+    document_id = header["id"]
+
+    groups = {}
+    for page in layout_data.get("pages", []):
+        groups.setdefault(_first_page_of_group(page["page_number"], pages_per_item), []).append(page)
+
+    items = []
+    page_items = []
+    for first_page, pages in sorted(groups.items()):
+        item_id = page_item_id(document_id, first_page)
+        page_items.append({"id": item_id, "first_page": first_page, "last_page": pages[-1]["page_number"]})
+        items.append(_encoded_item({
+            "id": item_id,
+            "document_id": document_id,
+            "item_type": ITEM_TYPE_PAGES,
+            "first_page": first_page,
+            "last_page": pages[-1]["page_number"],
+            "pages": pages
+        }))
+
+    scalars = {}
+    sections = []
+    for name, value in layout_data.items():
+        if name in ("id", "pages"):
+            continue
+        if isinstance(value, (dict, list)):
+            sections.append(name)
+            items.append(_encoded_item({
+                "id": section_item_id(document_id, name),
+                "document_id": document_id,
+                "item_type": ITEM_TYPE_SECTION,
+                "name": name,
+                "value": value
+            }))
+        else:
+            scalars[name] = value
+
+    header.update({
+        "document_id": document_id,
+        "item_type": ITEM_TYPE_HEADER,
+        "storage_layout": STORAGE_LAYOUT_PAGED,
+        "page_count": sum(len(pages) for pages in groups.values()),
+        "pages_per_item": pages_per_item,
+        "page_items": page_items,
+        "sections": sections,
+        "content": scalars
+    })
+    return _encoded_item(header), items
+
+
+def store_paged_document(container, layout_data, original_filename=None, pages_per_item=None, max_concurrency=None):
+    """
+    Upsert the page and section items concurrently, then the header. The header is
+    written last so a reader that finds it can also find every item it lists.
+    """
+    header, items = prepare_paged_items(layout_data, original_filename, pages_per_item)
+    max_concurrency = max_concurrency or int(os.getenv("COSMOS_BULK_CONCURRENCY", DEFAULT_BULK_CONCURRENCY))
+    charges, record_charge = charge_recorder()
+
+    def upsert(item):
+        container.upsert_item(body=item, response_hook=record_charge)
+
+    try:
+        with span("cosmos.store_paged", container=container.id, items=len(items) + 1) as request_span:
+            with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(items) or 1))) as executor:
+                map_in_context(executor, upsert, items)
+            stored_header = container.upsert_item(body=header, response_hook=record_charge)
+            request_span.set_attribute("request_charge", round(sum(charges), 2))
+        logging.info(
+            f"Paged document stored with ID: {stored_header['id']} "
+            f"({header['page_count']} pages in {len(header['page_items'])} page items, "
+            f"{len(header['sections'])} sections, {round(sum(charges), 2)} RU)"
+        )
+        return stored_header
+    except exceptions.CosmosHttpResponseError as e:
+        logging.error(f"Failed to store paged document: {e}")
+        raise
+
+
+async def store_paged_document_async(container, layout_data, original_filename=None, pages_per_item=None,
+                                     max_concurrency=None):
+    """Async version of store_paged_document for the aio Cosmos client"""
+    header, items = prepare_paged_items(layout_data, original_filename, pages_per_item)
+    semaphore = asyncio.Semaphore(max_concurrency or int(os.getenv("COSMOS_BULK_CONCURRENCY", DEFAULT_BULK_CONCURRENCY)))
+    charges, record_charge = charge_recorder()
+
+    async def upsert(item):
+        async with semaphore:
+            await container.upsert_item(body=item, response_hook=record_charge)
+
+    try:
+        with span("cosmos.store_paged", container=container.id, items=len(items) + 1) as request_span:
+            await asyncio.gather(*(upsert(item) for item in items))
+            stored_header = await container.upsert_item(body=header, response_hook=record_charge)
+            request_span.set_attribute("request_charge", round(sum(charges), 2))
+        logging.info(
+            f"Paged document stored with ID: {stored_header['id']} "
+            f"({header['page_count']} pages, {round(sum(charges), 2)} RU)"
+        )
+        return stored_header
+    except exceptions.CosmosHttpResponseError as e:
+        logging.error(f"Failed to store paged document: {e}")
+        raise
+
+
+def read_document_header(container, document_id):
+    """Point-read the header item of a paged document"""
+    try:
+        return container.read_item(item=document_id, partition_key=document_id)
+    except exceptions.CosmosResourceNotFoundError:
+        logging.warning(f"Paged document not found: {document_id}")
+        return None
+
+
+def read_document_page(container, document_id, page_number, pages_per_item=None):
+    """
+    Point-read one page. The item id is derived from the page number, so with
+    pages_per_item known this is a single read; otherwise the header is read first.
+    """
+    if pages_per_item is None:
+        header = read_document_header(container, document_id)
+        if header is None:
+            return None
+        pages_per_item = header["pages_per_item"]
+
+    item_id = page_item_id(document_id, _first_page_of_group(page_number, pages_per_item))
+    try:
+        item = container.read_item(item=item_id, partition_key=document_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+    return next((page for page in item["pages"] if page["page_number"] == page_number), None)
+
+
+def query_document_pages(container, document_id, first_page=1, last_page=None):
+    """Yield the pages of a page range in order, with a single-partition query"""
+    query = (
+        "SELECT * FROM c WHERE c.document_id = @document_id AND c.item_type = @item_type "
+        "AND c.last_page >= @first_page"
+    )
+    parameters = [
+        {"name": "@document_id", "value": document_id},
+        {"name": "@item_type", "value": ITEM_TYPE_PAGES},
+        {"name": "@first_page", "value": first_page}
+    ]
+    if last_page is not None:
+        query += " AND c.first_page <= @last_page"
+        parameters.append({"name": "@last_page", "value": last_page})
+    query += " ORDER BY c.first_page"
+
+    for item in iter_query_items(container, query, parameters, partition_key=document_id):
+        for page in item["pages"]:
+            if page["page_number"] >= first_page and (last_page is None or page["page_number"] <= last_page):
+                yield page
+
+
+class PagedDocument:
+    """A stored paged document; pages and sections are read only when accessed"""
+
+    def __init__(self, container, header):
+        self.container = container
+        self.header = header
+        self._sections = {}
+
+    @property
+    def document_id(self):
+        return self.header["document_id"]
+
+    @property
+    def page_count(self):
+        return self.header["page_count"]
+
+    def page(self, page_number):
+        """Return one page with a single point read"""
+        return read_document_page(self.container, self.document_id, page_number, self.header["pages_per_item"])
+
+    def iter_pages(self, first_page=1, last_page=None):
+        """Yield the pages of a range, fetching page items as the iteration reaches them"""
+        return query_document_pages(self.container, self.document_id, first_page, last_page)
+
+    def section(self, name):
+        """Return a top-level section (e.g. "llm_analysis"), read once and then cached"""
+        if name not in self._sections:
+            if name not in self.header["sections"]:
+                raise KeyError(name)
+            item = self.container.read_item(item=section_item_id(self.document_id, name), partition_key=self.document_id)
+            self._sections[name] = item["value"]
+        return self._sections[name]
+
+    def to_layout_data(self):
+        """Reassemble the full layout_data dict (reads every item)"""
+        layout_data = {"id": self.document_id, **self.header["content"]}
+        for name in self.header["sections"]:
+            layout_data[name] = self.section(name)
+        layout_data["pages"] = list(self.iter_pages())
+        return layout_data
+
+
+def load_paged_document(container, document_id):
+    """Return a PagedDocument for lazy access, or None when the document does not exist"""
+    header = read_document_header(container, document_id)
+    return PagedDocument(container, header) if header else None
@@ -0,0 +1,280 @@
+"""
+Result Cache Module
+Content-addressed cache for Document Intelligence layout results
+"""
+
+import logging
+import hashlib
+import os
+import copy
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from modules.utils.serialization import decode_json, encode_json
+
+
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL_SECONDS = 7 * 24 * 3600
+
+
+def compute_cache_key(file_bytes=None, model_id="prebuilt-layout", content_sha256=None):
+    """Compute a content-addressed cache key from the SHA-256 of the blob bytes (or another content identity) and the model id"""
+    if content_sha256 is None:
+        content_sha256 = hashlib.sha256(file_bytes).hexdigest()
+    digest = hashlib.sha256()
+    digest.update(model_id.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(content_sha256.encode("ascii"))
+    return digest.hexdigest()
+
+
+class MemoryLRUBackend:
+    """In-process LRU backend with entry-count and TTL eviction"""
+
+    name = "memory"
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value or None when missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            created, value = entry
+            if self.ttl_seconds and time.time() - created > self.ttl_seconds:
+                del self._entries[key]
+                self.evictions += 1
+                return None
+            self._entries.move_to_end(key)
+            return copy.deepcopy(value)
+
+    def put(self, key, value):
+        """Store a value, evicting the least recently used entries"""
+        with self._lock:
+            self._entries[key] = (time.time(), copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def size(self):
+        """Return the number of cached entries"""
+        with self._lock:
+            return len(self._entries)
+
+
+class SQLiteBackend:
+    """Local disk backend stored in a SQLite database file"""
+
+    name = "sqlite"
+
+    def __init__(self, path, max_entries=DEFAULT_MAX_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS layout_cache ("
+            "cache_key TEXT PRIMARY KEY, payload TEXT NOT NULL, "
+            "created REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """Return the cached value or None when missing or expired"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT payload, created FROM layout_cache WHERE cache_key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            payload, created = row
+            now = time.time()
+            if self.ttl_seconds and now - created > self.ttl_seconds:
+                self._conn.execute("DELETE FROM layout_cache WHERE cache_key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                return None
+            self._conn.execute(
+                "UPDATE layout_cache SET last_access = ? WHERE cache_key = ?", (now, key)
+            )
+            self._conn.commit()
+        return decode_json(payload)
+
+    def put(self, key, value):
+        """Store a value, evicting expired and least recently used rows"""
+        payload = encode_json(value).decode("utf-8")
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO layout_cache (cache_key, payload, created, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                (key, payload, now, now)
+            )
+            if self.ttl_seconds:
+                cursor = self._conn.execute(
+                    "DELETE FROM layout_cache WHERE created < ?", (now - self.ttl_seconds,)
+                )
+                self.evictions += max(cursor.rowcount, 0)
+            cursor = self._conn.execute(
+                "DELETE FROM layout_cache WHERE cache_key IN ("
+                "SELECT cache_key FROM layout_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self.evictions += max(cursor.rowcount, 0)
+            self._conn.commit()
+
+    def size(self):
+        """Return the number of cached entries"""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM layout_cache").fetchone()[0]
+
+
+class CosmosBackend:
+    """Cosmos DB backend; eviction relies on the per-item ttl property"""
+
+    name = "cosmos"
+
+    def __init__(self, container, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.container = container
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value or None when missing"""
+        import azure.cosmos.exceptions as exceptions
+
+        try:
+            item = self.container.read_item(item=key, partition_key=key)
+        except exceptions.CosmosResourceNotFoundError:
+            return None
+        return decode_json(item["payload"])
+
+    def put(self, key, value):
+        """Upsert a value with the configured ttl"""
+        item = {
+            "id": key,
+            "payload": encode_json(value).decode("utf-8"),
+            "cached_at": time.time()
+        }
+        if self.ttl_seconds:
+            item["ttl"] = int(self.ttl_seconds)
+        self.container.upsert_item(body=item)
+
+    def size(self):
+        """Item counts are not tracked for the Cosmos backend"""
+        return None
+
+
+class LayoutResultCache:
+    """Cache front-end tracking hit/miss counters over a pluggable backend"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Look up a cached layout; backend failures count as misses"""
+        try:
+            value = self.backend.get(key)
+        except Exception as e:
+            logging.warning(f"Result cache lookup failed (treating as miss): {e}")
+            value = None
+            with self._lock:
+                self.errors += 1
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store a layout; backend failures are logged and ignored"""
+        try:
+            self.backend.put(key, value)
+        except Exception as e:
+            logging.warning(f"Result cache store failed (continuing without it): {e}")
+            with self._lock:
+                self.errors += 1
+
+    def stats(self):
+        """Return hit/miss counters and backend information"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": self.backend.name,
+                "hits": self.hits,
+                "misses": self.misses,
+                "errors": self.errors,
+                "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+                "evictions": getattr(self.backend, "evictions", 0),
+                "entries": self.backend.size()
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _create_backend(backend_name):
+    """Build the cache backend selected by environment variables"""
+    max_entries = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+    ttl_seconds = int(os.getenv("RESULT_CACHE_TTL_SECONDS", DEFAULT_TTL_SECONDS))
+
+    if backend_name == "memory":
+        return MemoryLRUBackend(max_entries=max_entries, ttl_seconds=ttl_seconds)
+    if backend_name == "sqlite":
+        path = os.getenv("RESULT_CACHE_SQLITE_PATH", "/tmp/layout_cache/layout_cache.db")
+        return SQLiteBackend(path, max_entries=max_entries, ttl_seconds=ttl_seconds)
+    if backend_name == "cosmos":
+        from modules.clients.client_registry import get_cosmos_client
+        from modules.storage.cosmos_manager import get_container
+        endpoint = os.getenv("COSMOS_DB_ENDPOINT")
+        key = os.getenv("COSMOS_DB_KEY")
+        if not endpoint or not key:
+            raise ValueError("Cosmos result cache requires COSMOS_DB_ENDPOINT and COSMOS_DB_KEY")
+        client = get_cosmos_client(endpoint, key)
+        container = get_container(
+            client,
+            "DocumentAnalysisDB",
+            os.getenv("RESULT_CACHE_COSMOS_CONTAINER", "LayoutResultCache"),
+            default_ttl=-1
+        )
+        return CosmosBackend(container, ttl_seconds=ttl_seconds)
+    raise ValueError(f"Unknown result cache backend: {backend_name}")
+
+
+def get_result_cache():
+    """Return the process-wide result cache, or None when caching is disabled"""
+    global _cache
+    backend_name = os.getenv("RESULT_CACHE_BACKEND", "memory").lower()
+    if backend_name in ("", "none", "off", "disabled"):
+        return None
+
+    with _cache_lock:
+        if _cache is None or _cache.backend.name != backend_name:
+            try:
+                _cache = LayoutResultCache(_create_backend(backend_name))
+                logging.info(f"Result cache initialized with '{backend_name}' backend")
+            except Exception as e:
+                logging.warning(f"Result cache unavailable (continuing without it): {e}")
+                return None
+        return _cache
@@ -0,0 +1,61 @@
+"""
+Lazy Imports Module
+Defers importing service SDKs until first use so cold starts only pay for the stages that run
+"""
+
+import importlib
+import importlib.util
+import threading
+import time
+
+from modules.utils.tracing import span
+
+
+_import_timings = {}
+_timings_lock = threading.Lock()
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access"""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def _load(self):
+        if self._module is None:
+            # The import is traced so its cost shows up inside the stage that needed it
+            with span("import", module=self._name):
+                start = time.perf_counter()
+                module = importlib.import_module(self._name)
+                elapsed_ms = round((time.perf_counter() - start) * 1000, 3)
+            with _timings_lock:
+                _import_timings.setdefault(self._name, elapsed_ms)
+            self._module = module
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self._name}' ({state})>"
+
+
+def lazy_module(name):
+    """Return a placeholder that imports module name the first time it is used"""
+    return LazyModule(name)
+
+
+def is_module_available(name):
+    """Return True when a module can be imported, without importing it"""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def get_import_timings():
+    """Return milliseconds spent on each lazy import in this process"""
+    with _timings_lock:
+        return dict(_import_timings)
@@ -0,0 +1,114 @@
+"""
+Log Policy Module
+Bounded, sampled logging of per-item and payload output with one summary record per stage
+"""
+
+import logging
+import json
+import os
+import threading
+from contextvars import ContextVar
+from itertools import islice
+
+
+LOG_LEVEL_SUMMARY = "summary"
+LOG_LEVEL_SAMPLED = "sampled"
+LOG_LEVEL_FULL = "full"
+LOG_LEVELS = (LOG_LEVEL_SUMMARY, LOG_LEVEL_SAMPLED, LOG_LEVEL_FULL)
+
+DEFAULT_LOG_LEVEL = LOG_LEVEL_SAMPLED
+DEFAULT_SAMPLE_ITEMS = 5
+DEFAULT_MAX_DOCUMENT_LOG_BYTES = 64 * 1024
+
+
+def get_log_detail_level():
+    """Return the configured LOG_DETAIL_LEVEL (summary, sampled or full)"""
+    level = os.getenv("LOG_DETAIL_LEVEL", DEFAULT_LOG_LEVEL).lower()
+    return level if level in LOG_LEVELS else DEFAULT_LOG_LEVEL
+
+
+def _sample_items():
+    """Return how many items are logged per list in sampled mode"""
+    return int(os.getenv("LOG_SAMPLE_ITEMS", DEFAULT_SAMPLE_ITEMS))
+
+
+class DocumentLogBudget:
+    """Caps the payload bytes one document may write to the log"""
+
+    def __init__(self, document_name, max_bytes):
+        self.document_name = document_name
+        self.max_bytes = max_bytes
+        self.used_bytes = 0
+        self.truncated_bytes = 0
+        self._lock = threading.Lock()
+
+    def take(self, text):
+        """Return text cut to the remaining budget, with a truncation marker when cut"""
+        data = text.encode("utf-8")
+        with self._lock:
+            remaining = max(0, self.max_bytes - self.used_bytes)
+            if len(data) <= remaining:
+                self.used_bytes += len(data)
+                return text
+            self.used_bytes += remaining
+            self.truncated_bytes += len(data) - remaining
+        kept = data[:remaining].decode("utf-8", errors="ignore")
+        return f"{kept}[... truncated {len(data) - remaining} bytes: log budget of {self.max_bytes} bytes per document reached ...]"
+
+
+_current_budget = ContextVar("document_log_budget", default=None)
+
+
+def start_document_logging(document_name):
+    """Start the log budget for one document; stages in the same context share it"""
+    max_bytes = int(os.getenv("LOG_MAX_DOCUMENT_BYTES", DEFAULT_MAX_DOCUMENT_LOG_BYTES))
+    budget = DocumentLogBudget(document_name, max_bytes)
+    _current_budget.set(budget)
+    return budget
+
+
+def get_document_log_budget():
+    """Return the log budget of the current document, if one was started"""
+    return _current_budget.get()
+
+
+def log_items(label, items, formatter=str, total=None):
+    """
+    Log items one per record: none in summary mode, the first LOG_SAMPLE_ITEMS in
+    sampled mode, all in full mode. items may be a generator; pass total for the marker.
+    """
+    level = get_log_detail_level()
+    if level == LOG_LEVEL_SUMMARY:
+        return
+    limit = None if level == LOG_LEVEL_FULL else _sample_items()
+    logged = 0
+    for item in islice(items, limit):
+        logging.info(f"{label} {logged}: {formatter(item)}")
+        logged += 1
+    if total is not None and total > logged:
+        logging.info(f"{label}: [... {total - logged} more not logged (LOG_DETAIL_LEVEL={level}) ...]")
+
+
+def log_payload(label, text):
+    """
+    Log a large payload. Summary mode logs only its size; sampled mode cuts it to
+    the document's remaining byte budget with a truncation marker; full mode logs it whole.
+    """
+    level = get_log_detail_level()
+    size = len(text.encode("utf-8"))
+    if level == LOG_LEVEL_SUMMARY:
+        logging.info(f"{label}: {size} bytes (payload not logged, LOG_DETAIL_LEVEL=summary)")
+        return
+    budget = get_document_log_budget()
+    if level == LOG_LEVEL_SAMPLED and budget is not None:
+        text = budget.take(text)
+    logging.info(f"{label}:\n{text}")
+
+
+def log_stage_summary(stage, **fields):
+    """Emit one structured summary record for a stage (counts, sizes, timings)"""
+    record = {"stage": stage, **fields}
+    budget = get_document_log_budget()
+    if budget is not None:
+        record["document"] = budget.document_name
+    logging.info(f"STAGE SUMMARY {json.dumps(record, default=str, separators=(',', ':'))}")
@@ -4,8 +4,11 @@ Utilities for consistent logging and formatting
 """
 
 import logging
+from contextlib import contextmanager
 from datetime import datetime
 
+from modules.utils.tracing import span
+
 
 def log_processing_step(step_name, details=None):
     """Log a processing step with consistent formatting"""
@@ -18,6 +21,14 @@ def log_processing_step(step_name, details=None):
     logging.info(separator)
 
 
+@contextmanager
+def processing_step(step_name, details=None, **attributes):
+    """Log a processing step and trace the block as a span; yields the span"""
+    log_processing_step(step_name, details)
+    with span(step_name, **attributes) as step_span:
+        yield step_span
+
+
 def format_timestamp(timestamp=None):
     """Format timestamp for logging and display"""
     if timestamp is None:
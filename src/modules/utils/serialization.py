@@ -0,0 +1,82 @@
+"""
+Serialization Helper Functions
+Encodes documents to JSON once, with orjson when available, for logging, size checks and storage
+"""
+
+import json
+import os
+
+from modules.processors.layout_model import layout_json_default
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def is_fast_encoder_enabled():
+    """Return True when orjson is installed and not disabled with JSON_FAST_ENCODER"""
+    return orjson is not None and os.getenv("JSON_FAST_ENCODER", "true").lower() not in ("0", "false", "no")
+
+
+def encode_json(value, indent=False):
+    """Encode a value (including compact layout objects) to UTF-8 JSON bytes"""
+    if is_fast_encoder_enabled():
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        try:
+            return orjson.dumps(value, default=layout_json_default, option=option)
+        except TypeError:
+            # orjson rejects a few values the standard library accepts (e.g. ints over 64 bits)
+            pass
+    return json.dumps(
+        value,
+        ensure_ascii=False,
+        indent=2 if indent else None,
+        separators=None if indent else (",", ":"),
+        default=layout_json_default
+    ).encode("utf-8")
+
+
+def decode_json(data):
+    """Decode JSON bytes or text"""
+    if is_fast_encoder_enabled():
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def is_pretty_logging_enabled():
+    """Return True when logged JSON should be indented (costs a second encode)"""
+    return os.getenv("LOG_JSON_PRETTY", "false").lower() in ("1", "true", "yes")
+
+
+class EncodedJson:
+    """A value together with its JSON encoding, produced on first use and then reused"""
+
+    __slots__ = ("value", "_data")
+
+    def __init__(self, value):
+        self.value = value
+        self._data = None
+
+    @property
+    def data(self):
+        """The compact UTF-8 JSON bytes"""
+        if self._data is None:
+            self._data = encode_json(self.value)
+        return self._data
+
+    @property
+    def size(self):
+        """Encoded size in bytes"""
+        return len(self.data)
+
+    @property
+    def text(self):
+        """The compact JSON as text"""
+        return self.data.decode("utf-8")
+
+    def log_text(self):
+        """Text for log output: the shared compact encoding, or an indented copy when requested"""
+        if is_pretty_logging_enabled():
+            return encode_json(self.value, indent=True).decode("utf-8")
+        return self.text
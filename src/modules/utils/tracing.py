@@ -0,0 +1,219 @@
+"""
+Tracing Module
+Context-manager spans and per-invocation metrics records for the blob pipeline
+"""
+
+import logging
+import contextvars
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+
+
+_current_trace = contextvars.ContextVar("pipeline_trace", default=None)
+_current_span = contextvars.ContextVar("pipeline_span", default=None)
+_otel_tracer = None
+_trace_listeners = []
+
+# Numeric span attributes with these suffixes are summed per stage in the metrics record
+SUMMED_ATTRIBUTE_SUFFIXES = ("_bytes", "_tokens", "_charge")
+
+
+def _export_mode():
+    """Return TRACE_EXPORT: "log" (JSON record per invocation, default), "otel" or "none" """
+    return os.getenv("TRACE_EXPORT", "log").lower()
+
+
+def _get_otel_tracer():
+    """Return an OpenTelemetry tracer when TRACE_EXPORT=otel and the API is installed"""
+    global _otel_tracer
+    if _export_mode() != "otel":
+        return None
+    if _otel_tracer is None:
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            logging.warning("TRACE_EXPORT=otel but opentelemetry-api is not installed; using the log exporter")
+            return None
+        _otel_tracer = trace.get_tracer("document-pipeline")
+    return _otel_tracer
+
+
+class Span:
+    """A timed operation with attributes, in the OpenTelemetry span shape"""
+
+    def __init__(self, trace, name, parent_id=None, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.status = "OK"
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms = None
+        self._otel_span = None
+
+    def set_attribute(self, key, value):
+        """Set or overwrite an attribute"""
+        self.attributes[key] = value
+        if self._otel_span is not None and isinstance(value, (str, bool, int, float)):
+            self._otel_span.set_attribute(key, value)
+
+    def add_attribute(self, key, value):
+        """Add a numeric value to an attribute (e.g. tokens over several calls)"""
+        self.set_attribute(key, self.attributes.get(key, 0) + value)
+
+    def end(self, error=None):
+        """Close the span and record it on its trace"""
+        self.duration_ms = round((time.perf_counter() - self._start) * 1000, 3)
+        if error is not None:
+            self.status = "ERROR"
+            self.attributes["error"] = str(error)
+        if self.trace is not None:
+            self.trace.record(self)
+
+    def to_dict(self):
+        """Serialize like an OTLP span"""
+        return {
+            "trace_id": self.trace.trace_id if self.trace else None,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": int(self.start_time * 1e9),
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "attributes": self.attributes
+        }
+
+
+class Trace:
+    """All spans recorded during one function invocation"""
+
+    def __init__(self, name, attributes=None):
+        self.trace_id = secrets.token_hex(16)
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def stage_metrics(self):
+        """Aggregate span durations and numeric attributes by span name"""
+        metrics = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            entry = metrics.setdefault(span.name, {"count": 0, "duration_ms": 0.0, "errors": 0})
+            entry["count"] += 1
+            entry["duration_ms"] = round(entry["duration_ms"] + span.duration_ms, 3)
+            entry["errors"] += span.status == "ERROR"
+            for key, value in span.attributes.items():
+                if key.endswith(SUMMED_ATTRIBUTE_SUFFIXES) and isinstance(value, (int, float)):
+                    entry[key] = round(entry.get(key, 0) + value, 3)
+        return metrics
+
+    def to_dict(self):
+        """Serialize the invocation as one metrics record"""
+        with self._lock:
+            spans = [span.to_dict() for span in self.spans]
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "attributes": self.attributes,
+            "stages": self.stage_metrics(),
+            "spans": spans
+        }
+
+
+def start_trace(name, **attributes):
+    """Start the trace for one invocation; spans opened in this context belong to it"""
+    trace = Trace(name, attributes)
+    _current_trace.set(trace)
+    _current_span.set(None)
+    return trace
+
+
+def get_current_trace():
+    """Return the trace of the current invocation, if one was started"""
+    return _current_trace.get()
+
+
+def current_span():
+    """Return the innermost open span, if any"""
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, **attributes):
+    """Time a block as a child of the current span; yields the Span for attributes"""
+    parent = _current_span.get()
+    current = Span(_current_trace.get(), name, parent.span_id if parent else None, attributes)
+    tracer = _get_otel_tracer()
+    otel_context = None
+    if tracer is not None:
+        otel_attributes = {
+            key: value for key, value in attributes.items() if isinstance(value, (str, bool, int, float))
+        }
+        otel_context = tracer.start_as_current_span(name, attributes=otel_attributes)
+        current._otel_span = otel_context.__enter__()
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        raise
+    else:
+        current.end()
+    finally:
+        _current_span.reset(token)
+        if otel_context is not None:
+            otel_context.__exit__(None, None, None)
+
+
+def set_span_attribute(key, value):
+    """Set an attribute on the current span, if any"""
+    current = _current_span.get()
+    if current is not None:
+        current.set_attribute(key, value)
+
+
+def add_trace_listener(listener):
+    """Register a callable that receives every finished Trace (e.g. a benchmark collector)"""
+    _trace_listeners.append(listener)
+
+
+def finish_trace(trace=None, error=None):
+    """
+    Export the invocation's metrics record (marked ERROR when error is given) and return
+    its per-stage summary. The trace is then detached so it cannot leak into the next
+    invocation that runs on this worker.
+    """
+    trace = trace or _current_trace.get()
+    if trace is None:
+        return {}
+    try:
+        trace.attributes["status"] = "ERROR" if error is not None else "OK"
+        if error is not None:
+            trace.attributes["error"] = f"{type(error).__name__}: {error}"
+        for listener in _trace_listeners:
+            listener(trace)
+        if _export_mode() == "log" or (_export_mode() == "otel" and _get_otel_tracer() is None):
+            logging.info(f"TRACE {json.dumps(trace.to_dict(), default=str, separators=(',', ':'))}")
+        return trace.stage_metrics()
+    finally:
+        if _current_trace.get() is trace:
+            _current_trace.set(None)
+            _current_span.set(None)
+
+
+def map_in_context(executor, func, items):
+    """Like executor.map, but each call runs in a copy of the caller's context so spans nest correctly"""
+    futures = [executor.submit(contextvars.copy_context().run, func, item) for item in items]
+    return [future.result() for future in futures]